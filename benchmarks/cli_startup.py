@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+"""
+Measure the start-up time of spiderpig-cli.py (the time to import the
+package, register commands and parse arguments) and the command modules
+imported on the way.
+
+    python benchmarks/cli_startup.py [REPEAT]
+"""
+from statistics import median
+from time import perf_counter
+import os
+import subprocess
+import sys
+import tempfile
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CLI = os.path.join(ROOT, 'spiderpig-cli.py')
+ENV = dict(os.environ, PYTHONPATH=os.pathsep.join([ROOT, os.environ.get('PYTHONPATH', '')]))
+SCENARIOS = [
+    ('python -c pass', ['-c', 'pass']),
+    ('import spiderpig', ['-c', 'import spiderpig']),
+    ('--help', [CLI, '--help']),
+    ('spiderpig-gc --help', [CLI, 'spiderpig-gc', '--help']),
+    ('spiderpig-sweep --help', [CLI, 'spiderpig-sweep', '--help']),
+]
+
+
+_LIST_MODULES = """
+import atexit, runpy, sys
+atexit.register(lambda: sys.stderr.write('\\n' + ' '.join(sys.modules) + '\\n'))
+sys.argv = sys.argv[1:]
+if len(sys.argv) > 0 and sys.argv[0] == '-c':
+    exec(sys.argv[1])
+else:
+    runpy.run_path(sys.argv[0], run_name='__main__')
+"""
+
+
+def command_modules(args, cwd):
+    """
+    Command modules imported when the process is run with the given
+    arguments.
+    """
+    result = subprocess.run([sys.executable, '-c', _LIST_MODULES] + args, cwd=cwd, env=ENV, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
+    imported = result.stderr.strip().splitlines()[-1].split()
+    return sorted(m.split('.')[-1] for m in imported if m.startswith('spiderpig.commands.common.'))
+
+
+def run(args, cwd):
+    subprocess.run([sys.executable] + args, cwd=cwd, env=ENV, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+
+
+def main(repeat):
+    with tempfile.TemporaryDirectory() as cwd:
+        for name, args in SCENARIOS:
+            # the first run writes the command manifest and bytecode
+            run(args, cwd)
+            spent = []
+            for _ in range(repeat):
+                started = perf_counter()
+                run(args, cwd)
+                spent.append(perf_counter() - started)
+            print('{:<25} {:>10.1f} ms   command modules imported: {}'.format(name, median(spent) * 1000, ', '.join(command_modules(args, cwd)) or '-'))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10)
@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+"""
+Measure the overhead of calling spiderpig decorated functions compared to
+calling the undecorated function.
+
+    python benchmarks/decorator_overhead.py [CALLS]
+"""
+from timeit import timeit
+import spiderpig
+import sys
+
+
+def plain(a=None, b=None):
+    return a
+
+
+@spiderpig.configured()
+def configured(a=None, b=None):
+    return a
+
+
+@spiderpig.configured(b=2)
+def configured_with_config(a=None, b=None):
+    return a
+
+
+@spiderpig.cached()
+def cached(a=None, b=None):
+    return a
+
+
+def main(calls):
+    with spiderpig.spiderpig(a=1, b=1):
+        baseline = timeit(lambda: plain(1, 1), number=calls) / calls
+        print('{:<30} {:>10.2f} us'.format('plain call', baseline * 10 ** 6))
+        for name, fun in [('@configured', configured), ('@configured(b=2)', configured_with_config), ('@cached (in-memory hit)', cached)]:
+            fun()
+            spent = timeit(fun, number=calls) / calls
+            print('{:<30} {:>10.2f} us (overhead {:.2f} us)'.format(name, spent * 10 ** 6, (spent - baseline) * 10 ** 6))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+"""
+Compare FileStorage and PackedFileStorage on many small results: time to
+store and read them, time to list them and the number of files they take.
+
+    python benchmarks/packed_storage.py [SIZE ...]
+"""
+from spiderpig.cache import FileStorage, StorageCacheProvider
+from spiderpig.execution import ExecutionContext
+from spiderpig.packed import PackedFileStorage
+from time import perf_counter
+import os
+import shutil
+import sys
+import tempfile
+
+
+def small(i):
+    return {'value': i, 'squared': i * i}
+
+
+def _count_files(directory):
+    return sum(len(files) for _, _, files in os.walk(directory))
+
+
+def _measure(storage_class, size):
+    directory = tempfile.mkdtemp()
+    try:
+        provider = StorageCacheProvider(storage=storage_class(directory))
+        provider.prepare()
+        context = ExecutionContext(cache_provider=provider)
+        time_before = perf_counter()
+        for i in range(size):
+            context.execute(small, i)
+        write = (perf_counter() - time_before) / size
+        provider.close()
+        # a new process reads the results
+        provider = StorageCacheProvider(storage=storage_class(directory))
+        context = ExecutionContext(cache_provider=provider)
+        time_before = perf_counter()
+        for i in range(size):
+            context.execute(small, i)
+        read = (perf_counter() - time_before) / size
+        time_before = perf_counter()
+        listed = sum(1 for _ in provider.storage.read_executions())
+        listing = perf_counter() - time_before
+        assert listed == size
+        return write, read, listing, _count_files(directory)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def main(sizes):
+    print('{:>10} {:>18} {:>12} {:>12} {:>12} {:>10}'.format('entries', 'storage', 'write [us]', 'read [us]', 'list [ms]', 'files'))
+    for size in sizes:
+        for storage_class in [FileStorage, PackedFileStorage]:
+            write, read, listing, files = _measure(storage_class, size)
+            print('{:>10} {:>18} {:>12.2f} {:>12.2f} {:>12.2f} {:>10}'.format(
+                size, storage_class.__name__, write * 10 ** 6, read * 10 ** 6, listing * 10 ** 3, files
+            ))
+
+
+if __name__ == '__main__':
+    main([int(size) for size in sys.argv[1:]] if len(sys.argv) > 1 else [1000, 10000])
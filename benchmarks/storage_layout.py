@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+"""
+Compare lookup latency of the flat and sharded FileStorage layouts depending
+on the number of executions of one function.
+
+    python benchmarks/storage_layout.py [SIZE ...]
+"""
+from spiderpig.cache import FileStorage
+from time import perf_counter
+import hashlib
+import random
+import shutil
+import sys
+import tempfile
+
+
+FUNCTION_NAME = 'benchmark.module.function'
+LOOKUPS = 2000
+
+
+class _Entry:
+
+    def __init__(self, name):
+        self.name = name
+
+
+def _populate(layout, size):
+    directory = tempfile.mkdtemp()
+    storage = FileStorage(directory)
+    storage.write_info(layout=layout)
+    storage = FileStorage(directory)
+    entries = [_Entry('{}.{}'.format(FUNCTION_NAME, hashlib.sha1(str(i).encode()).hexdigest())) for i in range(size)]
+    for entry in entries:
+        # files are only touched, writing them via the storage would
+        # measure fsync instead of lookups
+        for extension in ['execution.pickle', 'execution.info.pickle', 'execution.ready']:
+            open(storage._get_execution_filename(entry, extension, prepare=True), 'a').close()
+    return directory, storage, entries
+
+
+def _measure(storage, entries):
+    present = random.sample(entries, min(LOOKUPS, len(entries)))
+    missing = [_Entry('{}.{}'.format(FUNCTION_NAME, hashlib.sha1('missing{}'.format(i).encode()).hexdigest())) for i in range(LOOKUPS)]
+    time_before = perf_counter()
+    for entry in present:
+        assert storage.is_execution_ready(entry)
+    hit = (perf_counter() - time_before) / len(present)
+    time_before = perf_counter()
+    for entry in missing:
+        assert not storage.is_execution_ready(entry)
+    miss = (perf_counter() - time_before) / len(missing)
+    return hit, miss
+
+
+def main(sizes):
+    print('{:>10} {:>8} {:>12} {:>12}'.format('entries', 'layout', 'hit [us]', 'miss [us]'))
+    for size in sizes:
+        for layout, layout_name in [(FileStorage.LAYOUT_FLAT, 'flat'), (FileStorage.LAYOUT_SHARDED, 'sharded')]:
+            directory, storage, entries = _populate(layout, size)
+            try:
+                hit, miss = _measure(storage, entries)
+                print('{:>10} {:>8} {:>12.2f} {:>12.2f}'.format(size, layout_name, hit * 10 ** 6, miss * 10 ** 6))
+            finally:
+                shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main([int(size) for size in sys.argv[1:]] if len(sys.argv) > 1 else [1000, 10000, 100000])
@@ -1,13 +1,20 @@
 from . import cache
 from . import commands, config
 from . import execution
+from . import partition
+from . import profiling
+from . import resources
+from .resources import validate_resources
 from .exceptions import ValidationError, NotInitialized
 from .msg import Verbosity
 from contextlib import ContextDecorator
 from functools import wraps
 import argcomplete
 import json
+import os
+import sys
 import tempfile
+import weakref
 import yaml
 
 
@@ -17,6 +24,8 @@ __VERSION__ = '2.4.0-dev'
 _EXECUTION_CONTEXT = None
 _CACHE_PROVIDER = None
 _STORAGE = None
+_PREWARM = False
+_LOCK_REPORT = False
 
 
 class spiderpig(ContextDecorator):
@@ -51,7 +60,7 @@ class spiderpig(ContextDecorator):
     init
     """
 
-    def __init__(self, directory=None, override_cache=False, verbosity=Verbosity.INFO, max_in_memory_entries=1000, config_file=None, **global_kwargs):
+    def __init__(self, directory=None, override_cache=False, verbosity=Verbosity.INFO, max_in_memory_entries=1000, config_file=None, write_behind=False, remote_cache=None, cache_tiers=None, override_functions=None, max_in_memory_bytes=None, prewarm=False, shared_memory_bytes=None, packed_storage=False, host_resources=None, profile_functions=None, lock_report=False, **global_kwargs):
         """
         Initialize spiderpig for using it out of command-line tool.
 
@@ -69,6 +78,53 @@ class spiderpig(ContextDecorator):
         config_file: str
             path to the YAML/JSON file containing key-word parameters to
             override the global configuration
+        write_behind: bool, default False
+            True if the results should be persisted in a background thread,
+            so the caller does not wait until they are written to the storage
+        remote_cache: str
+            URL of the shared HTTP cache server (see spiderpig.remote) used when
+            the result is not available locally
+        cache_tiers: list
+            additional (slower) storage tiers consulted when the result is not
+            available in the given directory; each tier is given either as a
+            directory, or as a dictionary with keys 'directory', 'max_entries'
+            and 'write_policy' (see cache.StorageCacheProvider), or as a string
+            'DIRECTORY[,max_entries=N][,write_policy=POLICY]'
+        override_functions: list
+            names of functions (e.g., 'pkg.mod.fun') whose cached executions
+            (and executions depending on them) should be recomputed
+        max_in_memory_bytes: int
+            maximal (estimated) size of results in in-memory cache in bytes,
+            unlimited by default
+        prewarm: bool, default False
+            True if the working set saved by the last run (or the most
+            valuable stored results) should be loaded to in-memory cache in
+            the background; the working set is saved when spiderpig terminates
+        shared_memory_bytes: int
+            if given, large buffer-backed results (e.g., arrays) are kept in
+            shared memory of at most this size, so the processes on the same
+            host using the same directory share one copy of them (see
+            spiderpig.shm); it needs the cache directory
+        packed_storage: bool, default False
+            True if small results should be packed into segment files
+            instead of having files of their own (see spiderpig.packed);
+            caches which have been packed once are always opened packed
+        host_resources: dict
+            budget of resources (e.g., {'memory_gb': 64, 'cpu': 16}) of this
+            host shared by the processes using the directory, executions of
+            functions needing resources wait until they fit in it (see
+            spiderpig.resources); the physical memory and the number of CPUs
+            by default, the budget is used only if it is given or some
+            function has been decorated with resources before
+        profile_functions: list
+            patterns of names of functions (e.g., 'pkg.mod.*') whose
+            executions are computed under cProfile and tracemalloc; the
+            profiles are stored next to the executions (see
+            spiderpig.profiling and spiderpig-profiles)
+        lock_report: bool, default False
+            True if the time spent waiting for locks and the most contended
+            executions should be reported when spiderpig terminates (see
+            lock_statistics)
         global_kwargs: dict
             key-word arguments passed to spiderpig functions
         """
@@ -78,15 +134,33 @@ class spiderpig(ContextDecorator):
         self._max_in_memory_entries = max_in_memory_entries
         self._global_kwargs = global_kwargs
         self._config_file = config_file
+        self._write_behind = write_behind
+        self._remote_cache = remote_cache
+        self._cache_tiers = cache_tiers
+        self._override_functions = override_functions
+        self._max_in_memory_bytes = max_in_memory_bytes
+        self._prewarm = prewarm
+        self._shared_memory_bytes = shared_memory_bytes
+        self._packed_storage = packed_storage
+        self._host_resources = host_resources
+        self._profile_functions = profile_functions
+        self._lock_report = lock_report
 
     def __enter__(self):
-        init(self._directory, self._override_cache, self._verbosity, self._max_in_memory_entries, self._config_file, **self._global_kwargs)
+        init(
+            self._directory, self._override_cache, self._verbosity, self._max_in_memory_entries, self._config_file,
+            write_behind=self._write_behind, remote_cache=self._remote_cache, cache_tiers=self._cache_tiers,
+            override_functions=self._override_functions, max_in_memory_bytes=self._max_in_memory_bytes,
+            prewarm=self._prewarm, shared_memory_bytes=self._shared_memory_bytes, packed_storage=self._packed_storage,
+            host_resources=self._host_resources, profile_functions=self._profile_functions,
+            lock_report=self._lock_report, **self._global_kwargs
+        )
 
     def __exit__(self, *exc):
         terminate()
 
 
-def init(directory=None, override_cache=False, verbosity=Verbosity.INFO, max_in_memory_entries=1000, config_file=None, **global_kwargs):
+def init(directory=None, override_cache=False, verbosity=Verbosity.INFO, max_in_memory_entries=1000, config_file=None, write_behind=False, remote_cache=None, cache_tiers=None, override_functions=None, max_in_memory_bytes=None, prewarm=False, shared_memory_bytes=None, packed_storage=False, host_resources=None, profile_functions=None, lock_report=False, **global_kwargs):
     """
     Initialize spiderpig for using it out of command-line tool.
 
@@ -104,6 +178,53 @@ def init(directory=None, override_cache=False, verbosity=Verbosity.INFO, max_in_
     config_file: str
         path to the YAML/JSON file containing key-word parameters to
         override the global configuration
+    write_behind: bool, default False
+        True if the results should be persisted in a background thread,
+        so the caller does not wait until they are written to the storage
+    remote_cache: str
+        URL of the shared HTTP cache server (see spiderpig.remote) used when
+        the result is not available locally
+    cache_tiers: list
+        additional (slower) storage tiers consulted when the result is not
+        available in the given directory; each tier is given either as a
+        directory, or as a dictionary with keys 'directory', 'max_entries'
+        and 'write_policy' (see cache.StorageCacheProvider), or as a string
+        'DIRECTORY[,max_entries=N][,write_policy=POLICY]'
+    override_functions: list
+        names of functions (e.g., 'pkg.mod.fun') whose cached executions
+        (and executions depending on them) should be recomputed
+    max_in_memory_bytes: int
+        maximal (estimated) size of results in in-memory cache in bytes,
+        unlimited by default
+    prewarm: bool, default False
+        True if the working set saved by the last run (or the most valuable
+        stored results) should be loaded to in-memory cache in the
+        background; the working set is saved when spiderpig terminates
+    shared_memory_bytes: int
+        if given, large buffer-backed results (e.g., arrays) are kept in
+        shared memory of at most this size, so the processes on the same host
+        using the same directory share one copy of them (see spiderpig.shm);
+        it needs the cache directory
+    packed_storage: bool, default False
+        True if small results should be packed into segment files instead of
+        having files of their own (see spiderpig.packed); caches which have
+        been packed once are always opened packed
+    host_resources: dict
+        budget of resources (e.g., {'memory_gb': 64, 'cpu': 16}) of this host
+        shared by the processes using the directory, executions of functions
+        needing resources wait until they fit in it (see spiderpig.resources);
+        the physical memory and the number of CPUs by default, the budget is
+        used only if it is given or some function has been decorated with
+        resources before
+    profile_functions: list
+        patterns of names of functions (e.g., 'pkg.mod.*') whose executions
+        are computed under cProfile and tracemalloc; the profiles are stored
+        next to the executions (see spiderpig.profiling and
+        spiderpig-profiles)
+    lock_report: bool, default False
+        True if the time spent waiting for locks and the most contended
+        executions should be reported when spiderpig terminates (see
+        lock_statistics)
     global_kwargs: dict
         key-word arguments passed to spiderpig functions
 
@@ -131,6 +252,8 @@ def init(directory=None, override_cache=False, verbosity=Verbosity.INFO, max_in_
     global _EXECUTION_CONTEXT
     global _CACHE_PROVIDER
     global _STORAGE
+    global _PREWARM
+    global _LOCK_REPORT
     if config_file is not None:
         with open(config_file, 'r') as f:
             from_config_file = json.load(f.read()) if config_file.endswith('.json') else yaml.load(f.read())
@@ -139,21 +262,58 @@ def init(directory=None, override_cache=False, verbosity=Verbosity.INFO, max_in_
                     raise ValidationError('Config "{} ({})" is not scalar.'.format(key, value))
             from_config_file.update(global_kwargs)
             global_kwargs= from_config_file
-    if directory is None:
-        _CACHE_PROVIDER = cache.InMemoryCacheProvider(max_entries=max_in_memory_entries)
-    else:
-        _STORAGE = cache.FileStorage(directory if directory else tempfile.mkdtemp())
-        _CACHE_PROVIDER = cache.InMemoryCacheProvider(
-            provider=cache.StorageCacheProvider(
-                storage=_STORAGE, verbosity=verbosity, override=override_cache
-            ),
-            max_entries=max_in_memory_entries
+    provider = None
+    if remote_cache is not None:
+        from . import remote
+        provider = remote.RemoteCacheProvider(remote.RemoteCacheClient(remote_cache), verbosity=verbosity)
+    tiers = [] if directory is None else [{'directory': directory if directory else tempfile.mkdtemp()}]
+    for tier in ([] if cache_tiers is None else cache_tiers):
+        tiers.append(config.parse_cache_tier(tier) if isinstance(tier, str) else dict(tier))
+    for tier in tiers:
+        # the cache does not move when the working directory is changed
+        tier['directory'] = os.path.abspath(tier['directory'])
+    # the locks are kept next to the cache, so processes sharing the cache
+    # (e.g., workers of spiderpig-sweep) do not compute the same results
+    locker = None if len(tiers) == 0 else execution.Locker(os.path.join(tiers[0]['directory'], '.locks'), verbosity=verbosity)
+    for tier in reversed(tiers):
+        _STORAGE = _open_storage(tier['directory'], packed_storage)
+        provider = cache.StorageCacheProvider(
+            storage=_STORAGE, verbosity=verbosity, locker=locker, override=override_cache, write_behind=write_behind,
+            provider=provider, max_entries=tier.get('max_entries'), write_policy=tier.get('write_policy', 'always'),
+            override_functions=override_functions
+        )
+    if shared_memory_bytes is not None:
+        if len(tiers) == 0:
+            # the entries are shared by the processes using the same cache
+            raise ValidationError('The shared memory cache needs the cache directory.')
+        from . import shm
+        provider = shm.SharedMemoryCacheProvider(
+            tiers[0]['directory'],
+            verbosity=verbosity, locker=locker, provider=provider, max_bytes=int(shared_memory_bytes)
         )
+    _CACHE_PROVIDER = cache.InMemoryCacheProvider(max_entries=max_in_memory_entries, provider=provider, max_bytes=max_in_memory_bytes)
     _CACHE_PROVIDER.prepare()
+    _PREWARM = prewarm
+    _LOCK_REPORT = lock_report
+    if prewarm:
+        _CACHE_PROVIDER.prewarm()
+    if isinstance(host_resources, str):
+        host_resources = config.parse_resources(host_resources)
+    scheduler = None
+    # the executions are neither admitted nor measured unless the resources
+    # are used
+    if host_resources is not None or resources.is_annotated():
+        budget = resources.ResourceBudget(
+            os.path.join(tiers[0]['directory'], '.resources') if len(tiers) > 0 else None, capacity=host_resources
+        )
+        scheduler = resources.ResourceScheduler(budget, _CACHE_PROVIDER, verbosity=verbosity)
+    config.snapshot_environment()
     _EXECUTION_CONTEXT = execution.ExecutionContext(
         configuration=config.Configuration(**global_kwargs),
         cache_provider=_CACHE_PROVIDER,
-        verbosity=verbosity
+        verbosity=verbosity,
+        scheduler=scheduler,
+        profiler=None if not profile_functions else profiling.Profiler(profile_functions, _STORAGE if len(tiers) > 0 else None)
     )
 
 
@@ -166,6 +326,13 @@ def terminate():
     global _CACHE_PROVIDER
     global _STORAGE
 
+    if _CACHE_PROVIDER is not None:
+        if _PREWARM:
+            save_working_set()
+        _CACHE_PROVIDER.flush()
+        _CACHE_PROVIDER.close()
+        if _LOCK_REPORT:
+            _CACHE_PROVIDER._locker.print_report()
     _EXECUTION_CONTEXT = None
     _CACHE_PROVIDER = None
     _STORAGE
@@ -230,7 +397,9 @@ class configuration:
                 **self._config
             ),
             cache_provider=_CACHE_PROVIDER,
-            verbosity=self._current_exec_context.verbosity
+            verbosity=self._current_exec_context.verbosity,
+            scheduler=self._current_exec_context.scheduler,
+            profiler=self._current_exec_context.profiler
         )
         return self
 
@@ -241,6 +410,18 @@ class configuration:
         _EXECUTION_CONTEXT = self._current_exec_context
 
 
+def save_working_set():
+    """
+    Save the results currently kept in memory as the working set, which is
+    loaded to memory when spiderpig is initialized with prewarm=True.
+
+    Returns
+    -------
+    number of saved entries
+    """
+    return cache_provider().save_working_set()
+
+
 def storage():
     """
     Retrieve the current storage used by spiderpig to persist cache. If
@@ -257,6 +438,26 @@ def storage():
     return _STORAGE
 
 
+def lock_statistics(kind=None):
+    """
+    Retrieve the telemetry of the locks acquired by this process: how many
+    times each lock has been acquired and contended, and how long it has
+    been waited for and held.
+
+    Parameters
+    ----------
+    kind: str
+        only locks of the given kind, i.e., execution.Locker.LOCK_GLOBAL,
+        LOCK_FUNCTION or LOCK_EXECUTION
+
+    Returns
+    -------
+    list of execution.LockStatistics, the locks waited for the longest time
+    first
+    """
+    return cache_provider()._locker.statistics(kind)
+
+
 def cache_provider():
     """
     Retrieve the current cache provider.
@@ -277,6 +478,93 @@ def execution_context():
     return _EXECUTION_CONTEXT
 
 
+def plan(func, *args, **kwargs):
+    """
+    Plan the execution of the given function with the given arguments
+    without executing it. The plan is based on the dependency graph recorded
+    by previous runs and on the stored metadata of executions.
+
+    Returns
+    -------
+    planner.Plan reporting the status (valid in memory/on disk, stale or
+    missing) of the needed executions, the estimated compute time and the
+    critical path
+
+    Examples
+    --------
+
+        >>> @cached()
+        ... def fun(a=None):
+        ...     return a
+        ...
+        >>> with spiderpig(a=1):
+        ...     print(plan(fun).root.status)
+        ...     fun()
+        ...     print(plan(fun).root.status)
+        ...
+        missing
+        1
+        memory
+    """
+    from . import planner
+    function = execution.Function(func)
+    kwargs.update(zip(function.arguments, args))
+    return planner.Planner(execution_context(), cache_provider()).plan(function, **kwargs)
+
+
+def invalidate(func, *args, **kwargs):
+    """
+    Invalidate the cached execution of the given function with the given
+    arguments (completed from the current configuration as if the function
+    was called) and all executions depending on it.
+
+    Returns
+    -------
+    set of names of invalidated executions
+
+    See also
+    --------
+    invalidate_function
+    """
+    function = execution.Function(func)
+    kwargs.update(zip(function.arguments, args))
+    return cache_provider().invalidate(executions=[execution_context().create_execution(function, **kwargs)])
+
+
+def invalidate_function(func):
+    """
+    Invalidate all cached executions of the given function and all
+    executions depending on them.
+
+    Returns
+    -------
+    set of names of invalidated executions
+
+    See also
+    --------
+    invalidate
+    """
+    return cache_provider().invalidate(function=execution.Function(func))
+
+
+def submit(func, *args, **kwargs):
+    """
+    Enqueue the execution of the given function to the work queue in the
+    cache directory. It is executed by one of spiderpig-worker processes
+    sharing the directory, possibly on another node.
+
+    Returns
+    -------
+    spiderpig.distributed.Task whose result() waits for the execution and
+    reads its result from the cache
+    """
+    from . import distributed
+    function = execution.Function(func)
+    kwargs.update(zip(function.arguments, args))
+    cache_provider().flush()
+    return distributed.submit(distributed.WorkQueue(storage().directory), execution_context(), func, kwargs)
+
+
 class configured:
 
     """
@@ -290,7 +578,7 @@ class configured:
     cached
     """
 
-    def __init__(self, cached=False, **config):
+    def __init__(self, cached=False, chunk_size=None, partition_by=None, combine=None, partition_workers=1, resources=None, **config):
         """
         Create a decorator instance.
 
@@ -298,24 +586,93 @@ class configured:
         ----------
         cached: bool, default False
             turn on caching
+        chunk_size: int
+            number of items stored in one chunk when a generator function is
+            cached, 1000 by default
+        partition_by: str or callable
+            split the range given by the 'start' and 'end' arguments into
+            partitions executed separately, e.g., 'date' (see
+            spiderpig.partition)
+        combine: callable
+            function merging the list of results of partitions, required
+            together with partition_by
+        partition_workers: int, default 1
+            number of threads executing the partitions
+        resources: dict
+            resources one execution needs, e.g., {'memory_gb': 8, 'cpu': 4};
+            the execution is computed when they are available in the budget
+            of the host (see spiderpig.resources)
         config: dict
             key-word parameters to override the global configuration
         """
+        if resources is not None:
+            validate_resources(resources)
+        if partition_by is not None:
+            partition.get_partitioner(partition_by)
+            if combine is None:
+                raise ValidationError('The partitioned function has to be given the combine function.')
         self._cached = cached
+        self._options = {
+            'chunk_size': chunk_size,
+            'partition_by': partition_by,
+            'combine': combine,
+            'partition_workers': partition_workers,
+            'resources': resources,
+        }
         self._config = config
 
     def __call__(self, func):
+        plan = _CallPlan(func, self._cached, self._config, **self._options)
 
         @wraps(func)
         def _wrapper(*args, **kwargs):
-            def_args = execution.Function(func).arguments
-            kwargs.update(dict(zip(def_args, args)))
-            with configuration(**self._config):
-                return execution_context().execute(func, use_cache=self._cached, **kwargs)
+            return plan(args, kwargs)
 
         return _wrapper
 
 
+class _CallPlan:
+
+    """
+    Invocation of a decorated function prepared when the function is
+    decorated. Argument names are resolved once and contexts overriding the
+    configuration are reused across calls.
+    """
+
+    def __init__(self, func, use_cache, config, **options):
+        self._function = execution.Function(func)
+        self._function.set_options(cached=use_cache, **options)
+        self._arg_names = self._function.arguments
+        self._use_cache = use_cache
+        self._partitioned = options.get('partition_by') is not None
+        self._config = config
+        self._contexts = weakref.WeakKeyDictionary()
+
+    def __call__(self, args, kwargs):
+        if len(args) > 0:
+            kwargs.update(zip(self._arg_names, args))
+        current_context = execution_context()
+        if len(self._config) == 0:
+            return self._execute(current_context, kwargs)
+        context = self._contexts.get(current_context)
+        if context is None or context.is_executing():
+            # a recursive call gets its own context as it would get by
+            # entering the configuration context
+            context = current_context.derive(**self._config)
+            self._contexts[current_context] = context
+        global _EXECUTION_CONTEXT
+        _EXECUTION_CONTEXT = context
+        try:
+            return self._execute(context, kwargs)
+        finally:
+            _EXECUTION_CONTEXT = current_context
+
+    def _execute(self, context, kwargs):
+        if self._partitioned:
+            return partition.execute(context, self._function, use_cache=self._use_cache, **kwargs)
+        return context.execute(self._function, use_cache=self._use_cache, **kwargs)
+
+
 class cached(configured):
 
     """
@@ -324,6 +681,16 @@ class cached(configured):
     based on the values of parameters of the given function and its
     dependencies.
 
+    Generator functions are cached as streams: the yielded items are stored in
+    chunks as they are consumed and replayed lazily from the storage. When the
+    consumption is interrupted, the next run replays the completed chunks and
+    continues from there.
+
+    Functions computing aggregates over a range given by the 'start' and
+    'end' arguments can be partitioned, e.g., by dates. Each partition is
+    cached separately and the results are merged by the given combiner, so
+    extending the range computes only the new partitions.
+
     Examples
     --------
 
@@ -357,8 +724,22 @@ class cached(configured):
 
         Parameters
         ----------
-        cached: bool, default False
-            turn on caching
+        chunk_size: int
+            number of items stored in one chunk when a generator function is
+            cached, 1000 by default
+        partition_by: str or callable
+            split the range given by the 'start' and 'end' arguments into
+            partitions cached separately, e.g., 'date' (see
+            spiderpig.partition)
+        combine: callable
+            function merging the list of results of partitions, required
+            together with partition_by
+        partition_workers: int, default 1
+            number of threads executing the partitions
+        resources: dict
+            resources one execution needs, e.g., {'memory_gb': 8, 'cpu': 4};
+            the execution is computed when they are available in the budget
+            of the host (see spiderpig.resources)
         config: dict
             key-word parameters to override the global configuration
         """
@@ -367,7 +748,9 @@ class cached(configured):
 
 def run_cli(command_packages=None, namespaced_command_packages=None, argument_parser=None, setup_functions=None):
     """
-    Run spiderpig command-line application.
+    Run spiderpig command-line application. With --connect SOCKET, the
+    command is run by the daemon listening on the socket (see
+    spiderpig.daemon).
 
     Args:
         command_packages: list of packages containing modules representing
@@ -378,6 +761,11 @@ def run_cli(command_packages=None, namespaced_command_packages=None, argument_pa
         argument_parser: custom argument parser (argparse.ArgumentParser instance)
         setup_functions: functions invoked before the main command is executed
     """
+    connect, argv = _connect_argument(sys.argv[1:])
+    if connect is not None:
+        # the thin client does not register any command
+        from . import daemon
+        sys.exit(daemon.run_client(connect, argv))
     import spiderpig.commands.common as spcommon
     if command_packages is None:
         command_packages = []
@@ -387,16 +775,47 @@ def run_cli(command_packages=None, namespaced_command_packages=None, argument_pa
         setup_functions = []
     parser = config.get_argument_parser() if argument_parser is None else argument_parser
     subparsers = parser.add_subparsers()
+    # shell completion needs the options of all commands
+    argv = None if '_ARGCOMPLETE' in os.environ else sys.argv[1:]
     for command_package in command_packages:
-        commands.register_submodule_commands(subparsers, command_package)
+        commands.register_submodule_commands(subparsers, command_package, argv=argv)
     for command_namespace, command_package in namespaced_command_packages.items():
-        commands.register_submodule_commands(subparsers, command_package, namespace=command_namespace)
-    commands.register_submodule_commands(subparsers, spcommon, namespace='spiderpig')
+        commands.register_submodule_commands(subparsers, command_package, namespace=command_namespace, argv=argv)
+    commands.register_submodule_commands(subparsers, spcommon, namespace='spiderpig', argv=argv)
     argcomplete.autocomplete(parser)
+    commands.set_application(parser, setup_functions)
     args = vars(parser.parse_args())
 
     args = config.process_kwargs(args)
+    args.pop('connect', None)
+    dry_run = args.pop('dry_run', False)
     with spiderpig(args['spiderpig_dir'], **{k: v for (k, v) in args.items() if k != 'func'}):
+        if dry_run:
+            commands.plan(args)
+            return
         for setup_fun in setup_functions:
             execution_context().execute(setup_fun, use_cache=False)
         commands.execute(args)
+
+
+def _open_storage(directory, packed=False):
+    if packed or cache.FileStorage(directory).read_info().get('packed', False):
+        from . import packed as packed_module
+        return packed_module.PackedFileStorage(directory)
+    return cache.FileStorage(directory)
+
+
+def _connect_argument(argv):
+    """
+    Split the socket of the daemon (--connect) from the other command-line
+    arguments.
+
+        >>> _connect_argument(['--connect', 'sp.sock', 'my-command', '--a', '1'])
+        ('sp.sock', ['my-command', '--a', '1'])
+    """
+    for i, arg in enumerate(argv):
+        if arg == '--connect' and i + 1 < len(argv):
+            return argv[i + 1], argv[:i] + argv[i + 2:]
+        if arg.startswith('--connect='):
+            return arg[len('--connect='):], argv[:i] + argv[i + 1:]
+    return None, argv
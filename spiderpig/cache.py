@@ -1,12 +1,41 @@
-from .exceptions import TooManyDependencies
+from .exceptions import TooManyDependencies, ValidationError
 from .execution import Locker, Execution, Function
 from .msg import Verbosity, print_warn
+from collections import defaultdict, deque, namedtuple
 from glob import iglob
+from itertools import islice
+from multiprocessing.pool import ThreadPool
 from pathlib import Path
+from time import time
 import abc
+import atexit
+import filelock
+import heapq
+import marshal
 import os
 import pickle
+import queue
 import shutil
+import sys
+import tempfile
+import threading
+import weakref
+
+
+# seconds without foreground requests before the cache prewarming continues
+PREWARM_IDLE_TIME = 0.05
+
+# number of items yielded by a generator function stored in one chunk
+CHUNK_SIZE = 1000
+
+# number of the latest profiles kept for each execution
+PROFILE_HISTORY = 5
+
+# reference to a stored execution known only by its name
+ExecutionReference = namedtuple('ExecutionReference', ['name'])
+
+# stored result of a generator function, the items are kept in chunks
+StoredStream = namedtuple('StoredStream', ['chunks'])
 
 
 class CacheProvider(metaclass=abc.ABCMeta):
@@ -35,6 +64,31 @@ class CacheProvider(metaclass=abc.ABCMeta):
     def lock(self, obj=None, already_exclusive=False):
         return EmptyContext() if already_exclusive else self._locker.lock(obj)
 
+    def flush(self):
+        if self._provider is not None:
+            self._provider.flush()
+
+    def close(self):
+        """
+        Release the resources held by the provider (and the providers below),
+        e.g., when spiderpig terminates.
+        """
+        if self._provider is not None:
+            self._provider.close()
+
+    def invalidate(self, executions=None, function=None):
+        """
+        Invalidate the given executions (or all executions of the given
+        function) and all executions depending on them.
+
+        Returns
+        -------
+        set of names of invalidated executions
+        """
+        if self._provider is None:
+            return {e.name for e in ([] if executions is None else executions)}
+        return self._provider.invalidate(executions=executions, function=function)
+
     @property
     def verbosity(self):
         return self._verbosity
@@ -50,96 +104,386 @@ class CacheProvider(metaclass=abc.ABCMeta):
 
 class InMemoryCacheProvider(CacheProvider):
 
-    def __init__(self, verbosity=Verbosity.INFO, locker=None, max_entries=1000, provider=None):
+    """
+    Cache provider keeping results in memory. When the cache is full, the
+    entries are evicted in the GreedyDual-Size manner: the entries which
+    save the least compute time per byte are evicted first, while the
+    priority of recently used entries is inflated, so old entries eventually
+    leave the cache as well.
+    """
+
+    def __init__(self, verbosity=Verbosity.INFO, locker=None, max_entries=1000, provider=None, max_bytes=None):
         CacheProvider.__init__(self, locker, verbosity, provider)
         self._max_entries = max_entries
+        self._max_bytes = max_bytes
         self._cache = {}
         self._cache_priority = {}
+        self._cache_value = {}
+        self._cache_size = {}
+        self._heap = []
+        self._inflation = 0
+        self._bytes = 0
+        self._state_lock = threading.RLock()
+        self._foreground_time = 0
+        self._prewarm_thread = None
+        self._prewarm_stopped = threading.Event()
 
     def prepare(self):
         if self._provider is not None:
             return self._provider.prepare()
 
     def get_or_execute(self, execution, already_exclusive=False):
+        self._foreground_time = time()
+        if execution.function.is_generator:
+            # streams are not kept in memory, they are replayed from the
+            # storage below
+            if self._provider is None:
+                return True, execution()
+            return self._provider.get_or_execute(execution, already_exclusive)
         with self.lock(execution, already_exclusive):
             if self.is_valid_cache(execution):
                 execution_name = execution.name
-                result = self._cache[execution_name]
-                self._cache_priority[execution_name] = self._cache_priority.get(execution_name, 0) + 1
-                return False, result
+                with self._state_lock:
+                    self._touch(execution_name)
+                    return False, self._cache[execution_name]
             if self._provider is None:
                 executed = True
                 execution_result = execution()
             else:
                 executed, execution_result = self._provider.get_or_execute(execution, already_exclusive=True)
-            execution_name = execution.name
-            if len(self._cache) >= self._max_entries:
-                for cache_key, _ in sorted(self._cache_priority.items(), key=lambda x: x[1])[:self._max_entries // 2]:
-                    del self._cache[cache_key]
-                self._cache_priority = {}
-            self._cache[execution_name] = execution_result
-            self._cache_priority[execution_name] = self._cache_priority.get(execution_name, 0) + 1
+            self._put(execution, execution_result)
             return executed, execution_result
 
+    def prewarm(self, wait=False):
+        """
+        Load the results from the storage below in a background thread. The
+        working set saved by save_working_set() is loaded if available,
+        otherwise the stored results saving the most compute time per byte.
+        Loading stops when the cache is full and pauses while there are
+        foreground requests.
+
+        Parameters
+        ----------
+        wait: bool, default False
+            block until the results are loaded
+        """
+        storage_provider = self._storage_provider()
+        if storage_provider is None:
+            return
+        if self._prewarm_thread is None or not self._prewarm_thread.is_alive():
+            self._prewarm_stopped.clear()
+            self._prewarm_thread = threading.Thread(target=self._prewarm, args=(storage_provider,), name='spiderpig-prewarm', daemon=True)
+            self._prewarm_thread.start()
+        if wait:
+            self._prewarm_thread.join()
+
+    def close(self):
+        self._stop_prewarm()
+        CacheProvider.close(self)
+
+    def working_set(self):
+        """
+        Names of executions currently in the cache, the most valuable first.
+        """
+        with self._state_lock:
+            return [name for name, _ in sorted(self._cache_priority.items(), key=lambda x: -x[1])]
+
+    def save_working_set(self):
+        """
+        Persist the current working set in the storage below, so it can be
+        loaded by prewarm() after the restart.
+
+        Returns
+        -------
+        number of saved entries
+        """
+        storage_provider = self._storage_provider()
+        if storage_provider is None:
+            return 0
+        working_set = self.working_set()
+        storage_provider.storage.write_working_set(working_set)
+        return len(working_set)
+
     def size(self):
         return len(self._cache)
 
     def is_valid_cache(self, execution):
         return execution.name in self._cache and all([self.is_valid_cache(e) for e in execution.dependencies])
 
+    def _put(self, execution, execution_result):
+        execution_name = execution.name
+        size = execution.size if execution.size is not None else _estimate_size(execution_result)
+        with self._state_lock:
+            self._remove(execution_name)
+            while len(self._cache) > 0 and not self._fits(size):
+                self._evict()
+            self._cache[execution_name] = execution_result
+            self._cache_value[execution_name] = retention_value(execution.time, size)
+            self._cache_size[execution_name] = size
+            self._bytes += size
+            self._touch(execution_name)
+
+    def _fits(self, size, max_entries=None):
+        max_entries = self._max_entries if max_entries is None else max_entries
+        return len(self._cache) < max_entries and (self._max_bytes is None or self._bytes + size <= self._max_bytes)
+
+    def _storage_provider(self):
+        provider = self._provider
+        while provider is not None and not isinstance(provider, StorageCacheProvider):
+            provider = provider.provider
+        return provider
+
+    def _prewarm(self, storage_provider):
+        storage = storage_provider.storage
+        try:
+            names = storage.read_working_set()
+            if names is None:
+                executions = sorted(storage.read_executions(), key=lambda e: -retention_value(e.time, e.size or 0))
+                names = [e.name for e in executions]
+            for name in names:
+                # foreground requests take precedence
+                while time() - self._foreground_time < PREWARM_IDLE_TIME and not self._prewarm_stopped.is_set():
+                    self._prewarm_stopped.wait(PREWARM_IDLE_TIME)
+                if self._prewarm_stopped.is_set():
+                    return
+                with self._state_lock:
+                    if name in self._cache:
+                        continue
+                    if not self._fits(0):
+                        return
+                execution = storage.read_execution(ExecutionReference(name))
+                if execution is None:
+                    continue
+                with self.lock(execution):
+                    found, result = storage_provider.load(execution)
+                    with self._state_lock:
+                        if found and name not in self._cache and not isinstance(result, StoredStream):
+                            if not self._fits(execution.size if execution.size is not None else _estimate_size(result)):
+                                return
+                            self._put(execution, result)
+        except Exception as e:
+            print_warn('Prewarming of the cache failed: {}'.format(e))
+
+    def _stop_prewarm(self):
+        self._prewarm_stopped.set()
+        if self._prewarm_thread is not None:
+            self._prewarm_thread.join()
+            self._prewarm_thread = None
+
+    def _touch(self, execution_name):
+        priority = self._inflation + self._cache_value[execution_name]
+        self._cache_priority[execution_name] = priority
+        heapq.heappush(self._heap, (priority, execution_name))
+        if len(self._heap) > 2 * len(self._cache) + 100:
+            # drop outdated priorities
+            self._heap = [(p, n) for (n, p) in self._cache_priority.items()]
+            heapq.heapify(self._heap)
+
+    def _evict(self):
+        while True:
+            priority, execution_name = heapq.heappop(self._heap)
+            if self._cache_priority.get(execution_name) == priority:
+                break
+        self._inflation = priority
+        self._remove(execution_name)
+
+    def _remove(self, execution_name):
+        if execution_name not in self._cache:
+            return
+        del self._cache[execution_name]
+        del self._cache_priority[execution_name]
+        del self._cache_value[execution_name]
+        self._bytes -= self._cache_size.pop(execution_name)
+
+    def invalidate(self, executions=None, function=None):
+        if self._provider is None:
+            # dependents are not known without the storage
+            invalidated = {e.name for e in ([] if executions is None else executions)}
+            self.clear(recursively=False)
+            return invalidated
+        invalidated = self._provider.invalidate(executions=executions, function=function)
+        prefix = None if function is None else function.name + '.'
+        with self._state_lock:
+            for execution_name in list(self._cache):
+                if execution_name in invalidated or (prefix is not None and execution_name.startswith(prefix)):
+                    self._remove(execution_name)
+        return invalidated
+
     def to_serializable(self):
         return {
             'max_entries': self._max_entries,
+            'max_bytes': self._max_bytes,
         }
 
     @staticmethod
     def from_serializable(serializable, verbosity):
-        return InMemoryCacheProvider(verbosity, max_entries=serializable['max_entries'])
+        return InMemoryCacheProvider(verbosity, max_entries=serializable['max_entries'], max_bytes=serializable.get('max_bytes'))
 
     def clear(self, recursively=True):
-        self._cache = {}
-        self._cache_priority = {}
+        with self._state_lock:
+            self._cache = {}
+            self._cache_priority = {}
+            self._cache_value = {}
+            self._cache_size = {}
+            self._heap = []
+            self._bytes = 0
         if recursively and self._provider is not None:
             self._provider.clear()
 
 
 class StorageCacheProvider(CacheProvider):
 
-    def __init__(self, storage, verbosity=Verbosity.INFO, locker=None, override=False, provider=None):
+    WRITE_POLICIES = ['always', 'computed', 'never']
+
+    def __init__(self, storage, verbosity=Verbosity.INFO, locker=None, override=False, provider=None, write_behind=False, max_pending_writes=100, max_entries=None, write_policy='always', override_functions=None):
+        """
+        Create a cache provider persisting results in the given storage.
+
+        Parameters
+        ----------
+        storage: Storage
+            storage used to persist results
+        override: bool, default False
+            True if the entries created before the provider is prepared
+            should be considered invalid
+        provider: CacheProvider
+            slower cache provider asked when the result is not available in
+            this one, e.g., another StorageCacheProvider
+        write_behind: bool, default False
+            persist results in a background thread
+        max_pending_writes: int, default 100
+            maximal number of results waiting to be persisted in the write
+            behind mode
+        max_entries: int
+            maximal number of entries in the storage, unlimited by default
+        write_policy: str, default 'always'
+            'always' stores both computed results and results promoted from
+            the slower provider, 'computed' stores only computed results and
+            'never' makes the storage read-only
+        override_functions: list
+            names of functions (e.g., 'pkg.mod.fun') whose executions (and
+            executions depending on them) should be recomputed
+        """
         CacheProvider.__init__(self, locker, verbosity, provider)
+        if write_policy not in StorageCacheProvider.WRITE_POLICIES:
+            raise ValidationError('The write policy has to be one of {}, given: {}'.format(StorageCacheProvider.WRITE_POLICIES, write_policy))
         self._storage = storage
         self._override = override
         self._time = None
+        self._writer = StorageWriter(storage, self._locker, max_pending_writes) if write_behind else None
+        self._max_entries = max_entries
+        self._write_policy = write_policy
+        self._override_functions = [] if override_functions is None else list(override_functions)
+        self._entries = None
+        self._checked_functions = set()
+        self._code_lock = threading.RLock()
 
     def prepare(self):
         with self.lock():
             self._storage.write_info(init=True)
             self._time = self._storage.read_info_time()
             self._storage.write_info(override_time=self._time)
-            for _ in self._storage.read_functions():
-                pass
-            if self._provider is not None:
-                self._provider.prepare()
+            # the stored functions are imported and their code is checked
+            # only when they are needed (see _check_code)
+            for info in self._storage.read_function_infos():
+                Function.register_stored_dependencies(info)
+            for function in [Function.from_name(name) for name in self._override_functions]:
+                self._storage.invalidate([e.name for e in self._storage.read_executions(function)])
+                self._storage.write_function(function)
+            if self._max_entries is not None:
+                self._entries = sum(1 for _ in self._storage.read_executions())
+        if self._provider is not None:
+            self._provider.prepare()
 
     def get_or_execute(self, execution, already_exclusive=False):
+        self._check_code(execution.function)
+        if execution.function.is_generator:
+            return self._get_or_execute_stream(execution, already_exclusive)
         with self.lock(execution, already_exclusive):
+            if self._writer is not None:
+                pending = self._writer.pending(execution)
+                if pending is not None:
+                    return False, pending()
             if self.is_valid_cache(execution):
-                return False, self._storage.read_execution_result(execution)
+                return False, self._read_execution_result(execution)
             if self._provider is None:
                 executed = True
                 execution()
             else:
-                executed, self._provider.get_or_execute(execution, already_exclusive=True)
+                executed, _ = self._provider.get_or_execute(execution, already_exclusive=True)
+            if self._write_policy == 'never' or (self._write_policy == 'computed' and not executed):
+                return executed, execution()
+            if self._entries is not None:
+                self._entries += 1
+            if self._writer is not None:
+                self._writer.submit(execution)
+                return executed, execution()
             self._storage.write_execution_result(execution)
         with self.lock(execution.function):
             self._storage.write_function(execution.function)
-        return executed, self._storage.read_execution_result(execution)
+        result = self._storage.read_execution_result(execution)
+        if self._entries is not None and self._entries > self._max_entries:
+            self._evict()
+        return executed, result
+
+    @property
+    def storage(self):
+        return self._storage
+
+    def load(self, execution):
+        """
+        Read the cached result without executing anything.
+
+        Returns
+        -------
+        (True if the result is available, the result)
+        """
+        self._check_code(execution.function)
+        if self._writer is not None:
+            pending = self._writer.pending(execution)
+            if pending is not None:
+                return True, pending()
+        if not self.is_valid_cache(execution):
+            return False, None
+        return True, self._read_execution_result(execution)
+
+    def flush(self):
+        if self._writer is not None:
+            self._writer.flush()
+        CacheProvider.flush(self)
+
+    def close(self):
+        self.flush()
+        self._storage.close()
+        CacheProvider.close(self)
 
     def size(self):
         with self.lock():
             return sum(1 for _ in self._storage.read_executions())
 
+    def invalidate(self, executions=None, function=None):
+        self.flush()
+        names = [e.name for e in ([] if executions is None else executions)]
+        with self.lock():
+            if function is not None:
+                names += [e.name for e in self._storage.read_executions(function)]
+            invalidated = self._storage.invalidate(names)
+        if self._provider is not None:
+            # the tiers below drop the dependents as well
+            references = [ExecutionReference(name) for name in sorted(invalidated)]
+            invalidated |= self._provider.invalidate(executions=references, function=function)
+        return invalidated
+
     def is_valid_cache(self, execution, reread=True):
+        if reread and hasattr(execution, 'function'):
+            self._check_code(execution.function)
+        if self._storage.indexed:
+            # dependents are marked dirty whenever the execution is rewritten
+            if not self._storage.is_execution_ready(execution):
+                return False
+            if self._override and self._storage.read_execution_time(execution) < self._time:
+                return False
+            return not self._storage.is_execution_dirty(execution)
         if reread:
             try:
                 execution = self._storage.read_execution(execution)
@@ -148,16 +492,150 @@ class StorageCacheProvider(CacheProvider):
             except TooManyDependencies as e:
                 print_warn(str(e))
                 return self._storage.is_execution_ready(execution)
+        if self._storage.is_execution_dirty(execution):
+            return False
         execution_time = self._storage.read_execution_time(execution)
         if self._override and execution_time < self._time:
             return False
         return execution_time >= self._get_execution_dependencies_max_time(execution) and all([self.is_valid_cache(d, reread=False) for d in execution.dependencies])
 
+    def _check_code(self, function):
+        """
+        Invalidate the executions of the given function (and of functions it
+        depends on) whose code has changed since they were stored, together
+        with their dependents. Each function is checked once per process,
+        the first time it is needed, so the stored functions are not
+        imported when the cache is prepared.
+        """
+        name = function.name
+        if name in self._checked_functions:
+            return
+        with self._code_lock:
+            if name in self._checked_functions:
+                return
+            self._checked_functions.add(name)
+            stored = self._storage.read_function_info(name)
+            if stored is None:
+                return
+            for dependency in stored['dependencies']:
+                try:
+                    self._check_code(Function.from_name(dependency['function_name']))
+                except (ImportError, AttributeError):
+                    # the function does not exist anymore
+                    pass
+            if stored.get('code_fingerprint') is None or stored['code_fingerprint'] == function.code_fingerprint:
+                return
+            with self.lock(function):
+                self._storage.invalidate([e.name for e in self._storage.read_executions(function)])
+                self._storage.write_function(function)
+
     def clear(self, recursively=True):
         self._storage.clear()
         if recursively and self._provider:
             self._provider.clear(recursively)
 
+    def _read_execution_result(self, execution):
+        result = self._storage.read_execution_result(execution)
+        if len(execution.dependencies) == 0:
+            # the result can be promoted to faster cache tiers, so they need to
+            # know the dependencies as well
+            try:
+                stored_execution = self._storage.read_execution(execution)
+                if stored_execution is not None:
+                    execution.set_statistics(stored_execution.time, stored_execution.own_time, stored_execution.size, stored_execution.memory)
+                for dependency in ([] if stored_execution is None else stored_execution.dependencies):
+                    execution.add_dependency(dependency)
+            except TooManyDependencies:
+                pass
+        execution.set_result(result)
+        return result
+
+    def _get_or_execute_stream(self, execution, already_exclusive):
+        """
+        Results of generator functions are stored in chunks as they are
+        consumed and replayed lazily. The slower providers are not asked.
+        """
+        with self.lock(execution, already_exclusive):
+            if self.is_valid_cache(execution):
+                stream = self._read_execution_result(execution)
+                return False, self._storage.read_execution_chunks(execution, stream.chunks)
+            if self._write_policy == 'never':
+                return True, execution()
+        return True, self._stream(execution)
+
+    def _stream(self, execution):
+        # the stream is written by one thread or process at a time, the lock
+        # is held until the stream is consumed or closed
+        stream_lock = self._locker.lock(ExecutionReference('{}.stream'.format(execution.name)))
+        try:
+            stream_lock.acquire(timeout=0)
+        except filelock.Timeout:
+            # another consumer is storing the stream
+            yield from execution()
+            return
+        try:
+            yield from self._write_stream(execution)
+        finally:
+            stream_lock.release()
+
+    def _write_stream(self, execution):
+        chunk_size = execution.function.options.get('chunk_size') or CHUNK_SIZE
+        stored = None
+        with self.lock(execution):
+            if self.is_valid_cache(execution):
+                # stored by another consumer in the meantime
+                stored = self._read_execution_result(execution)
+            else:
+                if self._storage.is_execution_ready(execution):
+                    # chunks of a stale stream can not be resumed
+                    self._storage.delete_execution_result(execution, invalidate_dependents=False)
+                completed = self._storage.start_execution_stream(execution, chunk_size)
+        if stored is not None:
+            yield from self._storage.read_execution_chunks(execution, stored.chunks)
+            return
+        # chunks completed by an interrupted run are replayed, the generator
+        # can not be resumed in the middle, so it only skips their items
+        yield from self._storage.read_execution_chunks(execution, completed)
+        compute_time = 0
+        started = time()
+        items = execution()
+        deque(islice(items, completed * chunk_size), maxlen=0)
+        compute_time += time() - started
+        chunk = []
+        while True:
+            started = time()
+            try:
+                item = next(items)
+            except StopIteration:
+                break
+            finally:
+                compute_time += time() - started
+            chunk.append(item)
+            if len(chunk) == chunk_size:
+                # the chunk is stored before its last item is passed on, so
+                # all items the consumer has seen are resumable
+                self._storage.write_execution_chunk(execution, completed, chunk)
+                completed, chunk = completed + 1, []
+            yield item
+        if len(chunk) > 0:
+            self._storage.write_execution_chunk(execution, completed, chunk)
+            completed += 1
+        execution.set_result(StoredStream(completed))
+        execution.set_statistics(time=compute_time, own_time=compute_time)
+        with self.lock(execution):
+            self._storage.write_execution_result(execution)
+        with self.lock(execution.function):
+            self._storage.write_function(execution.function)
+        if self._entries is not None:
+            self._entries += 1
+            if self._entries > self._max_entries:
+                self._evict()
+
+    def _evict(self):
+        with self.lock():
+            self._storage.collect_garbage(max_entries=self._max_entries // 2)
+            self._entries = min(self._entries, self._max_entries // 2)
+
     def _get_execution_dependencies_max_time(self, execution):
         times = [self._storage.read_execution_time(d) for d in execution.dependencies]
         times = [(t if t is not None else float('inf')) for t in times]
@@ -166,10 +644,80 @@ class StorageCacheProvider(CacheProvider):
         return max(times)
 
 
+class StorageWriter:
+
+    """
+    Background writer persisting already computed executions to the given
+    storage (write-behind). The number of executions waiting to be written is
+    bounded, so the callers are blocked when the writer can not keep up.
+
+    The executions are written in the order they were submitted, i.e.,
+    dependencies are always persisted before executions depending on them.
+    Since the results are serialized in the background, they should not be
+    modified after they are returned to the caller.
+    """
+
+    def __init__(self, storage, locker, max_pending=100):
+        self._storage = storage
+        self._locker = locker
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        self._thread = None
+
+    def submit(self, execution):
+        execution_name = execution.name
+        with self._pending_lock:
+            self._pending[execution_name] = execution
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='spiderpig-writer', daemon=True)
+                self._thread.start()
+                _WRITERS.add(self)
+        self._queue.put((execution_name, execution))
+
+    def pending(self, execution):
+        with self._pending_lock:
+            return self._pending.get(execution.name)
+
+    def flush(self):
+        self._queue.join()
+
+    def _run(self):
+        while True:
+            execution_name, execution = self._queue.get()
+            try:
+                # the execution can be computed (and written) by another
+                # process at the same time
+                with self._locker.lock(execution):
+                    self._storage.write_execution_result(execution)
+                with self._locker.lock(execution.function):
+                    self._storage.write_function(execution.function)
+            except Exception as e:
+                print_warn('Can not persist execution {}: {}'.format(execution_name, e))
+            finally:
+                with self._pending_lock:
+                    if self._pending.get(execution_name) is execution:
+                        del self._pending[execution_name]
+                self._queue.task_done()
+
+
+# writers with a running thread, their pending executions are persisted
+# before the process exits
+_WRITERS = weakref.WeakSet()
+
+
+def _flush_writers():
+    for writer in list(_WRITERS):
+        writer.flush()
+
+
+atexit.register(_flush_writers)
+
+
 class Storage(metaclass=abc.ABCMeta):
 
     @abc.abstractmethod
-    def delete_execution_result(self, execution):
+    def delete_execution_result(self, execution, invalidate_dependents=True):
         pass
 
     @abc.abstractmethod
@@ -184,6 +732,22 @@ class Storage(metaclass=abc.ABCMeta):
     def read_execution_result(self, execution):
         pass
 
+    @abc.abstractmethod
+    def write_execution_chunk(self, execution, index, items):
+        pass
+
+    @abc.abstractmethod
+    def read_execution_chunks(self, execution, chunks):
+        pass
+
+    @abc.abstractmethod
+    def count_execution_chunks(self, execution):
+        pass
+
+    @abc.abstractmethod
+    def start_execution_stream(self, execution, chunk_size):
+        pass
+
     @abc.abstractmethod
     def read_execution_time(self, execution):
         pass
@@ -196,6 +760,26 @@ class Storage(metaclass=abc.ABCMeta):
     def is_execution_ready(self, execution):
         pass
 
+    @abc.abstractmethod
+    def is_execution_dirty(self, execution):
+        pass
+
+    @abc.abstractmethod
+    def invalidate(self, execution_names):
+        pass
+
+    @abc.abstractmethod
+    def collect_garbage(self, max_entries=None, max_bytes=None):
+        pass
+
+    @abc.abstractmethod
+    def write_working_set(self, execution_names):
+        pass
+
+    @abc.abstractmethod
+    def read_working_set(self):
+        pass
+
     @abc.abstractmethod
     def read_info(self):
         pass
@@ -216,28 +800,200 @@ class Storage(metaclass=abc.ABCMeta):
     def read_functions(self):
         pass
 
+    @abc.abstractmethod
+    def read_function_info(self, function_name):
+        pass
+
+    @abc.abstractmethod
+    def read_function_infos(self):
+        pass
+
     @abc.abstractmethod
     def clear(self):
         pass
 
+    def close(self):
+        """
+        Release the resources held by the storage, it can be used again
+        afterwards.
+        """
+        pass
+
+    def write_execution_profile(self, execution, stats, summary):
+        """
+        Store the profile of the computed execution (see
+        spiderpig.profiling). Storages which do not support profiles ignore
+        it.
+        """
+        pass
+
+    def read_profiles(self, function):
+        """
+        Summaries of the stored profiles of the executions of the given
+        function, the latest first.
+        """
+        return []
+
 
 class FileStorage(Storage):
 
+    """
+    Storage persisting executions as files. By default, the executions of
+    one function are sharded into subdirectories by the prefix of their hash
+    (e.g., 'module/function/ab/cd/abcd...'), so the directories stay small
+    even for hundreds of thousands of executions. Caches created with the
+    older flat layout can be converted by FileStorage.migrate().
+
+    Each execution keeps the names of executions depending on it (the
+    '.execution.dependents' file). When the execution is rewritten or
+    deleted, its dependents are transitively marked dirty
+    ('.execution.dirty'), so the validity of a cached execution is checked
+    without reading its dependencies. Caches created before the index was
+    introduced get it by FileStorage.migrate().
+
+    Items yielded by generator functions are stored in numbered chunks
+    ('.execution.chunk.000000.pickle', ...) written as the stream is
+    consumed, the result itself only refers to them (see StoredStream).
+    """
+
+    LAYOUT_FLAT = 1
+    LAYOUT_SHARDED = 2
+
     def __init__(self, directory, verbosity=Verbosity.INFO):
         self._directory = directory
         self._verbosity = verbosity
+        self._layout = None
+        self._migrating = False
+        self._indexed = None
+        self._layout_time = None
+
+    @property
+    def directory(self):
+        return self._directory
 
-    def delete_execution_result(self, execution):
-        for filename in [self._get_filename(execution.name, 'execution.info.pickle'), self._get_filename(execution.name, 'execution.pickle')]:
+    @property
+    def layout(self):
+        if self._layout is None:
+            self._refresh_layout()
+        return self._layout
+
+    @property
+    def indexed(self):
+        if self._indexed is None:
+            self._refresh_layout()
+        return self._indexed
+
+    def delete_execution_result(self, execution, invalidate_dependents=True):
+        """
+        Delete the stored execution. If the dependents are not invalidated
+        (e.g., when the execution is evicted), its index of dependents is
+        kept, so they are invalidated once the execution is written again.
+        """
+        object_name = self._find_execution(execution)
+        if object_name is None:
+            return
+        extensions = ['execution.ready', 'execution.info.pickle', 'execution.pickle', 'execution.dirty']
+        if invalidate_dependents:
+            self._mark_dependents_dirty(object_name)
+            extensions.append('execution.dependents')
+        filenames = [self._get_filename(object_name, extension) for extension in extensions]
+        for filename in filenames + list(iglob(self._get_filename(object_name, 'execution.chunk.*'))):
             try:
                 os.remove(filename)
             except OSError:
                 pass
 
+    def collect_garbage(self, max_entries=None, max_bytes=None):
+        """
+        Delete executions until there are at most the given number of them
+        and they take at most the given number of bytes. The executions
+        saving the least compute time per byte are deleted first, the older
+        ones in case of a tie.
+
+        Returns
+        -------
+        number of deleted executions
+        """
+        entries = []
+        for execution in self.read_executions():
+            execution_time = self.read_execution_time(execution)
+            if execution_time is None:
+                continue
+            size = execution.size if execution.size is not None else _getsize(self._get_execution_filename(execution, 'execution.pickle'))
+            entries.append((retention_value(execution.time, size), execution_time, size, execution))
+        entries.sort(key=lambda x: x[:2])
+        count, total_size, deleted = len(entries), sum(e[2] for e in entries), 0
+        for _, _, size, execution in entries:
+            if (max_entries is None or count <= max_entries) and (max_bytes is None or total_size <= max_bytes):
+                break
+            # a deleted execution does not make executions depending on it
+            # invalid, (unindexed caches check the dependencies anyway)
+            self.delete_execution_result(execution, invalidate_dependents=False)
+            count, total_size, deleted = count - 1, total_size - size, deleted + 1
+        return deleted
+
+    def is_execution_dirty(self, execution):
+        object_name = self._find_execution(execution)
+        return object_name is None or os.path.exists(self._get_filename(object_name, 'execution.dirty'))
+
+    def invalidate(self, execution_names):
+        """
+        Mark the given executions and all executions depending on them dirty.
+
+        Returns
+        -------
+        set of names of invalidated executions
+        """
+        invalidated = set()
+        for execution_name in execution_names:
+            for object_name in self._get_execution_object_names(execution_name):
+                if self._is_ready(object_name):
+                    self._write_dirty(object_name)
+                    invalidated.add(execution_name)
+                    invalidated |= self._mark_dependents_dirty(object_name)
+        return invalidated
+
+    def rebuild_index(self):
+        """
+        Build the index of dependents from the stored executions. The
+        executions which are stale according to the modification times of
+        their dependencies are marked dirty.
+
+        Returns
+        -------
+        number of indexed executions
+        """
+        indexed = 0
+        stale_object_names = []
+        for path in Path(self._directory).glob(os.path.join('**', '*.execution.info.pickle')):
+            object_name = os.path.relpath(str(path), self._directory)[:-len('.execution.info.pickle')].replace(os.sep, '.')
+            execution_time = _getmtime(self._get_filename(object_name, 'execution.pickle'))
+            try:
+                with open(str(path), 'rb') as f:
+                    execution = Execution.from_serializable(pickle.load(f))
+            except TooManyDependencies:
+                stale_object_names.append(object_name)
+                continue
+            stale = False
+            for dependency in execution.dependencies:
+                self._add_dependent(dependency, execution.name)
+                dependency_time = self.read_execution_time(dependency)
+                stale = stale or dependency_time is None or dependency_time > execution_time
+            if stale:
+                stale_object_names.append(object_name)
+            indexed += 1
+        for object_name in stale_object_names:
+            self._write_dirty(object_name)
+        # the dependents are known only after all executions are indexed
+        for object_name in stale_object_names:
+            self._mark_dependents_dirty(object_name)
+        self.write_info(dependents_index=True)
+        self._refresh_layout()
+        return indexed
+
     def write_execution(self, execution):
-        filename = self._get_filename(execution.name, 'execution.info.pickle', prepare=True)
-        with open(filename, 'wb') as f:
-            pickle.dump(execution.to_serializable(), f)
+        filename = self._get_execution_filename(execution, 'execution.info.pickle', prepare=True)
+        _atomic_write(filename, lambda f: pickle.dump(execution.to_serializable(), f))
 
     def write_function(self, function):
         filename = self._get_filename(function.name, 'function.info.pickle', prepare=True)
@@ -245,41 +1001,165 @@ class FileStorage(Storage):
         if os.path.exists(filename):
             with open(filename, 'rb') as f:
                 old_serializable = pickle.load(f)
-        with open(filename, 'wb') as f:
-            pickle.dump(Function.merge_serializables(function.to_serializable(), old_serializable), f)
+        serializable = Function.merge_serializables(function.to_serializable(), old_serializable)
+        _atomic_write(filename, lambda f: pickle.dump(serializable, f))
 
     def write_execution_ready(self, execution):
-        filename = self._get_filename(execution.name, 'execution.ready', prepare=True)
-        open(filename, 'a').close()
+        filename = self._get_execution_filename(execution, 'execution.ready', prepare=True)
+        _atomic_write(filename, lambda f: None)
 
     def is_execution_ready(self, execution):
-        return os.path.exists(self._get_filename(execution.name, 'execution.ready', prepare=False))
+        return self._find_execution(execution) is not None
 
     def write_execution_result(self, execution):
+        if self.layout == FileStorage.LAYOUT_FLAT:
+            # the layout is checked again under the lock, so nothing is
+            # written to the flat layout once the migration has started
+            with self._layout_lock():
+                self._refresh_layout()
+                return self._write_execution_result(execution)
+        return self._write_execution_result(execution)
+
+    def _write_execution_result(self, execution):
         execution_result = execution()
-        filename = self._get_filename(execution.name, 'execution.pickle', prepare=True)
-        with open(filename, 'wb') as f:
-            pickle.dump(execution_result, f)
+        filename = self._get_execution_filename(execution, 'execution.pickle', prepare=True)
+        _atomic_write(filename, lambda f: pickle.dump(execution_result, f))
+        size = _getsize(filename)
+        if isinstance(execution_result, StoredStream):
+            size += sum(_getsize(self._get_execution_filename(execution, _chunk_extension(i))) for i in range(execution_result.chunks))
+        execution.set_statistics(size=size)
         self.write_execution(execution)
         self.write_execution_ready(execution)
+        self._index_written(execution)
+
+    def write_execution_profile(self, execution, stats, summary):
+        """
+        Store the profile statistics (readable by pstats) and its summary
+        next to the execution. Only the latest profiles of each execution
+        are kept, the older ones are deleted.
+        """
+        prefix = 'profile.{:020d}'.format(int(summary['started'] * 1e9))
+        _atomic_write(self._get_execution_filename(execution, prefix + '.pstats', prepare=True), lambda f: marshal.dump(stats, f))
+        _atomic_write(self._get_execution_filename(execution, prefix + '.pickle'), lambda f: pickle.dump(summary, f))
+        for filename in sorted(iglob(self._get_execution_filename(execution, 'profile.*.pickle')))[:-PROFILE_HISTORY]:
+            for old in [filename, filename[:-len('.pickle')] + '.pstats']:
+                try:
+                    os.remove(old)
+                except FileNotFoundError:
+                    pass
+
+    def read_profiles(self, function):
+        """
+        Summaries of the stored profiles of the executions of the given
+        function, the latest first. Each summary contains the path to the
+        profile statistics under the key 'stats_filename'.
+        """
+        function_directory = os.path.join(self._directory, function.name.replace('.', os.sep))
+        patterns = []
+        if self.layout == FileStorage.LAYOUT_SHARDED:
+            patterns.append(os.path.join(function_directory, '*', '*', '*.profile.*.pickle'))
+        if self.layout == FileStorage.LAYOUT_FLAT or self._migrating:
+            patterns.append(os.path.join(function_directory, '*.profile.*.pickle'))
+        profiles = []
+        for filename in (path for pattern in patterns for path in iglob(pattern)):
+            try:
+                with open(filename, 'rb') as f:
+                    summary = pickle.load(f)
+            except FileNotFoundError:
+                # deleted by the process storing a newer profile
+                continue
+            summary['stats_filename'] = filename[:-len('.pickle')] + '.pstats'
+            profiles.append(summary)
+        return sorted(profiles, key=lambda p: -p['started'])
+
+    def _index_written(self, execution):
+        # the stored execution is valid, unlike the executions depending on
+        # its previous version
+        object_name = self._get_execution_object_names(execution.name)[0]
+        try:
+            os.remove(self._get_filename(object_name, 'execution.dirty'))
+        except FileNotFoundError:
+            pass
+        execution_name = execution.name
+        for dependency in execution.dependencies:
+            self._add_dependent(dependency, execution_name)
+        self._mark_dependents_dirty(object_name)
 
     def read_execution_result(self, execution):
-        if not self.is_execution_ready(execution):
+        object_name = self._find_execution(execution)
+        if object_name is None:
             return None
-        filename = self._get_filename(execution.name, 'execution.pickle')
+        filename = self._get_filename(object_name, 'execution.pickle')
         with open(filename, 'rb') as f:
             return pickle.load(f)
 
+    def write_execution_chunk(self, execution, index, items):
+        filename = self._get_execution_filename(execution, _chunk_extension(index), prepare=True)
+        _atomic_write(filename, lambda f: pickle.dump(items, f))
+
+    def read_execution_chunks(self, execution, chunks):
+        """
+        Lazily read items stored in the given number of the first chunks.
+        Only one chunk is loaded at a time.
+        """
+        object_name = self._get_execution_object_names(execution.name)[0]
+        for index in range(chunks):
+            with open(self._get_filename(object_name, _chunk_extension(index)), 'rb') as f:
+                items = pickle.load(f)
+            yield from items
+
+    def count_execution_chunks(self, execution):
+        """
+        Number of consecutive chunks stored for the given execution, e.g.,
+        by the run which was interrupted.
+        """
+        object_name = self._get_execution_object_names(execution.name)[0]
+        chunks = 0
+        while os.path.exists(self._get_filename(object_name, _chunk_extension(chunks))):
+            chunks += 1
+        return chunks
+
+    def start_execution_stream(self, execution, chunk_size):
+        """
+        Prepare storing the chunks of the given size for the given execution.
+        The chunks stored by an interrupted run are kept only if they have
+        the same size, otherwise their items could not be skipped.
+
+        Returns
+        -------
+        number of chunks which can be resumed
+        """
+        object_name = self._get_execution_object_names(execution.name)[0]
+        size_filename = self._get_filename(object_name, 'execution.chunk.size.pickle', prepare=True)
+        completed = self.count_execution_chunks(execution)
+        if completed > 0:
+            try:
+                with open(size_filename, 'rb') as f:
+                    stored_chunk_size = pickle.load(f)
+            except FileNotFoundError:
+                stored_chunk_size = None
+            if stored_chunk_size == chunk_size:
+                return completed
+            for filename in iglob(self._get_filename(object_name, 'execution.chunk.*')):
+                try:
+                    os.remove(filename)
+                except FileNotFoundError:
+                    pass
+        _atomic_write(size_filename, lambda f: pickle.dump(chunk_size, f))
+        return 0
+
     def read_execution_time(self, execution):
-        if not self.is_execution_ready(execution):
+        object_name = self._find_execution(execution)
+        if object_name is None:
             return None
-        filename = self._get_filename(execution.name, 'execution.pickle')
+        filename = self._get_filename(object_name, 'execution.pickle')
         return os.path.getmtime(filename)
 
     def read_execution(self, execution):
-        if not self.is_execution_ready(execution):
+        object_name = self._find_execution(execution)
+        if object_name is None:
             return None
-        filename = self._get_filename(execution.name, 'execution.info.pickle')
+        filename = self._get_filename(object_name, 'execution.info.pickle')
         with open(filename, 'rb') as f:
             return Execution.from_serializable(pickle.load(f))
 
@@ -287,11 +1167,61 @@ class FileStorage(Storage):
         if function is None:
             walker = Path(self._directory).glob(os.path.join('**', '*.execution.info.pickle'))
         else:
-            walker = iglob(os.path.join(self._directory, function.name.replace('.', os.sep), '*.execution.info.pickle'))
+            function_directory = os.path.join(self._directory, function.name.replace('.', os.sep))
+            patterns = []
+            if self.layout == FileStorage.LAYOUT_SHARDED:
+                patterns.append(os.path.join(function_directory, '*', '*', '*.execution.info.pickle'))
+            if self.layout == FileStorage.LAYOUT_FLAT or self._migrating:
+                patterns.append(os.path.join(function_directory, '*.execution.info.pickle'))
+            walker = (path for pattern in patterns for path in iglob(pattern))
         for path in walker:
             with open(str(path), 'rb') as f:
                 yield Execution.from_serializable(pickle.load(f))
 
+    def migrate(self):
+        """
+        Move executions stored in the flat layout to the sharded one. The
+        cache can be used by other processes during the migration, entries
+        which are just being moved are considered to be missing.
+
+        Returns
+        -------
+        number of moved executions
+        """
+        with self._layout_lock():
+            self.write_info(layout=FileStorage.LAYOUT_SHARDED, migrating=True)
+        self._refresh_layout()
+        moved = 0
+        for ready_filename in list(Path(self._directory).glob(os.path.join('**', '*.execution.ready'))):
+            directory, filename = os.path.split(str(ready_filename))
+            execution_hash = filename[:-len('.execution.ready')]
+            if directory.endswith(os.path.join(execution_hash[:2], execution_hash[2:4])):
+                continue
+            target_directory = os.path.join(directory, execution_hash[:2], execution_hash[2:4])
+            os.makedirs(target_directory, exist_ok=True)
+            os.remove(str(ready_filename))
+            # e.g., profiles of the execution
+            for sidecar in iglob(os.path.join(directory, '{}.*'.format(execution_hash))):
+                os.replace(sidecar, os.path.join(target_directory, os.path.basename(sidecar)))
+            _atomic_write(os.path.join(target_directory, filename), lambda f: None)
+            moved += 1
+        self.write_info(migrating=False)
+        self._refresh_layout()
+        if not self.indexed:
+            self.rebuild_index()
+        return moved
+
+    def write_working_set(self, execution_names):
+        filename = self._get_filename('working_set', 'pickle', prepare=True)
+        _atomic_write(filename, lambda f: pickle.dump(list(execution_names), f))
+
+    def read_working_set(self):
+        filename = self._get_filename('working_set', 'pickle')
+        if not os.path.exists(filename):
+            return None
+        with open(filename, 'rb') as f:
+            return pickle.load(f)
+
     def read_info(self):
         filename = self._get_filename('info', 'pickle')
         if not os.path.exists(filename):
@@ -307,11 +1237,14 @@ class FileStorage(Storage):
 
     def write_info(self, **kwargs):
         info = self.read_info()
+        if 'dependents_index' not in info:
+            info['dependents_index'] = len(info) == 0
+        if 'layout' not in info:
+            info['layout'] = self.layout
         for key, value in kwargs.items():
             info[key] = value
         filename = self._get_filename('info', 'pickle', prepare=True)
-        with open(filename, 'wb') as f:
-            pickle.dump(info, f)
+        _atomic_write(filename, lambda f: pickle.dump(info, f))
 
     def clear(self):
         for f in iglob(os.path.join(self._directory, '*')):
@@ -325,15 +1258,244 @@ class FileStorage(Storage):
             with open(str(path), 'rb') as f:
                 yield Function.from_serializable(pickle.load(f))
 
+    def read_function_infos(self):
+        """
+        Stored information about all functions, see read_function_info.
+        """
+        for path in Path(self._directory).glob(os.path.join('**', '*.function.info.pickle')):
+            with open(str(path), 'rb') as f:
+                yield pickle.load(f)
+
+    def read_function_info(self, function_name):
+        """
+        Stored information about the function (its code fingerprint and the
+        names of functions it depends on) read without importing it, or None.
+        """
+        try:
+            with open(self._get_filename(function_name, 'function.info.pickle'), 'rb') as f:
+                return pickle.load(f)
+        except FileNotFoundError:
+            return None
+
+    def recover(self, grace_period=60, workers=8, quarantine=True):
+        """
+        Find partial entries (e.g., left by killed processes) and move them
+        to the quarantine directory, so they do not break readers. The
+        pickles are not loaded, only their presence, age and the final STOP
+        opcode are checked. The directories are scanned in parallel.
+
+        Parameters
+        ----------
+        grace_period: float, default 60
+            unfinished entries younger than the given number of seconds are
+            considered to be still written by another process
+        workers: int, default 8
+            number of threads scanning the directories
+        quarantine: bool, default True
+            if False, the partial entries are only reported
+
+        Returns
+        -------
+        list of paths to the partial files
+        """
+        directories = []
+        for root, dirs, _ in os.walk(self._directory):
+            dirs[:] = [d for d in dirs if not d.startswith('.')]
+            directories.append(root)
+        now = time()
+        pool = ThreadPool(workers)
+        try:
+            partial = [p for found in pool.map(lambda d: self._find_partial_files(d, now - grace_period), directories) for p in found]
+        finally:
+            pool.close()
+        if quarantine:
+            for path in partial:
+                target = os.path.join(self._directory, '.quarantine', os.path.relpath(path, self._directory) + '.quarantined')
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                try:
+                    os.replace(path, target)
+                except FileNotFoundError:
+                    pass
+        return partial
+
+    def _find_partial_files(self, directory, created_before):
+        entries = defaultdict(dict)
+        partial = []
+        for filename in os.listdir(directory):
+            path = os.path.join(directory, filename)
+            if filename.startswith('.') and filename.endswith('.tmp'):
+                if _getmtime(path) < created_before:
+                    partial.append(path)
+            elif filename.endswith('.function.info.pickle') or filename == 'info.pickle':
+                if not _is_complete_pickle(path):
+                    partial.append(path)
+            elif '.execution.' in filename:
+                entry, extension = filename.split('.execution.', 1)
+                entries[entry][extension] = path
+        for files in entries.values():
+            if all(e in ['dependents', 'dirty'] for e in files):
+                # the index of dependents can exist without the execution
+                continue
+            if 'ready' not in files and all(e in ['dependents', 'dirty'] or (e.startswith('chunk.') and _is_complete_pickle(f)) for e, f in files.items()):
+                # complete chunks of an interrupted stream are resumed later
+                continue
+            if 'ready' in files:
+                broken = any(e not in files or not _is_complete_pickle(files[e]) for e in ['pickle', 'info.pickle'])
+            else:
+                broken = all(_getmtime(f) < created_before for f in files.values())
+            if broken:
+                partial += sorted(files.values())
+        return partial
+
+    def _refresh_layout(self):
+        info = self.read_info()
+        self._layout = info.get('layout', FileStorage.LAYOUT_FLAT if len(info) > 0 else FileStorage.LAYOUT_SHARDED)
+        self._migrating = info.get('migrating', False)
+        self._indexed = info.get('dependents_index', len(info) == 0)
+        self._layout_time = time()
+
+    def _layout_lock(self):
+        return filelock.FileLock(self._get_filename('layout', 'lock', prepare=True))
+
+    def _add_dependent(self, execution, dependent_name):
+        object_name = self._get_execution_object_names(execution.name)[0]
+        # the dependent is rewritten whenever it is recomputed, it is added
+        # only once so the file does not grow
+        if dependent_name in self._read_dependents(object_name):
+            return
+        filename = self._get_filename(object_name, 'execution.dependents', prepare=True)
+        # appending a short line is atomic, so concurrent writers do not need
+        # to be synchronized (at worst, both of them append the same line)
+        with open(filename, 'a') as f:
+            f.write(dependent_name + '\n')
+
+    def _read_dependents(self, object_name):
+        try:
+            with open(self._get_filename(object_name, 'execution.dependents'), 'r') as f:
+                return {line.strip() for line in f if line.strip()}
+        except FileNotFoundError:
+            return set()
+
+    def _mark_dependents_dirty(self, object_name):
+        marked = set()
+        to_mark = [object_name]
+        while len(to_mark) > 0:
+            for dependent_name in self._read_dependents(to_mark.pop()):
+                if dependent_name in marked:
+                    continue
+                for dependent_object_name in self._get_execution_object_names(dependent_name):
+                    dirty_filename = self._get_filename(dependent_object_name, 'execution.dirty')
+                    if not self._is_ready(dependent_object_name):
+                        continue
+                    marked.add(dependent_name)
+                    # executions depending on a dirty one are already dirty
+                    if not os.path.exists(dirty_filename):
+                        self._write_dirty(dependent_object_name)
+                        to_mark.append(dependent_object_name)
+        return marked
+
+    def _write_dirty(self, object_name):
+        _atomic_write(self._get_filename(object_name, 'execution.dirty', prepare=True), lambda f: None)
+
+    def _is_ready(self, object_name):
+        return os.path.exists(self._get_filename(object_name, 'execution.ready'))
+
+    def _get_execution_object_names(self, execution_name):
+        if self.layout == FileStorage.LAYOUT_FLAT:
+            return [execution_name]
+        function_name, execution_hash = execution_name.rsplit('.', 1)
+        sharded = '{}.{}.{}.{}'.format(function_name, execution_hash[:2], execution_hash[2:4], execution_hash)
+        return [sharded, execution_name] if self._migrating else [sharded]
+
+    def _find_execution(self, execution, refresh=True):
+        for object_name in self._get_execution_object_names(execution.name):
+            if self._is_ready(object_name):
+                return object_name
+        if refresh and (self.layout == FileStorage.LAYOUT_FLAT or self._migrating) and time() - self._layout_time > 1:
+            # the cache may be migrated by another process in the meantime
+            self._refresh_layout()
+            return self._find_execution(execution, refresh=False)
+        return None
+
+    def _get_execution_filename(self, execution, extension, prepare=False):
+        return self._get_filename(self._get_execution_object_names(execution.name)[0], extension, prepare=prepare)
+
     def _get_filename(self, object_name, extension, prepare=False):
         filename = os.path.join(self._directory, '{}.{}'.format(object_name.replace('.', os.sep), extension))
         if prepare:
             directory = os.path.dirname(filename)
             if not os.path.exists(directory):
-                os.makedirs(directory)
+                os.makedirs(directory, exist_ok=True)
         return filename
 
 
+def _atomic_write(filename, dump):
+    """
+    Write the file via a temporary file in the same directory which is
+    synced and renamed, so readers never see a partially written file. The
+    directory is synced as well, so the rename survives a crash of the host.
+    """
+    directory = os.path.dirname(filename)
+    fd, tmp_filename = tempfile.mkstemp(dir=directory, prefix='.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            dump(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_filename, filename)
+    except BaseException:
+        try:
+            os.remove(tmp_filename)
+        except OSError:
+            pass
+        raise
+    directory_fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(directory_fd)
+    finally:
+        os.close(directory_fd)
+
+
+def _chunk_extension(index):
+    return 'execution.chunk.{:06d}.pickle'.format(index)
+
+
+def _is_complete_pickle(filename):
+    try:
+        with open(filename, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == pickle.STOP
+    except OSError:
+        return False
+
+
+def retention_value(compute_time, size):
+    """
+    Compute time saved per byte by keeping the result of the execution.
+    Results with unknown compute time are considered to be cheap.
+    """
+    return (compute_time or 0) / max(size, 1)
+
+
+def _estimate_size(value):
+    nbytes = getattr(value, 'nbytes', None)
+    return nbytes if isinstance(nbytes, int) else sys.getsizeof(value)
+
+
+def _getsize(filename):
+    try:
+        return os.path.getsize(filename)
+    except OSError:
+        return 0
+
+
+def _getmtime(filename):
+    try:
+        return os.path.getmtime(filename)
+    except OSError:
+        return float('inf')
+
+
 class EmptyContext:
 
     def __enter__(self):
@@ -1,6 +1,54 @@
+"""
+Registration and execution of command-line commands. Commands are modules
+with the execute() function whose parameters become command-line options.
+
+The metadata of commands (name, help and options) are read from the source
+code without importing the modules and cached in the '__pycache__'
+directory of the command package, so only the module of the selected
+command is imported. Modules customizing their parser (init_parser(),
+command_name()) are imported when the command is selected or when the
+names of commands can not be determined from arguments (e.g., shell
+completion).
+"""
+
+from spiderpig import msg
+from spiderpig.exceptions import NotInitialized, ValidationError
+from spiderpig.execution import Function
+import ast
+import importlib
 import inspect
+import os
+import pickle
 import pkgutil
-from spiderpig import msg
+import spiderpig
+
+
+MANIFEST_FILENAME = 'spiderpig-commands.pickle'
+# version of the metadata format, bump it when _read_command_info changes
+MANIFEST_VERSION = 1
+
+# registered commands: name -> (function, parser)
+_COMMANDS = {}
+# arguments of the last executed command (including the global ones)
+_ARGS = {}
+# argument parser and setup functions of the running application
+_APPLICATION = {'parser': None, 'setup_functions': []}
+
+
+class LazyCommand:
+
+    """
+    Execute function of the command module which is imported when the
+    command is executed. If the parser of the command is deferred, the
+    module completes it when it is imported.
+    """
+
+    def __init__(self, module_name, deferred_parser=False):
+        self.module_name = module_name
+        self.deferred_parser = deferred_parser
+
+    def load(self):
+        return importlib.import_module(self.module_name).execute
 
 
 def register_submodule_command(subparsers, submodule, namespace=None):
@@ -10,35 +58,98 @@ def register_submodule_command(subparsers, submodule, namespace=None):
         command_name = submodule.__name__.split('.')[-1].replace('_', '-')
     command_name = command_name if namespace is None else '{}-{}'.format(namespace, command_name)
     subparser = subparsers.add_parser(command_name, help=submodule.__doc__)
-    if 'init_parser' in dir(submodule):
-        submodule.init_parser(subparser)
-    else:
-        args, varargs, keywords, defaults = inspect.getargspec(submodule.execute)
-
-        def transform(x):
-            return [] if x is None else x
-        kwargs = dict(zip(args[-len(transform(defaults)):], transform(defaults)))
-        for argname, default in kwargs.items():
-            if isinstance(default, bool):
-                used_argname = argname if not default else 'not-{}'.format(argname)
-                action = 'store_true' if not default else 'store_false'
-                subparser.add_argument('--{}'.format(used_argname.replace('_', '-')), action=action, required=False, help='default: {}'.format(default), dest=argname)
-            else:
-                subparser.add_argument('--{}'.format(argname.replace('_', '-')), action='store', default=default, required=False, help='default: {}'.format(default), dest=argname)
-        for argname in args:
-            if argname not in kwargs:
-                subparser.add_argument('--{}'.format(argname), action='store', required=True)
-    subparser.set_defaults(func=submodule.execute)
+    _init_subparser(subparser, submodule)
+    _COMMANDS[command_name] = (submodule.execute, subparser)
+
+
+def register_submodule_commands(subparsers, package, namespace=None, argv=None):
+    """
+    Register commands from the modules of the given package.
+
+    Parameters
+    ----------
+    argv: list
+        command-line arguments; if given, the modules customizing their
+        parser are imported only if their command is among the arguments
+    """
+    selected = None if argv is None else set(argv)
+    for module_name, info in _read_manifest(package).items():
+        if info is None:
+            continue
+        if info['command_name'] is None or (info['eager'] and (selected is None or _namespaced(info['command_name'], namespace) in selected)):
+            submodule = importlib.import_module(module_name)
+            if is_submodule_command(submodule):
+                register_submodule_command(subparsers, submodule, namespace=namespace)
+            continue
+        command_name = _namespaced(info['command_name'], namespace)
+        subparser = subparsers.add_parser(command_name, help=info['help'])
+        if info['eager']:
+            func = LazyCommand(module_name, deferred_parser=True)
+        else:
+            func = LazyCommand(module_name)
+            _add_arguments(subparser, info['args'], info['defaults'])
+        subparser.set_defaults(func=func)
+        _COMMANDS[command_name] = (func, subparser)
+
+
+def registered_command(command_name):
+    """
+    Get the function and the argument parser of the registered command.
+    """
+    if command_name not in _COMMANDS:
+        raise ValidationError('There is no command {}, available: {}'.format(command_name, ', '.join(sorted(_COMMANDS))))
+    func, subparser = _COMMANDS[command_name]
+    if isinstance(func, LazyCommand):
+        submodule = importlib.import_module(func.module_name)
+        if func.deferred_parser:
+            _init_subparser(subparser, submodule)
+        func = submodule.execute
+        _COMMANDS[command_name] = (func, subparser)
+    return func, subparser
+
+
+def load_commands(argv=None):
+    """
+    Import the modules of the registered commands and complete their
+    parsers.
+
+    Parameters
+    ----------
+    argv: list
+        command-line arguments; if given, only the commands among them are
+        loaded
+    """
+    selected = None if argv is None else set(argv)
+    for command_name, (func, _) in list(_COMMANDS.items()):
+        if isinstance(func, LazyCommand) and (selected is None or command_name in selected):
+            registered_command(command_name)
+
+
+def set_application(parser, setup_functions=None):
+    """
+    Remember the argument parser (with registered commands) and the setup
+    functions of the running command-line application.
+    """
+    _APPLICATION['parser'] = parser
+    _APPLICATION['setup_functions'] = [] if setup_functions is None else list(setup_functions)
+
 
+def application():
+    """
+    Argument parser and setup functions of the running command-line
+    application (see set_application).
+    """
+    if _APPLICATION['parser'] is None:
+        raise NotInitialized('There is no running command-line application.')
+    return _APPLICATION['parser'], _APPLICATION['setup_functions']
 
-def register_submodule_commands(subparsers, package, namespace=None):
-    prefix = package.__name__ + "."
-    for importer, module_name, ispkg in pkgutil.iter_modules(package.__path__, prefix):
-        if not ispkg:
-            submodule = importer.find_module(module_name).load_module(module_name)
-            if not is_submodule_command(submodule):
-                continue
-            register_submodule_command(subparsers, submodule, namespace=namespace)
+
+def global_args():
+    """
+    Arguments the running command-line application was started with, except
+    the chosen command.
+    """
+    return {key: value for (key, value) in _ARGS.items() if key != 'func'}
 
 
 def is_submodule_command(submodule):
@@ -49,7 +160,167 @@ def execute(args):
     if 'func' not in args:
         msg.print_error('You have to choose subcommand!')
         return
+    _ARGS.clear()
+    _ARGS.update(args)
+    func, func_args = _command(args)
+    # the command is executed in the execution context, so the functions it
+    # depends on are recorded and can be planned next time
+    spiderpig.execution_context().execute(func, use_cache=False, **func_args)
+    try:
+        storage = spiderpig.storage()
+    except NotInitialized:
+        return
+    function = Function(func)
+    if len(function.dependencies) > 0:
+        with spiderpig.cache_provider().lock(function):
+            storage.write_function(function)
+
+
+def run(command_name, args):
+    """
+    Run the registered command with the given arguments in the current
+    spiderpig context, as if it was run from the command line.
+    """
+    func, _ = registered_command(command_name)
+    with spiderpig.configuration(**args):
+        execute(dict(args, func=func))
+
+
+def plan(args):
+    if 'func' not in args:
+        msg.print_error('You have to choose subcommand!')
+        return
+    func, func_args = _command(args)
+    spiderpig.plan(func, **func_args).print()
+
+
+def _command(args):
     func = args['func']
-    allowed_args = inspect.getargspec(func).args
-    func_args = {key: value for (key, value) in args.items() if key in allowed_args}
-    func(**func_args)
+    if isinstance(func, LazyCommand):
+        func = args['func'] = func.load()
+    Function(func).set_options(cached=False)
+    allowed_args = inspect.getfullargspec(func).args
+    return func, {key: value for (key, value) in args.items() if key in allowed_args}
+
+
+def _namespaced(command_name, namespace):
+    return command_name if namespace is None else '{}-{}'.format(namespace, command_name)
+
+
+def _init_subparser(subparser, submodule):
+    if 'init_parser' in dir(submodule):
+        submodule.init_parser(subparser)
+    else:
+        argspec = inspect.getfullargspec(submodule.execute)
+        _add_arguments(subparser, argspec.args, argspec.defaults)
+    subparser.set_defaults(func=submodule.execute)
+
+
+def _add_arguments(subparser, args, defaults):
+    defaults = [] if defaults is None else defaults
+    kwargs = dict(zip(args[len(args) - len(defaults):], defaults))
+    for argname, default in kwargs.items():
+        if isinstance(default, bool):
+            used_argname = argname if not default else 'not-{}'.format(argname)
+            action = 'store_true' if not default else 'store_false'
+            subparser.add_argument('--{}'.format(used_argname.replace('_', '-')), action=action, required=False, help='default: {}'.format(default), dest=argname)
+        else:
+            subparser.add_argument('--{}'.format(argname.replace('_', '-')), action='store', default=default, required=False, help='default: {}'.format(default), dest=argname)
+    for argname in args:
+        if argname not in kwargs:
+            subparser.add_argument('--{}'.format(argname), action='store', required=True)
+
+
+def _read_manifest(package):
+    """
+    Metadata of the modules of the given package (see _read_command_info).
+    The cached metadata are reused for the modules which have not changed.
+    """
+    manifest_filename = os.path.join(package.__path__[0], '__pycache__', MANIFEST_FILENAME)
+    try:
+        with open(manifest_filename, 'rb') as f:
+            cached = pickle.load(f)
+        if cached.get('version') != MANIFEST_VERSION:
+            cached = {}
+    except Exception:
+        cached = {}
+    cached_modules = cached.get('modules', {})
+    modules = {}
+    changed = False
+    prefix = package.__name__ + '.'
+    for module_info in pkgutil.iter_modules(package.__path__, prefix):
+        if module_info.ispkg:
+            continue
+        path = os.path.join(module_info.module_finder.path, module_info.name[len(prefix):] + '.py')
+        try:
+            stat = os.stat(path)
+        except OSError:
+            # e.g., compiled modules without the source code
+            modules[module_info.name] = (None, {'eager': True, 'command_name': None, 'help': None})
+            continue
+        key = (stat.st_mtime_ns, stat.st_size)
+        if module_info.name in cached_modules and cached_modules[module_info.name][0] == key:
+            modules[module_info.name] = cached_modules[module_info.name]
+        else:
+            modules[module_info.name] = (key, _read_command_info(module_info.name, path))
+            changed = True
+    if changed or set(modules) != set(cached_modules):
+        try:
+            os.makedirs(os.path.dirname(manifest_filename), exist_ok=True)
+            tmp_filename = '{}.{}'.format(manifest_filename, os.getpid())
+            with open(tmp_filename, 'wb') as f:
+                pickle.dump({'version': MANIFEST_VERSION, 'modules': modules}, f)
+            os.replace(tmp_filename, manifest_filename)
+        except OSError:
+            # the package can be installed in a read-only location
+            pass
+    return {module_name: info for module_name, (_, info) in sorted(modules.items())}
+
+
+def _read_command_info(module_name, path):
+    """
+    Read the metadata of the command from the source code of its module.
+
+    Returns
+    -------
+    None if the module is not a command, otherwise a dictionary with keys
+    'command_name', 'help', 'eager' (True if the module has to be imported
+    to register the command), 'args' and 'defaults'
+    """
+    with open(path, 'rb') as f:
+        tree = ast.parse(f.read(), path)
+    functions = {node.name: node for node in tree.body if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef))}
+    assigned = set()
+    for node in tree.body:
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            assigned |= {(alias.asname or alias.name).split('.')[0] for alias in node.names}
+        elif isinstance(node, ast.Assign):
+            assigned |= {target.id for target in node.targets if isinstance(target, ast.Name)}
+        elif isinstance(node, (ast.ClassDef, ast.AnnAssign, ast.AugAssign)):
+            assigned.add(getattr(node, 'name', None) or getattr(getattr(node, 'target', None), 'id', None))
+    info = {
+        'command_name': module_name.split('.')[-1].replace('_', '-'),
+        'help': ast.get_docstring(tree, clean=False),
+        'eager': False,
+        'args': None,
+        'defaults': None,
+    }
+    if 'execute' not in functions:
+        if 'execute' not in assigned and '*' not in assigned:
+            return None
+        info['eager'] = True
+        return info
+    if 'command_name' in functions or 'command_name' in assigned:
+        info['command_name'] = None
+    execute = functions['execute']
+    if any(name in functions or name in assigned for name in ['init_parser', 'command_name', '*']) or len(execute.decorator_list) > 0:
+        info['eager'] = True
+        return info
+    try:
+        info['defaults'] = [ast.literal_eval(default) for default in execute.args.defaults]
+    except ValueError:
+        # defaults are not literals, they are known after the import
+        info['eager'] = True
+        return info
+    info['args'] = [arg.arg for arg in execute.args.posonlyargs + execute.args.args]
+    return info
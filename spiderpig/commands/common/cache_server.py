@@ -0,0 +1,17 @@
+"""
+Run the reference HTTP server of the shared remote cache.
+"""
+
+from spiderpig.remote import CacheServer
+import spiderpig.msg as msg
+
+
+def execute(directory, host='127.0.0.1', port=8642):
+    server = CacheServer(directory, host=host, port=int(port))
+    msg.print_info('Serving the remote cache from {} on {}'.format(directory, server.url))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,18 @@
+"""
+Merge the segment files of the packed cache (see --packed-storage) and
+reclaim the space of rewritten and deleted executions. The cache can be used
+by other processes during the compaction.
+"""
+
+from spiderpig.packed import PackedFileStorage
+import spiderpig.msg as msg
+import spiderpig
+
+
+def execute(min_dead_ratio=0.5):
+    storage = spiderpig.storage()
+    if not isinstance(storage, PackedFileStorage):
+        msg.print_error('The cache is not packed, use --packed-storage.')
+        return
+    compacted, reclaimed = storage.compact(min_dead_ratio=float(min_dead_ratio))
+    msg.print_success('{} segments compacted, {} bytes reclaimed.'.format(compacted, reclaimed))
@@ -0,0 +1,18 @@
+"""
+Delete cached executions until the cache fits the given limits. Executions
+saving the least compute time per byte are deleted first.
+"""
+
+import spiderpig.msg as msg
+import spiderpig
+
+
+def execute(max_entries=None, max_bytes=None):
+    if max_entries is None and max_bytes is None:
+        msg.print_error('You have to specify --max-entries or --max-bytes.')
+        return
+    deleted = spiderpig.storage().collect_garbage(
+        max_entries=None if max_entries is None else int(max_entries),
+        max_bytes=None if max_bytes is None else int(max_bytes)
+    )
+    msg.print_success('{} executions deleted.'.format(deleted))
@@ -0,0 +1,25 @@
+"""
+Invalidate cached executions of the given function (or only one of them) and
+all executions depending on them.
+"""
+
+from spiderpig.execution import Function
+from clint.textui import indent
+import spiderpig.msg as msg
+import spiderpig
+
+
+def execute(function_name, execution_name=None):
+    function = Function.from_name(function_name)
+    if execution_name is None:
+        invalidated = spiderpig.cache_provider().invalidate(function=function)
+    else:
+        executions = [e for e in spiderpig.storage().read_executions(function) if e.name == execution_name]
+        if len(executions) == 0:
+            msg.print_error('There is no cached execution {}.'.format(execution_name))
+            return
+        invalidated = spiderpig.cache_provider().invalidate(executions=executions)
+    msg.print_success('{} executions invalidated.'.format(len(invalidated)))
+    with indent(4):
+        for name in sorted(invalidated):
+            msg.print_info(name)
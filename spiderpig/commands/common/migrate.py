@@ -0,0 +1,13 @@
+"""
+Convert the cache to the current storage format (sharded layout and index of
+dependents). The cache can be used by other processes during the migration.
+"""
+
+import spiderpig.msg as msg
+import spiderpig
+
+
+def execute():
+    storage = spiderpig.storage()
+    moved = storage.migrate()
+    msg.print_success('{} executions moved to the sharded layout, the index of dependents is up to date.'.format(moved))
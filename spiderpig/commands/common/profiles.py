@@ -0,0 +1,64 @@
+"""
+Show the hot spots of the last profiled run of the given function, or diff
+them with the previous run (see --profile-functions).
+"""
+
+from spiderpig.execution import Function
+from spiderpig.profiling import hot_spots
+from clint.textui import indent
+from datetime import datetime
+import marshal
+import spiderpig.msg as msg
+import spiderpig
+
+
+def execute(function_name, top=20, diff=False, sort='cumulative'):
+    profiles = spiderpig.storage().read_profiles(Function.from_name(function_name))
+    if len(profiles) < (2 if diff else 1):
+        msg.print_error('There {} profiled run(s) of {}, run it with --profile-functions.'.format(
+            'is only one' if len(profiles) == 1 else 'are no', function_name
+        ))
+        return
+    top = int(top)
+    last = profiles[0]
+    if not diff:
+        _print_profile(last)
+        with indent(4):
+            msg.print_info('{:>10} {:>10} {:>10}  function'.format('cumulative', 'total', 'calls'))
+            for function, calls, total_time, cumulative_time in hot_spots(_read_stats(last), sort=sort, top=top):
+                msg.print_info('{:>9.3f}s {:>9.3f}s {:>10}  {}'.format(cumulative_time, total_time, calls, function))
+        return
+    previous = profiles[1]
+    msg.print_info('Previous run:')
+    with indent(4):
+        _print_profile(previous)
+    msg.print_info('Last run:')
+    with indent(4):
+        _print_profile(last)
+    previous_times = {function: cumulative_time for function, _, _, cumulative_time in hot_spots(_read_stats(previous), top=None)}
+    last_times = {function: cumulative_time for function, _, _, cumulative_time in hot_spots(_read_stats(last), top=None)}
+    changes = sorted(
+        ((last_times.get(f, 0) - previous_times.get(f, 0), f) for f in set(previous_times) | set(last_times)),
+        key=lambda change: -abs(change[0])
+    )
+    msg.print_info('Largest changes of the cumulative time:')
+    with indent(4):
+        for change, function in changes[:top]:
+            msg.print_info('{:>+9.3f}s {:>9.3f}s -> {:>9.3f}s  {}'.format(change, previous_times.get(function, 0), last_times.get(function, 0), function))
+
+
+def _print_profile(profile):
+    msg.print_info('{} computed at {} in {:.3f}s, peak memory {:.1f} MiB'.format(
+        profile['execution'],
+        datetime.fromtimestamp(profile['started']).strftime('%Y-%m-%d %H:%M:%S'),
+        profile['time'],
+        profile['peak_memory'] / 2 ** 20,
+    ))
+    with indent(4):
+        for line, size, count in profile['retained_allocations'][:3]:
+            msg.print_info('{:.1f} MiB in {} blocks retained from {}'.format(size / 2 ** 20, count, line))
+
+
+def _read_stats(profile):
+    with open(profile['stats_filename'], 'rb') as f:
+        return marshal.load(f)
@@ -0,0 +1,19 @@
+"""
+Find partial cache entries left by crashed processes and move them to the
+quarantine directory.
+"""
+
+from clint.textui import indent
+import spiderpig.msg as msg
+import spiderpig
+
+
+def execute(grace_period=60, workers=8, report_only=False):
+    partial = spiderpig.storage().recover(grace_period=float(grace_period), workers=int(workers), quarantine=not report_only)
+    if len(partial) == 0:
+        msg.print_success('There are no partial entries.')
+        return
+    msg.print_warn('Partial entries{}:'.format('' if report_only else ' (quarantined)'))
+    with indent(4):
+        for path in partial:
+            msg.print_info(path)
@@ -0,0 +1,20 @@
+"""
+Run the daemon serving commands of this application over a Unix socket
+with warm caches; run commands in it by spiderpig-cli.py --connect SOCKET
+<command> ....
+"""
+
+from spiderpig.daemon import Daemon, WORKERS
+import os
+import spiderpig
+import spiderpig.commands as commands
+
+
+def execute(socket=None, workers=WORKERS):
+    if socket is None:
+        socket = os.path.join(spiderpig.storage().directory, 'daemon.sock')
+    parser, setup_functions = commands.application()
+    if commands.global_args().get('prewarm'):
+        # the workers inherit the loaded results
+        spiderpig.cache_provider().prewarm(wait=True)
+    Daemon(socket, parser, setup_functions, workers=int(workers)).serve_forever()
@@ -0,0 +1,159 @@
+"""
+Run the given command for many argument sets in parallel processes sharing
+one cache. The argument sets are given as a grid (e.g., --grid a=1,2,3
+--grid b=x,y) and/or as a YAML list of dictionaries. With --distributed,
+they are enqueued for spiderpig-worker processes instead.
+"""
+
+from itertools import product
+from multiprocessing import Pool
+from spiderpig.distributed import POLL_INTERVAL, Task, WorkQueue
+from spiderpig.exceptions import ValidationError
+from spiderpig.fingerprint import fingerprint
+from time import sleep, time
+import os
+import spiderpig
+import spiderpig.commands as commands
+import spiderpig.config as config
+import spiderpig.msg as msg
+import yaml
+
+
+_SWEEP_ARGS = ['command', 'grid', 'arguments', 'workers', 'distributed']
+
+
+def init_parser(parser):
+    parser.add_argument(
+        '--command',
+        action='store',
+        dest='command',
+        required=True,
+        help='name of the command to run, e.g., my-command')
+    parser.add_argument(
+        '--grid',
+        action='append',
+        dest='grid',
+        default=None,
+        help='NAME=VALUE1,VALUE2,...; the cartesian product of all grids is run')
+    parser.add_argument(
+        '--arguments',
+        action='store',
+        dest='arguments',
+        default=None,
+        help='path to the YAML file containing the list of argument sets')
+    parser.add_argument(
+        '--workers',
+        action='store',
+        dest='workers',
+        type=int,
+        default=os.cpu_count(),
+        help='number of worker processes, default: number of CPUs')
+    parser.add_argument(
+        '--distributed',
+        action='store_true',
+        dest='distributed',
+        default=False,
+        help='enqueue the argument sets for spiderpig-worker processes')
+
+
+def execute(command, grid=None, arguments=None, workers=None, distributed=False):
+    function, parser = commands.registered_command(command)
+    argument_sets = load_argument_sets(grid, arguments)
+    defaults = {a.dest: a.default for a in parser._actions if a.dest != 'help'}
+    required = {a.dest for a in parser._actions if a.required}
+    for argument_set in argument_sets:
+        missing = required - set(argument_set)
+        if len(missing) > 0:
+            raise ValidationError('The argument set {} does not contain required {}.'.format(argument_set, ', '.join(sorted(missing))))
+    global_args = {k: v for (k, v) in commands.global_args().items() if k not in _SWEEP_ARGS}
+    # the results computed so far have to be visible to the workers
+    spiderpig.cache_provider().flush()
+    tasks = [(command, dict(defaults, **argument_set)) for argument_set in argument_sets]
+    started = time()
+    finished, failed, total_time = 0, 0, 0
+    if distributed:
+        msg.print_info('Enqueuing {} argument sets of {} for workers.'.format(len(argument_sets), command))
+        outcomes = _run_distributed(tasks)
+    else:
+        msg.print_info('Running {} argument sets of {} in {} processes.'.format(len(argument_sets), command, workers))
+        pool = Pool(workers, initializer=_init_worker, initargs=(global_args,))
+        outcomes = pool.imap_unordered(_run, enumerate(tasks))
+    try:
+        for index, elapsed, error in outcomes:
+            finished += 1
+            total_time += elapsed or 0
+            if error is None:
+                msg.print_success('[{}/{}] {} done in {:.3f}s'.format(finished, len(tasks), _format_args(argument_sets[index]), elapsed or 0))
+            else:
+                failed += 1
+                msg.print_error('[{}/{}] {} failed in {:.3f}s: {}'.format(finished, len(tasks), _format_args(argument_sets[index]), elapsed or 0, error))
+    finally:
+        if not distributed:
+            pool.close()
+            pool.join()
+    wall_time = time() - started
+    msg.print_info('Finished {} argument sets ({} failed) in {:.3f}s, {:.3f}s of work, speedup {:.2f}x.'.format(
+        finished, failed, wall_time, total_time, total_time / wall_time if wall_time > 0 else 1
+    ))
+
+
+def load_argument_sets(grid=None, arguments=None):
+    """
+    Build the list of argument sets from the YAML file and the grid. When
+    both are given, each argument set from the file is combined with each
+    point of the grid.
+
+        >>> load_argument_sets(['a=1,2', 'b=x'])
+        [{'a': 1, 'b': 'x'}, {'a': 2, 'b': 'x'}]
+    """
+    argument_sets = [{}]
+    if arguments is not None:
+        with open(arguments, 'r') as f:
+            argument_sets = yaml.safe_load(f)
+        if not isinstance(argument_sets, list) or not all(isinstance(a, dict) for a in argument_sets):
+            raise ValidationError('The file {} has to contain the list of argument sets.'.format(arguments))
+    names, values = [], []
+    for dimension in ([] if grid is None else grid):
+        if '=' not in dimension:
+            raise ValidationError('The grid "{}" is not in the format NAME=VALUE1,VALUE2,....'.format(dimension))
+        name, dimension_values = dimension.split('=', 1)
+        names.append(name.replace('-', '_'))
+        values.append([config.process_kwargs({name: v})[name] for v in dimension_values.split(',')])
+    return [dict(argument_set, **dict(zip(names, point))) for argument_set in argument_sets for point in product(*values)]
+
+
+def _run_distributed(tasks):
+    queue = WorkQueue(spiderpig.storage().directory)
+    waiting = {}
+    for index, (command, args) in enumerate(tasks):
+        task_id = '{}.{}'.format(command, fingerprint(command, args))
+        queue.put(task_id, {'command': command, 'args': args})
+        waiting[index] = Task(queue, task_id)
+    while len(waiting) > 0:
+        for index, task in list(waiting.items()):
+            outcome = queue.outcome(task.task_id)
+            if outcome is not None:
+                del waiting[index]
+                yield index, outcome['time'], outcome['error']
+        if len(waiting) > 0:
+            sleep(POLL_INTERVAL)
+
+
+def _init_worker(global_args):
+    spiderpig.init(global_args['spiderpig_dir'], **global_args)
+
+
+def _run(task):
+    index, (command, args) = task
+    started = time()
+    try:
+        commands.run(command, args)
+        error = None
+    except Exception as e:
+        error = '{}: {}'.format(e.__class__.__name__, e)
+    spiderpig.cache_provider().flush()
+    return index, time() - started, error
+
+
+def _format_args(args):
+    return ', '.join('{}={}'.format(key, value) for key, value in sorted(args.items()))
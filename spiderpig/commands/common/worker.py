@@ -0,0 +1,23 @@
+"""
+Process tasks from the work queue in the cache directory (see
+spiderpig.submit and spiderpig-sweep --distributed). Workers on all nodes
+sharing the directory cooperate; tasks of dead workers are re-queued.
+"""
+
+from spiderpig.distributed import LEASE_TIMEOUT, HEARTBEAT_INTERVAL, WorkQueue, Worker
+import spiderpig.msg as msg
+import spiderpig
+
+
+def execute(max_tasks=None, idle_timeout=None, lease_timeout=LEASE_TIMEOUT, heartbeat_interval=HEARTBEAT_INTERVAL):
+    worker = Worker(
+        WorkQueue(spiderpig.storage().directory),
+        lease_timeout=float(lease_timeout),
+        heartbeat_interval=float(heartbeat_interval),
+    )
+    msg.print_info('Worker {} is waiting for tasks.'.format(worker.worker_id))
+    processed = worker.run(
+        max_tasks=None if max_tasks is None else int(max_tasks),
+        idle_timeout=None if idle_timeout is None else float(idle_timeout),
+    )
+    msg.print_success('{} tasks processed.'.format(processed))
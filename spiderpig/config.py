@@ -31,6 +31,85 @@ def get_argument_parser():
         dest='max_in_memory_entries',
         default=1000
     )
+    p.add_argument(
+        '--max-in-memory-bytes',
+        action='store',
+        dest='max_in_memory_bytes',
+        type=int,
+        default=None
+    )
+    p.add_argument(
+        '--shared-memory-bytes',
+        action='store',
+        dest='shared_memory_bytes',
+        type=int,
+        default=None,
+        help='share large results among processes on the host in shared memory of the given size')
+    p.add_argument(
+        '--packed-storage',
+        action='store_true',
+        dest='packed_storage',
+        default=False,
+        help='pack small results into segment files (see spiderpig-compact)')
+    p.add_argument(
+        '--host-resources',
+        action='store',
+        dest='host_resources',
+        default=None,
+        help='budget of resources of the host for executions needing them, e.g., memory_gb=64,cpu=16')
+    p.add_argument(
+        '--prewarm',
+        action='store_true',
+        dest='prewarm',
+        default=False,
+        help='load the working set of the last run to memory in the background')
+    p.add_argument(
+        '--write-behind',
+        action='store_true',
+        dest='write_behind',
+        default=False)
+    p.add_argument(
+        '--remote-cache',
+        action='store',
+        dest='remote_cache',
+        default=None)
+    p.add_argument(
+        '--cache-tier',
+        action='append',
+        dest='cache_tiers',
+        default=None,
+        help='DIRECTORY[,max_entries=N][,write_policy=POLICY]')
+    p.add_argument(
+        '--override-function',
+        action='append',
+        dest='override_functions',
+        default=None,
+        help='recompute executions of the given function (e.g., pkg.mod.fun) and executions depending on them')
+    p.add_argument(
+        '--profile-functions',
+        action='append',
+        dest='profile_functions',
+        default=None,
+        help='profile executions of functions matching the given pattern (e.g., pkg.mod.*), see spiderpig-profiles')
+    p.add_argument(
+        '--lock-report',
+        action='store_true',
+        dest='lock_report',
+        default=False,
+        help='report the time spent waiting for locks and the most contended executions')
+    p.add_argument(
+        '--connect',
+        action='store',
+        dest='connect',
+        default=None,
+        metavar='SOCKET',
+        help='run the command in the daemon (spiderpig-serve) listening on the given socket')
+    p.add_argument(
+        '--dry-run',
+        action='store_true',
+        dest='dry_run',
+        default=False,
+        help='only report which executions would be computed and how long it would take')
     return p
 
 
@@ -38,6 +117,42 @@ def process_kwargs(parsed_kwargs):
     return {key: _convert_kwarg_value(val) for (key, val) in parsed_kwargs.items()}
 
 
+def parse_cache_tier(value):
+    """
+    Parse the cache tier specification in the format
+    'DIRECTORY[,max_entries=N][,write_policy=POLICY]'.
+
+        >>> sorted(parse_cache_tier('/nfs/shared,max_entries=100,write_policy=never').items())
+        [('directory', '/nfs/shared'), ('max_entries', 100), ('write_policy', 'never')]
+    """
+    directory, *options = value.split(',')
+    tier = {'directory': directory}
+    for option in options:
+        if '=' not in option:
+            raise ValidationError('The cache tier option "{}" is not in the format key=value.'.format(option))
+        key, option_value = option.split('=', 1)
+        if key not in ['max_entries', 'write_policy']:
+            raise ValidationError('The cache tier option "{}" is not supported.'.format(key))
+        tier[key] = _convert_kwarg_value(option_value)
+    return tier
+
+
+def parse_resources(value):
+    """
+    Parse the resources in the format 'NAME=AMOUNT[,NAME=AMOUNT...]'.
+
+        >>> sorted(parse_resources('memory_gb=64,cpu=16').items())
+        [('cpu', 16), ('memory_gb', 64)]
+    """
+    resources = {}
+    for option in value.split(','):
+        if '=' not in option:
+            raise ValidationError('The resource "{}" is not in the format name=amount.'.format(option))
+        name, amount = option.split('=', 1)
+        resources[name] = _convert_kwarg_value(amount)
+    return resources
+
+
 def _convert_kwarg_value(val):
     if not isinstance(val, str):
         return val
@@ -57,36 +172,92 @@ def _convert_kwarg_value(val):
     return val
 
 
+def snapshot_environment():
+    """
+    Take the snapshot of the environment variables used by the root
+    configurations created from now on.
+    """
+    global _ENVIRONMENT
+    _ENVIRONMENT = _Environment(os.environ)
+
+
+class _Environment:
+
+    """
+    Snapshot of the environment variables, their values are converted once
+    when they are looked up for the first time.
+    """
+
+    def __init__(self, environ):
+        self._raw = dict(environ)
+        self._converted = {}
+
+    def __getitem__(self, key):
+        try:
+            return self._converted[key]
+        except KeyError:
+            pass
+        value = self._converted[key] = _convert_kwarg_value(self._raw[key])
+        return value
+
+    def __contains__(self, key):
+        return key in self._raw
+
+
+# the snapshot shared by the root configurations, it is taken once per
+# process and again whenever spiderpig is initialized
+_ENVIRONMENT = None
+
+
 class Configuration:
 
+    """
+    Immutable configuration (key-word arguments) of spiderpig functions. The
+    configuration overriding another one is flattened when it is created, so
+    lookups do not walk the chain of configurations. Environment variables
+    (upper-cased keys) are used as a fallback; they are snapshotted when the
+    process starts and whenever spiderpig is initialized (see
+    snapshot_environment).
+    """
+
     def __init__(self, configuration=None, **kwargs):
-        self._kwargs = process_kwargs(kwargs)
-        self._configuration = configuration
+        if configuration is None:
+            if _ENVIRONMENT is None:
+                snapshot_environment()
+            self._kwargs = {}
+            self._environ = _ENVIRONMENT
+        else:
+            self._kwargs = dict(configuration._kwargs)
+            self._environ = configuration._environ
+        self._kwargs.update(process_kwargs(kwargs))
 
     def __getitem__(self, key):
         if not isinstance(key, str):
             raise ValidationError('The key argument has to be a string.')
-        if key in self._kwargs:
+        try:
             return self._kwargs[key]
-        if self._configuration is not None and key in self._configuration:
-            return self._configuration[key]
-        if key.upper() in os.environ:
-            return _convert_kwarg_value(os.environ[key.upper()])
-        raise KeyError(key)
+        except KeyError:
+            pass
+        try:
+            return self._environ[key.upper()]
+        except KeyError:
+            raise KeyError(key)
 
     def __contains__(self, key):
-        return key in self._kwargs or (self._configuration is not None and key in self._configuration) or key.upper() in os.environ
+        return key in self._kwargs or key.upper() in self._environ
+
+    @property
+    def kwargs(self):
+        return dict(self._kwargs)
 
     def to_serializable(self):
-        result = {
+        return {
             'kwargs': dict(self._kwargs),
         }
-        if self._configuration is not None:
-            result['configuration'] = self._configuration.to_serializable()
-        return result
 
     @staticmethod
     def from_serializable(serializable):
+        # nested configurations were serialized by older versions
         configuration = None if 'configuration' not in serializable else Configuration.from_serializable(serializable['configuration'])
         return Configuration(configuration, **serializable['kwargs'])
 
@@ -0,0 +1,285 @@
+"""
+Long-lived process serving command-line commands over a Unix socket, so the
+commands do not pay for importing the analysis modules and preparing the
+cache, and they find the results of previous commands in memory. The daemon
+(spiderpig-serve) prepares everything once and forks the pool of worker
+processes accepting clients from the shared socket. Each worker serves one
+client at a time and keeps its in-memory cache between clients; the workers
+share the storage (and the shared memory tier, if enabled). The client
+(spiderpig-cli.py --connect SOCKET ...) only forwards its arguments and
+streams the output of the command back.
+"""
+
+from . import commands, config
+from .exceptions import ValidationError
+from .msg import print_error, print_info, print_warn
+from multiprocessing.connection import wait
+import inspect
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import spiderpig
+import struct
+import sys
+import threading
+import traceback
+
+
+WORKERS = 4
+
+_REQUEST = b'r'
+_OUTPUT = b'o'
+_EXIT = b'x'
+_HEADER = struct.Struct('<cI')
+# options applied by spiderpig.init when the daemon starts, they cannot be
+# changed by a single command
+_INIT_OPTIONS = [name for name in inspect.signature(spiderpig.init).parameters if name not in ['directory', 'global_kwargs']]
+
+
+class Daemon:
+
+    """
+    Server executing commands of the given application (argument parser and
+    setup functions, see spiderpig.run_cli) in the current spiderpig context.
+    """
+
+    def __init__(self, socket_path, parser, setup_functions=None, workers=WORKERS):
+        self._socket_path = os.path.abspath(socket_path)
+        self._parser = parser
+        self._setup_functions = [] if setup_functions is None else setup_functions
+        self._workers = workers
+        self._socket = None
+        self._directory = None
+
+    def serve_forever(self):
+        """
+        Serve clients until the daemon is interrupted (SIGINT, SIGTERM).
+        """
+        self._socket = self._listen()
+        self._directory = os.path.abspath(spiderpig.storage().directory)
+        # the workers inherit the imported commands and the prepared cache
+        commands.load_commands()
+        context = multiprocessing.get_context('fork')
+        pool = [self._start_worker(context, i) for i in range(self._workers)]
+        print_info('Serving commands on {} with {} workers.'.format(self._socket_path, self._workers))
+        previous_handler = signal.signal(signal.SIGTERM, _interrupt)
+        try:
+            while True:
+                wait([process.sentinel for process in pool])
+                for i, process in enumerate(pool):
+                    if not process.is_alive():
+                        process.join()
+                        print_warn('The worker {} has exited with code {}, starting a new one.'.format(process.name, process.exitcode))
+                        pool[i] = self._start_worker(context, i)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            signal.signal(signal.SIGTERM, previous_handler)
+            for process in pool:
+                if process.is_alive():
+                    process.terminate()
+                process.join()
+            self._socket.close()
+            try:
+                os.remove(self._socket_path)
+            except FileNotFoundError:
+                pass
+
+    def _start_worker(self, context, i):
+        process = context.Process(target=self._work, name='spiderpig-daemon-{}'.format(i), daemon=True)
+        process.start()
+        return process
+
+    def _listen(self):
+        if os.path.exists(self._socket_path):
+            if _is_alive(self._socket_path):
+                raise ValidationError('There is already a daemon listening on {}.'.format(self._socket_path))
+            # left by the daemon which has been killed
+            os.remove(self._socket_path)
+        listening = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listening.bind(self._socket_path)
+        listening.listen(64)
+        return listening
+
+    def _work(self):
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        # the worker has been forked inside the execution of spiderpig-serve,
+        # its arguments must not leak into the served commands
+        spiderpig.execution_context().detach()
+        while True:
+            connection, _ = self._socket.accept()
+            with connection:
+                try:
+                    self._serve(connection)
+                except (BrokenPipeError, ConnectionResetError):
+                    # the client has gone away
+                    pass
+                except Exception as e:
+                    # e.g., a malformed request, the worker has to survive
+                    traceback.print_exc()
+                    try:
+                        _send(connection, _EXIT, json.dumps({'code': 1, 'error': str(e)}).encode('utf-8'))
+                    except OSError:
+                        pass
+
+    def _serve(self, connection):
+        kind, payload = _receive(connection)
+        if kind != _REQUEST:
+            return
+        request = json.loads(payload.decode('utf-8'))
+        cwd = os.getcwd()
+        read_fd, write_fd = os.pipe()
+        forwarder = threading.Thread(target=_forward, args=(read_fd, connection), name='spiderpig-output', daemon=True)
+        forwarder.start()
+        # the output is redirected on the level of file descriptors, so the
+        # output of libraries and subprocesses reaches the client as well
+        sys.stdout.flush()
+        sys.stderr.flush()
+        saved_fds = os.dup(1), os.dup(2)
+        saved_streams = sys.stdout, sys.stderr
+        os.dup2(write_fd, 1)
+        os.dup2(write_fd, 2)
+        os.close(write_fd)
+        # the streams could have been replaced by ones not using the
+        # descriptors
+        sys.stdout = open(1, 'w', buffering=1, closefd=False)
+        sys.stderr = open(2, 'w', buffering=1, closefd=False)
+        try:
+            os.chdir(request['cwd'])
+            code = self._run(request['argv'])
+        finally:
+            sys.stdout.close()
+            sys.stderr.close()
+            sys.stdout, sys.stderr = saved_streams
+            # e.g., clint writes to the original streams
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os.dup2(saved_fds[0], 1)
+            os.dup2(saved_fds[1], 2)
+            for fd in saved_fds:
+                os.close(fd)
+            os.chdir(cwd)
+            forwarder.join()
+        _send(connection, _EXIT, json.dumps({'code': code}).encode('utf-8'))
+
+    def _run(self, argv):
+        try:
+            commands.load_commands(argv)
+            args = config.process_kwargs(vars(self._parser.parse_args(argv)))
+            dry_run = args.pop('dry_run', False)
+            args.pop('connect', None)
+            if os.path.abspath(args['spiderpig_dir']) != self._directory:
+                raise ValidationError('The daemon serves the directory {}, not {}.'.format(self._directory, os.path.abspath(args['spiderpig_dir'])))
+            for name in _INIT_OPTIONS:
+                if name in args and args.pop(name) != config.process_kwargs({name: self._parser.get_default(name)})[name]:
+                    raise ValidationError('The option {} is applied when the daemon starts, give it to spiderpig-serve instead.'.format(name))
+            with spiderpig.configuration(**{k: v for (k, v) in args.items() if k != 'func'}):
+                if dry_run:
+                    commands.plan(args)
+                else:
+                    for setup_fun in self._setup_functions:
+                        spiderpig.execution_context().execute(setup_fun, use_cache=False)
+                    commands.execute(args)
+            # the results have to be visible to other workers
+            spiderpig.cache_provider().flush()
+            return 0
+        except SystemExit as e:
+            # e.g., invalid arguments or --help
+            return e.code if isinstance(e.code, int) else 1
+        except ValidationError as e:
+            print_error(e)
+            return 1
+        except Exception:
+            traceback.print_exc()
+            return 1
+
+
+def run_client(socket_path, argv, output=None):
+    """
+    Run the command given by the command-line arguments in the daemon
+    listening on the given socket.
+
+    Parameters
+    ----------
+    output: file
+        binary stream the output of the command is written to, standard
+        output by default
+
+    Returns
+    -------
+    exit code of the command
+    """
+    output = sys.stdout.buffer if output is None else output
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        try:
+            connection.connect(socket_path)
+        except (FileNotFoundError, ConnectionRefusedError):
+            raise ValidationError('There is no daemon listening on {}, start it by spiderpig-serve.'.format(socket_path))
+        _send(connection, _REQUEST, json.dumps({'argv': argv, 'cwd': os.getcwd()}).encode('utf-8'))
+        while True:
+            kind, payload = _receive(connection)
+            if kind == _OUTPUT:
+                output.write(payload)
+                output.flush()
+            elif kind == _EXIT:
+                result = json.loads(payload.decode('utf-8'))
+                if 'error' in result:
+                    print_error('The daemon has failed to run the command: {}'.format(result['error']))
+                return result['code']
+            else:
+                print_warn('The daemon has closed the connection.')
+                return 1
+
+
+def _forward(read_fd, connection):
+    try:
+        while True:
+            data = os.read(read_fd, 65536)
+            if len(data) == 0:
+                break
+            try:
+                _send(connection, _OUTPUT, data)
+            except OSError:
+                # the client has gone away, the output is discarded
+                pass
+    finally:
+        os.close(read_fd)
+
+
+def _send(connection, kind, payload):
+    connection.sendall(_HEADER.pack(kind, len(payload)) + payload)
+
+
+def _receive(connection):
+    header = _receive_exactly(connection, _HEADER.size)
+    if header is None:
+        return None, None
+    kind, length = _HEADER.unpack(header)
+    return kind, _receive_exactly(connection, length)
+
+
+def _receive_exactly(connection, length):
+    chunks = []
+    while length > 0:
+        chunk = connection.recv(min(length, 65536))
+        if len(chunk) == 0:
+            return None
+        chunks.append(chunk)
+        length -= len(chunk)
+    return b''.join(chunks)
+
+
+def _is_alive(socket_path):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+        try:
+            probe.connect(socket_path)
+            return True
+        except (ConnectionRefusedError, FileNotFoundError):
+            return False
+
+
+def _interrupt(signum, frame):
+    raise KeyboardInterrupt()
@@ -0,0 +1,303 @@
+"""
+Distributed execution through a work queue kept in the shared cache
+directory, so no scheduler service is needed. Tasks are stored as files in
+'.queue/pending'. Workers (spiderpig-worker) on any node claim them by
+renaming them to '.queue/running', which succeeds for exactly one worker.
+Workers regularly touch their heartbeat files; the tasks of workers whose
+heartbeat is too old are moved back to the pending ones by any other
+worker. Results are persisted in the cache as usual, the queue keeps only
+the outcome of each task in '.queue/done'.
+"""
+
+from .cache import _atomic_write
+from .exceptions import TaskFailed
+from .execution import Execution
+from .msg import print_error, print_info
+from pathlib import Path
+from time import sleep, time
+import os
+import pickle
+import socket
+import spiderpig
+import threading
+import uuid
+
+
+# seconds without a heartbeat after which the tasks of a worker are re-queued
+LEASE_TIMEOUT = 30
+HEARTBEAT_INTERVAL = 5
+POLL_INTERVAL = 0.5
+
+_PENDING = 'pending'
+_RUNNING = 'running'
+_DONE = 'done'
+_WORKERS = 'workers'
+
+
+class WorkQueue:
+
+    """
+    Queue of tasks stored in the given (cache) directory. A task is a
+    dictionary, either {'execution': serialized execution} or {'command':
+    command name, 'args': arguments}.
+    """
+
+    def __init__(self, directory):
+        self._directory = os.path.join(directory, '.queue')
+        for subdirectory in [_PENDING, _RUNNING, _DONE, _WORKERS]:
+            os.makedirs(os.path.join(self._directory, subdirectory), exist_ok=True)
+
+    def put(self, task_id, task):
+        try:
+            os.remove(self._get_filename(_DONE, task_id))
+        except FileNotFoundError:
+            pass
+        _atomic_write(self._get_filename(_PENDING, task_id), lambda f: pickle.dump(task, f))
+
+    def claim(self, worker_id):
+        """
+        Take the oldest pending task.
+
+        Returns
+        -------
+        (task id, task), or None if there is no pending task
+        """
+        pending_directory = os.path.join(self._directory, _PENDING)
+        for filename in sorted(_list_tasks(pending_directory), key=lambda f: _getmtime(os.path.join(pending_directory, f))):
+            task_id = filename[:-len('.task')]
+            running_filename = self._get_filename(_RUNNING, '{}@{}'.format(task_id, worker_id))
+            try:
+                # only one of the concurrent workers succeeds
+                os.rename(os.path.join(pending_directory, filename), running_filename)
+            except FileNotFoundError:
+                continue
+            with open(running_filename, 'rb') as f:
+                return task_id, pickle.load(f)
+        return None
+
+    def complete(self, task_id, worker_id, error=None, elapsed=None):
+        outcome = {'worker': worker_id, 'error': error, 'time': elapsed}
+        _atomic_write(self._get_filename(_DONE, task_id), lambda f: pickle.dump(outcome, f))
+        try:
+            os.remove(self._get_filename(_RUNNING, '{}@{}'.format(task_id, worker_id)))
+        except FileNotFoundError:
+            # the task has been re-queued in the meantime
+            pass
+
+    def outcome(self, task_id):
+        """
+        Outcome of the finished task (a dictionary with keys 'worker',
+        'error' and 'time'), or None if the task is not finished.
+        """
+        try:
+            with open(self._get_filename(_DONE, task_id), 'rb') as f:
+                return pickle.load(f)
+        except FileNotFoundError:
+            return None
+
+    def heartbeat(self, worker_id):
+        Path(self._get_filename(_WORKERS, worker_id)).touch()
+
+    def remove_worker(self, worker_id):
+        try:
+            os.remove(self._get_filename(_WORKERS, worker_id))
+        except FileNotFoundError:
+            pass
+
+    def requeue_expired(self, lease_timeout=LEASE_TIMEOUT):
+        """
+        Move the tasks of workers without a recent heartbeat back to the
+        pending ones.
+
+        Returns
+        -------
+        number of re-queued tasks
+        """
+        running_directory = os.path.join(self._directory, _RUNNING)
+        expired_before = time() - lease_timeout
+        requeued = 0
+        for filename in _list_tasks(running_directory):
+            task_id, worker_id = filename[:-len('.task')].rsplit('@', 1)
+            heartbeat_time = _getmtime(self._get_filename(_WORKERS, worker_id))
+            if heartbeat_time is not None and heartbeat_time >= expired_before:
+                continue
+            try:
+                os.rename(os.path.join(running_directory, filename), self._get_filename(_PENDING, task_id))
+                requeued += 1
+            except FileNotFoundError:
+                pass
+        return requeued
+
+    def size(self):
+        """
+        Number of pending and running tasks.
+        """
+        return sum(len(_list_tasks(os.path.join(self._directory, d))) for d in [_PENDING, _RUNNING])
+
+    def _get_filename(self, subdirectory, name):
+        return os.path.join(self._directory, subdirectory, '{}.task'.format(name))
+
+
+class Task:
+
+    """
+    Handle of the submitted task.
+    """
+
+    def __init__(self, queue, task_id, execution=None):
+        self._queue = queue
+        self._task_id = task_id
+        self._execution = execution
+
+    @property
+    def task_id(self):
+        return self._task_id
+
+    def done(self):
+        return self._queue.outcome(self._task_id) is not None
+
+    def wait(self, timeout=None, poll_interval=POLL_INTERVAL):
+        """
+        Wait until the task is finished.
+
+        Returns
+        -------
+        outcome of the task (see WorkQueue.outcome)
+        """
+        started = time()
+        while True:
+            outcome = self._queue.outcome(self._task_id)
+            if outcome is not None:
+                return outcome
+            if timeout is not None and time() - started > timeout:
+                raise TimeoutError('The task {} is not finished in {} seconds.'.format(self._task_id, timeout))
+            sleep(poll_interval)
+
+    def result(self, timeout=None, poll_interval=POLL_INTERVAL):
+        """
+        Wait until the task is finished and return its result read from the
+        cache (None for commands). The result is never computed locally,
+        TaskFailed is raised when it is not in the cache.
+        """
+        outcome = self.wait(timeout=timeout, poll_interval=poll_interval)
+        if outcome['error'] is not None:
+            raise TaskFailed('The task {} failed: {}'.format(self._task_id, outcome['error']))
+        if self._execution is None:
+            return None
+        storage = spiderpig.storage()
+        if not storage.is_execution_ready(self._execution) or storage.is_execution_dirty(self._execution):
+            raise TaskFailed('The result of the task {} is not in the cache {}.'.format(self._task_id, storage.directory))
+        return storage.read_execution_result(self._execution)
+
+
+class Worker:
+
+    """
+    Worker processing tasks from the given queue in the current spiderpig
+    context. Several workers can share one queue, even on different nodes.
+    """
+
+    def __init__(self, queue, worker_id=None, lease_timeout=LEASE_TIMEOUT, heartbeat_interval=HEARTBEAT_INTERVAL, poll_interval=POLL_INTERVAL):
+        self._queue = queue
+        self._worker_id = worker_id if worker_id is not None else '{}-{}-{}'.format(
+            socket.gethostname().replace('.', '_'), os.getpid(), uuid.uuid4().hex[:8]
+        )
+        self._lease_timeout = lease_timeout
+        self._heartbeat_interval = heartbeat_interval
+        self._poll_interval = poll_interval
+        self._stopped = threading.Event()
+
+    @property
+    def worker_id(self):
+        return self._worker_id
+
+    def run(self, max_tasks=None, idle_timeout=None):
+        """
+        Process tasks until the given number of them is processed or there
+        is no task for the given number of seconds (forever by default).
+
+        Returns
+        -------
+        number of processed tasks
+        """
+        self._stopped.clear()
+        # the heartbeat has to exist before the first task is claimed
+        self._queue.heartbeat(self._worker_id)
+        heartbeat = threading.Thread(target=self._heartbeat, name='spiderpig-heartbeat', daemon=True)
+        heartbeat.start()
+        processed, idle_since, reaped = 0, time(), 0
+        try:
+            while max_tasks is None or processed < max_tasks:
+                if time() - reaped > self._heartbeat_interval:
+                    requeued = self._queue.requeue_expired(self._lease_timeout)
+                    if requeued > 0:
+                        print_info('{} tasks of dead workers re-queued.'.format(requeued))
+                    reaped = time()
+                claimed = self._queue.claim(self._worker_id)
+                if claimed is None:
+                    if idle_timeout is not None and time() - idle_since > idle_timeout:
+                        break
+                    sleep(self._poll_interval)
+                    continue
+                task_id, task = claimed
+                started = time()
+                try:
+                    _run_task(task)
+                    error = None
+                except Exception as e:
+                    error = '{}: {}'.format(e.__class__.__name__, e)
+                    print_error('The task {} failed: {}'.format(task_id, error))
+                # the result has to be persisted before the task is reported
+                spiderpig.cache_provider().flush()
+                self._queue.complete(task_id, self._worker_id, error, time() - started)
+                processed += 1
+                idle_since = time()
+        finally:
+            self._stopped.set()
+            heartbeat.join()
+            self._queue.remove_worker(self._worker_id)
+        return processed
+
+    def _heartbeat(self):
+        while not self._stopped.wait(self._heartbeat_interval):
+            self._queue.heartbeat(self._worker_id)
+
+
+def submit(queue, context, func, kwargs):
+    """
+    Enqueue the execution of the given function in the given context.
+
+    Returns
+    -------
+    Task
+    """
+    execution = context.create_execution(func, **kwargs)
+    queue.put(execution.name, {'execution': execution.to_serializable()})
+    return Task(queue, execution.name, execution)
+
+
+def _run_task(task):
+    if 'command' in task:
+        spiderpig.commands.run(task['command'], task['args'])
+        return
+    execution = Execution.from_serializable(task['execution'])
+    with spiderpig.configuration(**execution.configuration.kwargs):
+        _call(execution.function.raw_function, execution.kwargs)
+
+
+def _call(func, kwargs):
+    if hasattr(func, '__wrapped__'):
+        # decorated functions execute themselves in the current context
+        return func(**kwargs)
+    return spiderpig.execution_context().execute(func, **kwargs)
+
+
+def _list_tasks(directory):
+    return [f for f in os.listdir(directory) if f.endswith('.task')]
+
+
+def _getmtime(filename):
+    try:
+        return os.path.getmtime(filename)
+    except OSError:
+        return None
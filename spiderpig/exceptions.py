@@ -16,3 +16,7 @@ class CyclicExecution(SpiderpigError):
 
 class TooManyDependencies(SpiderpigError):
     pass
+
+
+class TaskFailed(SpiderpigError):
+    pass
@@ -1,18 +1,19 @@
 from .config import Configuration
 from .exceptions import ValidationError, CyclicExecution, TooManyDependencies
+from .fingerprint import fingerprint
 from .func import function_name
-from .msg import Verbosity, print_debug
+from .msg import Verbosity, print_debug, print_info, print_warn
 from clint.textui import indent
-from collections import defaultdict
+from collections import OrderedDict, defaultdict
+from copy import copy
 from functools import reduce
 from glob import iglob
-from threading import currentThread
-from time import time
+from multiprocessing.pool import ThreadPool
+from threading import Lock, get_ident
+from time import perf_counter, time
 import filelock
-import hashlib
 import importlib
 import inspect
-import json
 import os
 import re
 import tempfile
@@ -20,46 +21,123 @@ import tempfile
 
 DEPENDENCY_UPPER_BOUND = 500
 
+# seconds of waiting for a lock after which a warning is printed
+LOCK_WAIT_WARNING = 10
+# number of locks with statistics of their own, the least recently acquired
+# ones are merged into the statistics of other locks of their kind
+MAX_LOCK_STATISTICS = 1000
+
 
 class Function:
 
     _dependencies = defaultdict(list)
     _dependency_names = defaultdict(set)
+    # incremented whenever the dependency graph changes, so the values derived
+    # from the graph can be cached
+    _dependencies_version = 0
+    _dependent_arguments = {}
+    _code_fingerprints = {}
+    _options = defaultdict(dict)
+    # dependencies recorded in the storage which have not been imported yet
+    _stored_dependencies = defaultdict(list)
 
     def __init__(self, raw_function):
         self._raw_function = raw_function
+        self._stored_code_fingerprint = None
 
     def add_dependency(self, function):
         name = self.name
         if function.name != name and function.name not in self._dependency_names[name]:
             self._dependencies[name].append(function)
             self._dependency_names[name].add(function.name)
+            Function._dependencies_version += 1
 
     @property
     def arguments(self):
-        if hasattr(self.raw_function, '__wrapped__'):
-            return inspect.getargspec(self.raw_function.__wrapped__).args
-        else:
-            return inspect.getargspec(self.raw_function).args
+        return self._argspec.args
 
     @property
     def defaults(self):
-        if hasattr(self.raw_function, '__wrapped__'):
-            return inspect.getargspec(self.raw_function.__wrapped__).defaults
-        else:
-            return inspect.getargspec(self.raw_function).defaults
+        return self._argspec.defaults
+
+    @property
+    def default_kwargs(self):
+        if not hasattr(self, '_default_kwargs'):
+            defaults = self.defaults if self.defaults else []
+            self._default_kwargs = dict(zip(reversed(self.arguments), reversed(defaults)))
+        return dict(self._default_kwargs)
+
+    @property
+    def options(self):
+        """
+        Options the function was decorated with, e.g., whether it is cached.
+        """
+        return dict(Function._options[self.name])
+
+    def set_options(self, **options):
+        Function._options[self.name].update(options)
+
+    @property
+    def is_generator(self):
+        """
+        True if the function yields its results, so they are cached as a
+        stream of chunks.
+        """
+        if not hasattr(self, '_is_generator'):
+            raw_function = self.raw_function.__wrapped__ if hasattr(self.raw_function, '__wrapped__') else self.raw_function
+            self._is_generator = inspect.isgeneratorfunction(raw_function)
+        return self._is_generator
+
+    @property
+    def code_changed(self):
+        """
+        True if the code of the function differs from the code recorded in
+        the storage the function was loaded from.
+        """
+        return self._stored_code_fingerprint is not None and self._stored_code_fingerprint != self.code_fingerprint
+
+    @property
+    def code_fingerprint(self):
+        """
+        Fingerprint of the bytecode and constants of the function and of the
+        decorated functions it directly refers to (changes deeper in the call
+        graph are propagated through the dependencies of executions). It is
+        computed once per process.
+        """
+        name = self.name
+        if name not in Function._code_fingerprints:
+            raw_function = self.raw_function.__wrapped__ if hasattr(self.raw_function, '__wrapped__') else self.raw_function
+            code = getattr(raw_function, '__code__', None)
+            if code is None:
+                Function._code_fingerprints[name] = None
+            else:
+                callees = []
+                for referenced_name in sorted(_code_names(code)):
+                    referenced = raw_function.__globals__.get(referenced_name)
+                    if hasattr(referenced, '__wrapped__') and hasattr(referenced.__wrapped__, '__code__'):
+                        callees.append(_code_parts(referenced.__wrapped__.__code__))
+                Function._code_fingerprints[name] = fingerprint(_code_parts(code), callees)
+        return Function._code_fingerprints[name]
 
     @property
     def dependencies(self):
+        self._resolve_stored_dependencies()
         return list(Function._dependencies[self.name])
 
     @property
     def dependent_arguments(self):
-        return set(self.arguments) | reduce(
-            lambda a, b: a | b,
-            [d.dependent_arguments for d in self.dependencies],
-            set()
-        )
+        name = self.name
+        if name in Function._stored_dependencies:
+            self._resolve_stored_dependencies()
+        version, dependent_arguments = Function._dependent_arguments.get(name, (None, None))
+        if version != Function._dependencies_version:
+            dependent_arguments = frozenset(self.arguments) | reduce(
+                lambda a, b: a | b,
+                [d.dependent_arguments for d in self.dependencies],
+                frozenset()
+            )
+            Function._dependent_arguments[name] = (Function._dependencies_version, dependent_arguments)
+        return dependent_arguments
 
     @staticmethod
     def from_name(function_name):
@@ -77,10 +155,19 @@ class Function:
     def raw_function(self):
         return self._raw_function
 
+    @property
+    def _argspec(self):
+        if not hasattr(self, '_argspec_value'):
+            raw_function = self.raw_function.__wrapped__ if hasattr(self.raw_function, '__wrapped__') else self.raw_function
+            self._argspec_value = inspect.getfullargspec(raw_function)
+        return self._argspec_value
+
     def to_serializable(self):
+        self._resolve_stored_dependencies()
         name = self.name
         return {
             'function_name': name,
+            'code_fingerprint': self.code_fingerprint,
             'dependencies': [fun.to_serializable() for fun in Function._dependencies[name]],
         }
 
@@ -107,20 +194,47 @@ class Function:
             dependencies_by_name[d['function_name']] = Function.merge_serializables(d, dependencies_by_name_first.get(d['function_name']))
         return {
             'function_name': first['function_name'],
+            'code_fingerprint': first.get('code_fingerprint', second.get('code_fingerprint')),
             'dependencies': list(dependencies_by_name.values()),
         }
 
     @staticmethod
     def from_serializable(serializable):
         fun = Function.from_name(serializable['function_name'])
+        fun._stored_code_fingerprint = serializable.get('code_fingerprint')
         for dep in serializable['dependencies']:
             fun.add_dependency(Function.from_serializable(dep))
         return fun
 
+    @staticmethod
+    def register_stored_dependencies(serializable):
+        """
+        Remember the dependencies of the function from its stored
+        serializable. They are imported only when the dependencies of the
+        function are needed, the functions which can not be imported
+        anymore are skipped.
+        """
+        Function._stored_dependencies[serializable['function_name']].extend(serializable['dependencies'])
+
+    def _resolve_stored_dependencies(self):
+        stored = Function._stored_dependencies.pop(self.name, None)
+        if stored is None:
+            return
+        for dependency in stored:
+            try:
+                function = Function.from_name(dependency['function_name'])
+            except (ImportError, AttributeError):
+                continue
+            Function.register_stored_dependencies(dependency)
+            self.add_dependency(function)
+
     @staticmethod
     def clear_dependencies():
+        Function._stored_dependencies = defaultdict(list)
         Function._dependencies = defaultdict(list)
         Function._dependency_names = defaultdict(set)
+        Function._dependencies_version += 1
+        Function._dependent_arguments = {}
 
     def __call__(self, *args, **kwargs):
         return self.raw_function(*args, **kwargs)
@@ -135,6 +249,26 @@ class Function:
         return self.name
 
 
+def _code_names(code):
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if inspect.iscode(const):
+            names |= _code_names(const)
+    return names
+
+
+def _code_parts(code):
+    def const_parts(const):
+        if inspect.iscode(const):
+            return _code_parts(const)
+        if isinstance(const, (tuple, frozenset)):
+            return const.__class__(const_parts(c) for c in const)
+        if const is None or isinstance(const, (bool, int, float, str, bytes)):
+            return const
+        return repr(const)
+    return code.co_code, code.co_names, tuple(const_parts(c) for c in code.co_consts)
+
+
 class Execution:
 
     def __init__(self, function, configuration, verbosity=Verbosity.INFO, **kwargs):
@@ -150,7 +284,15 @@ class Execution:
         self._executed = False
         self._dependencies = []
         self._time = None
+        self._own_time = None
+        self._children_time = 0
+        self._size = None
+        self._memory = None
         self._verbosity = verbosity
+        self._scheduler = None
+        self._profiler = None
+        self._name = None
+        self._name_version = None
 
     def add_dependency(self, execution):
         if execution.name not in {e.name for e in self._dependencies}:
@@ -160,7 +302,7 @@ class Execution:
     def context_kwargs(self):
         context_kwargs = {}
         for arg in self.function.dependent_arguments:
-            if arg in self._configuration and arg not in self.kwargs:
+            if arg not in self._kwargs and arg in self._configuration:
                 context_kwargs[arg] = self._configuration[arg]
         return context_kwargs
 
@@ -168,6 +310,10 @@ class Execution:
     def dependencies(self):
         return list(self._dependencies)
 
+    @property
+    def configuration(self):
+        return self._configuration
+
     @property
     def function(self):
         return self._function
@@ -178,9 +324,13 @@ class Execution:
 
     @property
     def name(self):
-        return '{}.{}'.format(self.function.name, hashlib.sha1((
-            self.function.name + _serialize(self.kwargs) + _serialize(self.context_kwargs)
-        ).encode()).hexdigest())
+        # the name depends on the dependency graph of functions which can
+        # change during the execution
+        if self._name_version != Function._dependencies_version:
+            function_name = self.function.name
+            self._name = '{}.{}'.format(function_name, fingerprint(function_name, self._kwargs, self.context_kwargs))
+            self._name_version = Function._dependencies_version
+        return self._name
 
     def to_serializable(self):
         return {
@@ -188,6 +338,10 @@ class Execution:
             'configuration': self._configuration.to_serializable(),
             'kwargs': self.kwargs,
             'dependencies': [e.to_serializable() for e in self._dependencies],
+            'time': self._time,
+            'own_time': self._own_time,
+            'size': self._size,
+            'memory': self._memory,
         }
 
     @staticmethod
@@ -198,6 +352,7 @@ class Execution:
             verbosity=verbosity,
             **serializable['kwargs']
         )
+        execution.set_statistics(serializable.get('time'), serializable.get('own_time'), serializable.get('size'), serializable.get('memory'))
         if len(serializable['dependencies']) > DEPENDENCY_UPPER_BOUND:
             raise TooManyDependencies('The execution {} has too many dependencies'.format(execution))
         for d in serializable['dependencies']:
@@ -208,14 +363,60 @@ class Execution:
     def time(self):
         return self._time
 
+    @property
+    def own_time(self):
+        """
+        Time spent by the execution itself, i.e., without executions of its
+        dependencies.
+        """
+        return self._own_time
+
+    @property
+    def size(self):
+        """
+        Size of the serialized result in bytes (if it has been serialized).
+        """
+        return self._size
+
+    @property
+    def memory(self):
+        """
+        Peak growth of the resident memory of the process during the
+        execution in bytes (if it has been measured, see spiderpig.resources).
+        """
+        return self._memory
+
+    def set_statistics(self, time=None, own_time=None, size=None, memory=None):
+        """
+        Set the statistics of the execution known from elsewhere, e.g., when
+        the result is read from the cache. Unknown (None) values are ignored.
+        """
+        if time is not None:
+            self._time = time
+        if own_time is not None:
+            self._own_time = own_time
+        if size is not None:
+            self._size = size
+        if memory is not None:
+            self._memory = memory
+
+    def set_result(self, value):
+        self._value = value
+        self._executed = True
+
     def __call__(self):
         if not self._executed:
             time_before = time()
             kwargs = self.kwargs
             if 'verbosity' in self._function.arguments:
                 kwargs['verbosity'] = self._verbosity
-            self._value = self.function(**kwargs)
+            if self._scheduler is None or self._function.is_generator:
+                self._value = self._call(kwargs)
+            else:
+                with self._scheduler.running(self):
+                    self._value = self._call(kwargs)
             self._time = time() - time_before
+            self._own_time = max(0, self._time - self._children_time)
             self._executed = True
             if self._verbosity > Verbosity.DEBUG:
                 print_debug('execution {0} took {1:.3f} seconds'.format(self.name, self._time))
@@ -224,6 +425,12 @@ class Execution:
                         print_debug('{}: {}'.format(key, val))
         return self._value
 
+    def _call(self, kwargs):
+        if self._profiler is None:
+            return self.function(**kwargs)
+        with self._profiler.profiling(self):
+            return self.function(**kwargs)
+
     def __eq__(self, other):
         return self.function == other.function and self.kwargs == other.kwargs and self.context_kwargs == other.context_kwargs
 
@@ -247,53 +454,209 @@ class Execution:
 
 class ExecutionContext:
 
-    def __init__(self, configuration=None, cache_provider=None, verbosity=Verbosity.INFO, locker=None):
+    def __init__(self, configuration=None, cache_provider=None, verbosity=Verbosity.INFO, locker=None, scheduler=None, profiler=None):
         self._cache_provider = cache_provider
         self._execution_chain = defaultdict(list)
+        self._chain_functions = defaultdict(lambda: defaultdict(lambda: 0))
         self._configuration = configuration if configuration else Configuration()
         self._execution_count = defaultdict(lambda: 0)
         self._verbosity = verbosity
         self._locker = locker if locker else (cache_provider._locker if cache_provider else Locker())
+        self._scheduler = scheduler
+        self._profiler = profiler
 
     @property
     def configuration(self):
         return self._configuration
 
+    @property
+    def scheduler(self):
+        """
+        Scheduler admitting the executions needing resources (see
+        spiderpig.resources), or None.
+        """
+        return self._scheduler
+
+    @property
+    def profiler(self):
+        """
+        Profiler of the executions of selected functions (see
+        spiderpig.profiling), or None.
+        """
+        return self._profiler
+
+    def derive(self, **config):
+        """
+        Create a new context overriding the configuration of this one.
+        """
+        return ExecutionContext(
+            configuration=Configuration(self._configuration, **config),
+            cache_provider=self._cache_provider,
+            verbosity=self._verbosity,
+            locker=self._locker,
+            scheduler=self._scheduler,
+            profiler=self._profiler
+        )
+
+    def is_executing(self):
+        return len(self._execution_chain[get_ident()]) > 0
+
+    def detach(self):
+        """
+        Forget the executions running in the current thread, e.g., in a
+        process forked during an execution, so the executions made there do
+        not inherit its arguments and do not become its dependencies.
+        """
+        thread = get_ident()
+        self._execution_chain.pop(thread, None)
+        self._chain_functions.pop(thread, None)
+
     def execute(self, raw_function, *args, use_cache=True, **kwargs):
-        function = Function(raw_function)
-        arg_names = function.arguments
-        args_kwargs = dict(zip(arg_names, args))
-        kwarg_intersection = set(args_kwargs.keys()) & set(kwargs)
-        if len(kwarg_intersection) > 0:
-            raise ValidationError('Can not pass value for {} as both argument and key-word argument.'.format(kwarg_intersection))
-        kwargs.update(args_kwargs)
-        exec_kwargs = self._get_kwargs(function, **kwargs)
-        execution = Execution(function, self._configuration, verbosity=self.verbosity, **exec_kwargs)
-        execution_chain = self._execution_chain[currentThread()]
-        if execution in execution_chain:
-            raise CyclicExecution('There is an execution cycle: {} -> {}'.format(
-                execution.function.name,
-                [str(e) for e in execution_chain]
-            ))
+        function = raw_function if isinstance(raw_function, Function) else Function(raw_function)
+        if len(args) > 0:
+            args_kwargs = dict(zip(function.arguments, args))
+            kwarg_intersection = set(args_kwargs.keys()) & set(kwargs)
+            if len(kwarg_intersection) > 0:
+                raise ValidationError('Can not pass value for {} as both argument and key-word argument.'.format(kwarg_intersection))
+            kwargs.update(args_kwargs)
+        return self._execute(function, use_cache, kwargs)[1]
+
+    def execute_many(self, raw_function, kwargs_list, use_cache=True, workers=1):
+        """
+        Execute the function with each of the given key-word arguments. With
+        more workers, the executions run in a thread pool, but they are
+        recorded as dependencies of the running execution as if they were
+        executed one by one. When the context has a scheduler, the
+        executions with the longest critical path are started first.
+
+        Returns
+        -------
+        list of results in the order of the given key-word arguments
+        """
+        function = raw_function if isinstance(raw_function, Function) else Function(raw_function)
+        if workers <= 1 or len(kwargs_list) <= 1:
+            return [self._execute(function, use_cache, dict(kwargs))[1] for kwargs in kwargs_list]
+        execution_chain = self._execution_chain[get_ident()]
+        # the arguments inherited from the chain are resolved in this thread
+        kwargs_list = [self._get_kwargs(function, execution_chain, **kwargs) for kwargs in kwargs_list]
+        order = range(len(kwargs_list))
+        priorities = None if self._scheduler is None else self._scheduler.prioritize(self, function, kwargs_list, workers)
+        if priorities is not None:
+            order = sorted(order, key=lambda i: -priorities[i])
+        holding = self._scheduler is not None and self._scheduler.is_holding()
+
+        def execute_one(i):
+            if self._scheduler is None:
+                return i, self._execute(function, use_cache, kwargs_list[i])
+            with self._scheduler.prioritized(None if priorities is None else priorities[i], holding):
+                return i, self._execute(function, use_cache, kwargs_list[i])
+
+        started = time()
+        executed = [None] * len(kwargs_list)
+        pool = ThreadPool(min(workers, len(kwargs_list)))
+        try:
+            for i, execution_result in pool.imap_unordered(execute_one, order):
+                executed[i] = execution_result
+        finally:
+            pool.close()
+        for execution, _ in executed:
+            for execution_segment in execution_chain:
+                for dependency in [execution] + execution.dependencies:
+                    execution_segment.add_dependency(dependency)
+                    execution_segment.function.add_dependency(dependency.function)
+        if len(execution_chain) > 0:
+            execution_chain[-1]._children_time += time() - started
+        return [result for _, result in executed]
+
+    def resolve_kwargs(self, raw_function, **kwargs):
+        """
+        Key-word arguments the function would be executed with in this
+        context, including the ones inherited from running executions and
+        from the configuration.
+        """
+        function = raw_function if isinstance(raw_function, Function) else Function(raw_function)
+        return self._get_kwargs(function, self._execution_chain[get_ident()], **kwargs)
+
+    def _execute(self, function, use_cache, kwargs):
+        thread = get_ident()
+        execution_chain = self._execution_chain[thread]
+        chain_functions = self._chain_functions[thread]
+        exec_kwargs = self._get_kwargs(function, execution_chain, **kwargs)
+        execution = Execution(function, self._configuration, verbosity=self._verbosity, **exec_kwargs)
+        execution._scheduler = self._scheduler
+        if self._profiler is not None and self._profiler.matches(function):
+            execution._profiler = self._profiler
+        function_name = function.name
+        # names of executions are compared only when the function is already
+        # in the chain, since computing them is not for free
+        if chain_functions[function_name] > 0:
+            execution_name = execution.name
+            if any(e.name == execution_name for e in execution_chain if e.function.name == function_name):
+                raise CyclicExecution('There is an execution cycle: {} -> {}'.format(
+                    function_name,
+                    [str(e) for e in execution_chain]
+                ))
         for execution_segment in execution_chain:
             execution_segment.add_dependency(execution)
-            execution_segment.function.add_dependency(execution.function)
+            execution_segment.function.add_dependency(function)
         execution_chain.append(execution)
+        chain_functions[function_name] += 1
+        started = time()
         try:
             executed, result = (True, execution()) if (self._cache_provider is None or not use_cache) else self._cache_provider.get_or_execute(execution)
-            self._execution_count[str(execution)] += executed
+            if executed:
+                self._execution_count[self._count_key(function, execution._kwargs)] += 1
         finally:
             execution_chain.pop()
-        return result
-
-    def _get_kwargs(self, function, **cache_kwargs):
+            chain_functions[function_name] -= 1
+            if len(execution_chain) > 0:
+                execution_chain[-1]._children_time += time() - started
+        if executed and function.is_generator:
+            result = self._iterate_in_chain(execution, result)
+        return execution, result
+
+    def _iterate_in_chain(self, execution, items):
+        # the body of the generator runs when the items are consumed, i.e.,
+        # after the execution has left the chain, so it is put back for each
+        # item and the executions made by the body are its dependencies
+        items = iter(items)
+        function_name = execution.function.name
+        try:
+            while True:
+                thread = get_ident()
+                execution_chain = self._execution_chain[thread]
+                chain_functions = self._chain_functions[thread]
+                execution_chain.append(execution)
+                chain_functions[function_name] += 1
+                try:
+                    item = next(items)
+                except StopIteration:
+                    return
+                finally:
+                    execution_chain.pop()
+                    chain_functions[function_name] -= 1
+                yield item
+        finally:
+            # e.g., the stream being stored releases its lock
+            if hasattr(items, 'close'):
+                items.close()
+
+    def create_execution(self, raw_function, **kwargs):
+        """
+        Create the execution of the given function as it would be executed in
+        this context, without executing it.
+        """
+        function = raw_function if isinstance(raw_function, Function) else Function(raw_function)
+        return Execution(function, self._configuration, verbosity=self._verbosity, **self._get_kwargs(function, [], **kwargs))
+
+    def _get_kwargs(self, function, execution_chain, **cache_kwargs):
         valid_args = function.arguments
-        for execution_segment in self._execution_chain[currentThread()][::-1]:
-            for key, value in execution_segment.kwargs.items():
+        for execution_segment in reversed(execution_chain):
+            for key, value in execution_segment._kwargs.items():
                 if key in valid_args and key not in cache_kwargs:
                     cache_kwargs[key] = value
         for arg in valid_args:
-            if arg in self._configuration and arg not in cache_kwargs:
+            if arg not in cache_kwargs and arg in self._configuration:
                 cache_kwargs[arg] = self._configuration[arg]
         return cache_kwargs
 
@@ -302,34 +665,70 @@ class ExecutionContext:
         return self._verbosity
 
     def count_executions(self, function, **kwargs):
-        return self._execution_count[str(Execution(function, {}, verbosity=self.verbosity, **kwargs))]
-
-
-def _serialize(x):
-    if hasattr(x, 'fingerprint'):
-        return json.dumps([
-            '{}.{}'.format(x.__class__.__module__, x.__class__.__name__),
-            x.fingerprint()
-        ], sort_keys=True)
-    try:
-        return json.dumps(x, sort_keys=True)
-    except TypeError:
-        if isinstance(x, dict):
-            return json.dumps(sorted([(k, _serialize(v)) for (k, v) in x.items()]), sort_keys=True)
-        elif isinstance(x, list):
-            return json.dumps([_serialize(v) for v in x])
-        else:
-            return json.dumps({
-                'class': str(x.__class__),
-                'data': x.__dict__,
-            }, sort_keys=True)
+        return self._execution_count[self._count_key(Function(function), kwargs)]
+
+    def _count_key(self, function, kwargs):
+        full_kwargs = function.default_kwargs
+        full_kwargs.update(kwargs)
+        if not any(hasattr(value, 'fingerprint') for value in full_kwargs.values()):
+            try:
+                return function.name, frozenset(full_kwargs.items())
+            except TypeError:
+                pass
+        return str(Execution(function, {}, verbosity=self.verbosity, **kwargs))
+
+
+class LockStatistics:
+
+    """
+    Telemetry of one lock aggregated in the process: how many times it has
+    been acquired, how many times it has been held by someone else (another
+    thread or process) when it was requested, and how long it has been waited
+    for and held.
+    """
+
+    def __init__(self, name, kind, label):
+        self.name = name
+        self.kind = kind
+        self.label = label
+        self.acquisitions = 0
+        self.contended = 0
+        self.wait_time = 0
+        self.max_wait_time = 0
+        self.hold_time = 0
+
+    @property
+    def uncontended(self):
+        return self.acquisitions - self.contended
+
+    def add(self, acquisitions, contended, wait_time, max_wait_time, hold_time):
+        self.acquisitions += acquisitions
+        self.contended += contended
+        self.wait_time += wait_time
+        self.max_wait_time = max(self.max_wait_time, max_wait_time)
+        self.hold_time += hold_time
+
+    def __str__(self):
+        return '{}: {} acquired, {} contended, {:.3f}s waited (max {:.3f}s), {:.3f}s held'.format(
+            self.label, self.acquisitions, self.contended, self.wait_time, self.max_wait_time, self.hold_time
+        )
 
 
 class Locker:
 
-    def __init__(self, directory=None, verbosity=Verbosity.INFO):
+    LOCK_GLOBAL = 'global'
+    LOCK_FUNCTION = 'function'
+    LOCK_EXECUTION = 'execution'
+
+    def __init__(self, directory=None, verbosity=Verbosity.INFO, wait_warning=LOCK_WAIT_WARNING, max_statistics=MAX_LOCK_STATISTICS):
         self._directory = tempfile.mkdtemp() if directory is None else directory
         self._verbosity = verbosity
+        self._wait_warning = wait_warning
+        self._max_statistics = max_statistics
+        self._statistics = OrderedDict()
+        # kind -> statistics of the locks evicted from the statistics above
+        self._other_statistics = {}
+        self._statistics_lock = Lock()
         if not os.path.exists(self._directory):
             os.makedirs(self._directory)
 
@@ -342,7 +741,72 @@ class Locker:
 
     def lock(self, obj=None):
         name = 'spiderpig.global' if obj is None else obj.name
-        return LockWrapper(obj, filelock.FileLock(os.path.join(self._directory, '{}.lock'.format(name))), self._verbosity)
+        return LockWrapper(obj, filelock.FileLock(os.path.join(self._directory, '{}.lock'.format(name))), self._verbosity, locker=self, name=name)
+
+    def statistics(self, kind=None):
+        """
+        Telemetry of the locks acquired by this process (optionally only of
+        the given kind, e.g., Locker.LOCK_EXECUTION), the locks waited for
+        the longest time first. The least recently acquired locks are
+        reported together (their name is None) when there are too many.
+
+        Returns
+        -------
+        list of LockStatistics
+        """
+        with self._statistics_lock:
+            found = [
+                copy(s) for s in list(self._statistics.values()) + list(self._other_statistics.values())
+                if kind is None or s.kind == kind
+            ]
+        return sorted(found, key=lambda s: (-s.wait_time, -s.contended))
+
+    def print_report(self, top=10):
+        """
+        Print the time spent waiting for the locks of each kind and the most
+        contended executions.
+        """
+        statistics = self.statistics()
+        if len(statistics) == 0:
+            return
+        print_info('Lock contention:')
+        with indent(4):
+            for kind in [Locker.LOCK_GLOBAL, Locker.LOCK_FUNCTION, Locker.LOCK_EXECUTION]:
+                of_kind = [s for s in statistics if s.kind == kind]
+                if len(of_kind) > 0:
+                    print_info('{} locks: {} acquired, {} contended, {:.3f}s waited, {:.3f}s held'.format(
+                        kind, sum(s.acquisitions for s in of_kind), sum(s.contended for s in of_kind),
+                        sum(s.wait_time for s in of_kind), sum(s.hold_time for s in of_kind)
+                    ))
+        contended = [s for s in statistics if s.kind == Locker.LOCK_EXECUTION and s.contended > 0 and s.name is not None]
+        if len(contended) > 0:
+            print_info('The most contended executions:')
+            with indent(4):
+                for lock_statistics in contended[:top]:
+                    print_info(lock_statistics)
+
+    def _record(self, name, obj, contended, wait_time, hold_time):
+        with self._statistics_lock:
+            lock_statistics = self._statistics.get(name)
+            if lock_statistics is None:
+                kind = Locker.LOCK_GLOBAL if obj is None else (Locker.LOCK_EXECUTION if isinstance(obj, Execution) else Locker.LOCK_FUNCTION)
+                lock_statistics = LockStatistics(name, kind, 'global' if obj is None else str(obj))
+                self._statistics[name] = lock_statistics
+                if len(self._statistics) > self._max_statistics:
+                    self._merge_other(self._statistics.popitem(last=False)[1])
+            else:
+                self._statistics.move_to_end(name)
+            lock_statistics.add(1, contended, wait_time, wait_time, hold_time)
+
+    def _merge_other(self, lock_statistics):
+        other = self._other_statistics.get(lock_statistics.kind)
+        if other is None:
+            other = LockStatistics(None, lock_statistics.kind, 'other {} locks'.format(lock_statistics.kind))
+            self._other_statistics[lock_statistics.kind] = other
+        other.add(
+            lock_statistics.acquisitions, lock_statistics.contended, lock_statistics.wait_time,
+            lock_statistics.max_wait_time, lock_statistics.hold_time
+        )
 
     def to_serializable(self):
         return {'directory': self._directory}
@@ -354,33 +818,57 @@ class Locker:
 
 class LockWrapper:
 
-    def __init__(self, obj, lock, verbosity):
+    """
+    File lock of the given object (an execution, a function, or None for the
+    global lock). The time the lock is waited for and held is recorded in the
+    statistics of the locker; a warning is printed when the lock has been
+    waited for too long.
+    """
+
+    def __init__(self, obj, lock, verbosity, locker=None, name=None):
         self._lock = lock
         self._obj = obj
         self._verbosity = verbosity
+        self._locker = locker
+        self._name = name
+        self._contended = False
+        self._wait_time = 0
+        self._acquired = None
+
+    def acquire(self, *args, **kwargs):
+        if self._verbosity >= Verbosity.INTERNAL:
+            print_debug('trying to lock {}'.format(self._obj))
+        started = perf_counter()
+        try:
+            # the first attempt tells whether the lock is held by someone else
+            self._lock.acquire(timeout=0)
+            self._contended = False
+        except filelock.Timeout:
+            self._contended = True
+            self._lock.acquire(*args, **kwargs)
+        self._acquired = perf_counter()
+        self._wait_time = self._acquired - started
+        if self._locker is not None and self._contended and self._wait_time > self._locker._wait_warning:
+            print_warn('Waited {:.1f}s for the lock of {}, it is held by another thread or process.'.format(
+                self._wait_time, 'global' if self._obj is None else self._obj
+            ))
+        if self._verbosity >= Verbosity.INTERNAL:
+            print_debug('locking {}'.format(self._obj))
+        return self
+
+    def release(self, *args, **kwargs):
+        self._lock.release(*args, **kwargs)
+        if self._verbosity >= Verbosity.INTERNAL:
+            print_debug('unlocking {}'.format(self._obj))
+        if self._locker is not None and self._acquired is not None:
+            self._locker._record(self._name, self._obj, self._contended, self._wait_time, perf_counter() - self._acquired)
+            self._acquired = None
 
     def __enter__(self):
-        return self._lock.__class__.__enter__(self)
+        return self.acquire()
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        return self._lock.__class__.__exit__(self, exc_type, exc_val, exc_tb)
+        self.release()
 
     def __getattr__(self, attr):
-            self._lock.__class__
-            orig_attr = self._lock.__getattribute__(attr)
-            if self._verbosity < Verbosity.INTERNAL or attr not in ['acquire', 'release']:
-                return orig_attr
-            current_frame = inspect.currentframe()
-            call_frame = inspect.getouterframes(current_frame, 3)
-            line = call_frame[3]
-
-            def hooked(*args, **kwargs):
-                if attr == 'acquire':
-                    print_debug('{}:{} trying to lock {}'.format(line[1], line[2], self._obj))
-                result = orig_attr(*args, **kwargs)
-                if attr == 'acquire':
-                    print_debug('{}:{} locking {}'.format(line[1], line[2], self._obj))
-                else:
-                    print_debug('{}:{} unlocking {}'.format(line[1], line[2], self._obj))
-                return self if result is self._obj else result
-            return hooked
+        return getattr(self._lock, attr)
@@ -0,0 +1,403 @@
+"""
+Canonical fingerprints of arguments of spiderpig functions. The values are
+encoded to a stream fed incrementally to the hasher, so no intermediate
+string representation is built. BLAKE2b is used regardless of installed
+packages, since fingerprints (and thus execution names) have to be the same
+on all hosts sharing one cache.
+
+NumPy arrays and pandas objects are supported without importing these
+packages eagerly. Their data are hashed directly from the underlying buffers.
+Digests of read-only arrays are cached automatically as long as they stay
+read-only (an array made writeable, changed and made read-only again in
+between two fingerprints has to be reported by modified()); other (mutable)
+objects can be registered by track() and have to be reported by modified()
+after being changed in place.
+"""
+
+from collections import OrderedDict
+import datetime
+import hashlib
+import struct
+import sys
+import threading
+import weakref
+
+
+DIGEST_SIZE = 20
+LARGE_SIZE = 1024
+CACHE_SIZE = 256
+# the cache keeps the values alive, so only values worth it are kept there
+# and their total (shallow) size is bounded
+CACHE_MIN_BYTES = 1 << 16
+CACHE_MAX_BYTES = 1 << 26
+
+_HANDLERS = {}
+_RESOLVED_HANDLERS = {}
+_CACHE = OrderedDict()
+_CACHE_BYTES = 0
+_CACHE_LOCK = threading.Lock()
+_TRACKED = {}
+_ADAPTERS = {}
+_ADAPTERS_LOCK = threading.Lock()
+
+
+def fingerprint(*objects):
+    """
+    Compute the canonical fingerprint of the given objects.
+
+        >>> fingerprint({'b': [1, 2.0], 'a': None}) == fingerprint({'a': None, 'b': (1, 2.0)})
+        True
+        >>> fingerprint(1) == fingerprint(1.0)
+        False
+
+    Returns
+    -------
+    hexadecimal digest
+    """
+    hasher = hashlib.blake2b(digest_size=DIGEST_SIZE)
+    for obj in objects:
+        update(hasher, obj)
+    return hasher.hexdigest()
+
+
+def update(hasher, obj):
+    """
+    Feed the canonical encoding of the given object to the hasher.
+    """
+    handler = _HANDLERS.get(obj.__class__)
+    if handler is None:
+        handler = _RESOLVED_HANDLERS.get(obj.__class__)
+        if handler is None:
+            handler = _find_handler(obj)
+            _RESOLVED_HANDLERS[obj.__class__] = handler
+    handler(hasher, obj)
+
+
+def register_handler(cls, handler):
+    """
+    Register the function encoding instances of the given class. The handler
+    is called with the hasher and the object.
+    """
+    _HANDLERS[cls] = handler
+    _RESOLVED_HANDLERS.clear()
+
+
+def track(obj):
+    """
+    Cache the fingerprint of the given (large and mutable) object, e.g., NumPy
+    array or pandas data frame, as long as the object is alive. Whenever the
+    object is changed in place, modified() has to be called.
+    """
+    with _CACHE_LOCK:
+        if id(obj) not in _TRACKED:
+            _TRACKED[id(obj)] = _Tracked(obj)
+
+
+def modified(obj):
+    """
+    Report the in-place change of the tracked object, so its fingerprint is
+    computed again.
+    """
+    with _CACHE_LOCK:
+        tracked = _TRACKED.get(id(obj))
+        if tracked is not None:
+            tracked.version += 1
+
+
+class _Tracked:
+
+    def __init__(self, obj):
+        key = id(obj)
+        self.reference = weakref.ref(obj, lambda _: _TRACKED.pop(key, None))
+        self.version = 0
+        self.digest = None
+        self.digest_version = None
+        # tracked automatically while the object is read-only
+        self.frozen = False
+
+
+def _find_handler(obj):
+    if hasattr(obj, 'fingerprint'):
+        return _update_fingerprinted
+    package = obj.__class__.__module__.split('.')[0]
+    if package in _ADAPTERS:
+        with _ADAPTERS_LOCK:
+            adapter = _ADAPTERS.pop(package, None)
+            if adapter is not None:
+                adapter()
+    for cls, handler in list(_HANDLERS.items()):
+        if isinstance(obj, cls):
+            return handler
+    try:
+        memoryview(obj)
+        return _update_buffer
+    except TypeError:
+        return _update_object
+
+
+def _update_none(hasher, obj):
+    hasher.update(b'N')
+
+
+def _update_bool(hasher, obj):
+    hasher.update(b'T' if obj else b'F')
+
+
+def _update_int(hasher, obj):
+    hasher.update(b'i%d;' % obj)
+
+
+def _update_float(hasher, obj):
+    hasher.update(b'f' + float.__repr__(obj).encode() + b';')
+
+
+def _update_str(hasher, obj):
+    if len(obj) >= LARGE_SIZE:
+        return _update_large(hasher, obj, _update_str_content)
+    _update_str_content(hasher, obj)
+
+
+def _update_str_content(hasher, obj):
+    data = obj.encode('utf-8', 'surrogatepass')
+    hasher.update(b's' + struct.pack('<Q', len(data)))
+    hasher.update(data)
+
+
+def _update_bytes(hasher, obj):
+    if len(obj) >= LARGE_SIZE:
+        return _update_large(hasher, obj, _update_bytes_content)
+    _update_bytes_content(hasher, obj)
+
+
+def _update_bytes_content(hasher, obj):
+    hasher.update(b'b' + struct.pack('<Q', len(obj)))
+    hasher.update(obj)
+
+
+def _update_buffer(hasher, obj):
+    view = memoryview(obj)
+    hasher.update(b'B' + view.format.encode() + b';' + struct.pack('<{}Q'.format(view.ndim), *view.shape))
+    hasher.update(view if view.c_contiguous else view.tobytes())
+
+
+def _update_sequence(hasher, obj):
+    if len(obj) >= LARGE_SIZE:
+        return _update_large(hasher, obj, _update_sequence_content)
+    _update_sequence_content(hasher, obj)
+
+
+def _update_sequence_content(hasher, obj):
+    # lists and tuples are equivalent as they are in JSON
+    hasher.update(b'l' + struct.pack('<Q', len(obj)))
+    for item in obj:
+        update(hasher, item)
+
+
+def _update_dict(hasher, obj):
+    if all(key.__class__ is str for key in obj):
+        hasher.update(b'D' + struct.pack('<Q', len(obj)))
+        for key, value in sorted(obj.items(), key=lambda x: x[0]):
+            _update_str(hasher, key)
+            update(hasher, value)
+        return
+    hasher.update(b'd' + struct.pack('<Q', len(obj)))
+    for key_digest, value in sorted(((_digest(key), value) for key, value in obj.items()), key=lambda x: x[0]):
+        hasher.update(key_digest)
+        update(hasher, value)
+
+
+def _update_set(hasher, obj):
+    if len(obj) >= LARGE_SIZE:
+        return _update_large(hasher, obj, _update_set_content)
+    _update_set_content(hasher, obj)
+
+
+def _update_set_content(hasher, obj):
+    hasher.update(b'S' + struct.pack('<Q', len(obj)))
+    for item_digest in sorted(_digest(item) for item in obj):
+        hasher.update(item_digest)
+
+
+def _update_temporal(hasher, obj):
+    # e.g., the bounds of partitions (see spiderpig.partition)
+    update(hasher, (obj.__class__.__name__, obj.isoformat()))
+
+
+def _update_timedelta(hasher, obj):
+    update(hasher, ('timedelta', obj.days, obj.seconds, obj.microseconds))
+
+
+def _update_fingerprinted(hasher, obj):
+    hasher.update(b'F' + _class_name(obj).encode() + b';')
+    update(hasher, obj.fingerprint())
+
+
+def _update_object(hasher, obj):
+    if not hasattr(obj, '__dict__'):
+        raise TypeError('Can not compute fingerprint of {}, implement fingerprint() method.'.format(obj.__class__))
+    hasher.update(b'o' + _class_name(obj).encode() + b';')
+    update(hasher, obj.__dict__)
+
+
+def _update_large(hasher, obj, update_content):
+    """
+    Large values are encoded by their own digest. Digests of big strings and
+    bytes are cached, so the same big argument is not hashed on every call.
+    Tuples and frozensets are not cached, since they can contain mutable
+    objects (even hashable ones).
+    """
+    global _CACHE_BYTES
+    hasher.update(b'h')
+    size = sys.getsizeof(obj)
+    immutable = size >= CACHE_MIN_BYTES and obj.__class__ in (str, bytes)
+    if immutable:
+        with _CACHE_LOCK:
+            cached = _CACHE.get(id(obj))
+            if cached is not None and cached[0] is obj:
+                _CACHE.move_to_end(id(obj))
+                hasher.update(cached[1])
+                return
+    sub_hasher = hashlib.blake2b(digest_size=DIGEST_SIZE)
+    update_content(sub_hasher, obj)
+    digest = sub_hasher.digest()
+    if immutable:
+        with _CACHE_LOCK:
+            # the object is kept in the cache, so its id can not be reused
+            previous = _CACHE.pop(id(obj), None)
+            if previous is not None:
+                _CACHE_BYTES -= previous[2]
+            _CACHE[id(obj)] = (obj, digest, size)
+            _CACHE_BYTES += size
+            while len(_CACHE) > CACHE_SIZE or (_CACHE_BYTES > CACHE_MAX_BYTES and len(_CACHE) > 1):
+                _CACHE_BYTES -= _CACHE.popitem(last=False)[1][2]
+    hasher.update(digest)
+
+
+def _update_tracked(hasher, obj, update_content, frozen=False):
+    """
+    Encode the object by the digest of its content. The digest is cached if
+    the object is tracked or known to be frozen.
+    """
+    with _CACHE_LOCK:
+        tracked = _TRACKED.get(id(obj))
+        if tracked is None and frozen:
+            try:
+                tracked = _TRACKED[id(obj)] = _Tracked(obj)
+                tracked.frozen = True
+            except TypeError:
+                pass
+        if tracked is not None and tracked.reference() is not obj:
+            tracked = None
+        if tracked is not None and tracked.frozen and not frozen:
+            # the object has been made writeable again
+            del _TRACKED[id(obj)]
+            tracked = None
+        if tracked is not None and tracked.digest_version == tracked.version:
+            hasher.update(tracked.digest)
+            return
+        version = None if tracked is None else tracked.version
+    sub_hasher = hashlib.blake2b(digest_size=DIGEST_SIZE)
+    update_content(sub_hasher, obj)
+    digest = sub_hasher.digest()
+    if tracked is not None:
+        with _CACHE_LOCK:
+            if tracked.version == version:
+                tracked.digest, tracked.digest_version = digest, version
+    hasher.update(digest)
+
+
+def _digest(obj):
+    hasher = hashlib.blake2b(digest_size=DIGEST_SIZE)
+    update(hasher, obj)
+    return hasher.digest()
+
+
+def _register_numpy():
+    import numpy
+
+    def is_frozen(array):
+        # a read-only view of a writeable array can still change
+        while isinstance(array, numpy.ndarray):
+            if array.flags.writeable:
+                return False
+            array = array.base
+        return array is None or isinstance(array, bytes)
+
+    def update_data(hasher, array):
+        if array.dtype.hasobject:
+            update(hasher, array.tolist())
+        elif array.flags.c_contiguous:
+            hasher.update(array.reshape(-1).view(numpy.uint8))
+        else:
+            # walk the array in C order by chunks instead of copying it
+            iterator = numpy.nditer(array, flags=['external_loop', 'buffered', 'zerosize_ok'], order='C', buffersize=1 << 16)
+            for chunk in iterator:
+                hasher.update(numpy.ascontiguousarray(chunk).view(numpy.uint8))
+
+    def update_array(hasher, array):
+        hasher.update(b'A')
+        update(hasher, array.dtype.descr)
+        update(hasher, array.shape)
+        _update_tracked(hasher, array, update_data, frozen=is_frozen(array))
+
+    def update_scalar(hasher, value):
+        update(hasher, value.item())
+
+    register_handler(numpy.ndarray, update_array)
+    register_handler(numpy.generic, update_scalar)
+
+
+def _register_pandas():
+    import pandas
+
+    def update_index(hasher, index):
+        if isinstance(index, pandas.RangeIndex):
+            update(hasher, ('RangeIndex', index.start, index.stop, index.step, index.name))
+        else:
+            update(hasher, (index.__class__.__name__, str(index.dtype), list(index.names), index.to_numpy()))
+
+    def update_series_data(hasher, series):
+        update(hasher, (str(series.dtype), series.to_numpy()))
+
+    def update_series(hasher, series):
+        update(hasher, ('Series', series.name, series.index))
+        _update_tracked(hasher, series, update_series_data)
+
+    def update_frame_data(hasher, frame):
+        for i in range(frame.shape[1]):
+            update_series_data(hasher, frame.iloc[:, i])
+
+    def update_frame(hasher, frame):
+        update(hasher, ('DataFrame', frame.index, frame.columns))
+        _update_tracked(hasher, frame, update_frame_data)
+
+    register_handler(pandas.Timestamp, lambda hasher, value: update(hasher, ('Timestamp', value.isoformat())))
+    register_handler(pandas.Timedelta, lambda hasher, value: update(hasher, ('Timedelta', value.value)))
+    register_handler(pandas.Index, update_index)
+    register_handler(pandas.Series, update_series)
+    register_handler(pandas.DataFrame, update_frame)
+
+
+def _class_name(obj):
+    return '{}.{}'.format(obj.__class__.__module__, obj.__class__.__qualname__)
+
+
+register_handler(type(None), _update_none)
+register_handler(bool, _update_bool)
+register_handler(int, _update_int)
+register_handler(float, _update_float)
+register_handler(str, _update_str)
+register_handler(bytes, _update_bytes)
+register_handler(bytearray, _update_bytes)
+register_handler(list, _update_sequence)
+register_handler(tuple, _update_sequence)
+register_handler(dict, _update_dict)
+register_handler(set, _update_set)
+register_handler(frozenset, _update_set)
+# datetime is a subclass of date, so it has to be found first
+register_handler(datetime.datetime, _update_temporal)
+register_handler(datetime.date, _update_temporal)
+register_handler(datetime.time, _update_temporal)
+register_handler(datetime.timedelta, _update_timedelta)
+_ADAPTERS['numpy'] = _register_numpy
+_ADAPTERS['pandas'] = _register_pandas
@@ -0,0 +1,453 @@
+"""
+Storage packing small results into log-structured segment files, so caches
+with many tiny results (scalars, small dictionaries) do not need several
+files per execution. Each process appends records (name, execution info,
+pickled result) to its own segment in the '.packed' directory; the segment
+is locked while it is written, so it is sealed once the process ends or the
+segment is full. Every process keeps the index of the newest record of
+each execution, refreshed by scanning what has been appended since the last
+scan (a snapshot of the index is saved, so the segments are not scanned
+from the beginning). Deleted executions get empty records (tombstones).
+Results with large pickles are stored as standalone files, as in
+FileStorage. The indices of dependents and dirty markers are kept in files
+as well.
+
+Rewritten and deleted executions leave dead records in the segments, which
+are reclaimed by PackedFileStorage.compact (spiderpig-compact) while the
+cache is in use.
+"""
+
+from .cache import FileStorage, StoredStream, _atomic_write
+from .execution import Execution
+from .msg import Verbosity, print_warn
+from collections import defaultdict
+from time import time, time_ns
+import fcntl
+import filelock
+import os
+import pickle
+import shutil
+import struct
+import threading
+import uuid
+import zlib
+
+
+# results with larger pickles are stored as standalone files
+MAX_PACKED_SIZE = 16 * 1024
+# size after which the segment is sealed and a new one is started
+SEGMENT_SIZE = 64 * 1024 * 1024
+# number of bytes indexed since the last snapshot of the index after which
+# the snapshot is saved
+SNAPSHOT_BYTES = 1024 * 1024
+# seconds for which the found live record is trusted without refreshing the
+# index, missing records are always looked up in the new records
+REFRESH_INTERVAL = 1
+
+_MAGIC = b'SPR1'
+# magic, name length, info length, result length, time, checksum
+_HEADER = struct.Struct('<4sIIIdI')
+_SEGMENT_SUFFIX = '.segment'
+_SNAPSHOT = 'index.pickle'
+# nanoseconds
+_RACY_MTIME = 2 * 10 ** 9
+
+
+class PackedFileStorage(FileStorage):
+
+    """
+    FileStorage keeping executions whose pickled result is at most
+    max_packed_size bytes in segment files. The results are packed only in
+    the sharded layout (see FileStorage.migrate), otherwise they are stored
+    as by FileStorage. Once used, the cache is marked packed,
+    so spiderpig opens it by this storage (see is_packed).
+    """
+
+    def __init__(self, directory, verbosity=Verbosity.INFO, max_packed_size=MAX_PACKED_SIZE, segment_size=SEGMENT_SIZE):
+        FileStorage.__init__(self, directory, verbosity)
+        self._packed_directory = os.path.join(directory, '.packed')
+        self._max_packed_size = max_packed_size
+        self._segment_size = segment_size
+        # object name -> (time, segment, offset, info length, result length)
+        self._records = None
+        # segment -> number of scanned bytes
+        self._scanned = None
+        self._unsaved = 0
+        self._directory_mtime = None
+        self._refresh_time = 0
+        # [process id, segment, file descriptor, size] of the written segment
+        self._segment_writer = None
+        self._records_lock = threading.RLock()
+        self._layout_warned = False
+
+    @staticmethod
+    def is_packed(directory):
+        """
+        True if the cache in the given directory has been used by
+        PackedFileStorage.
+        """
+        return FileStorage(directory).read_info().get('packed', False)
+
+    def write_info(self, **kwargs):
+        FileStorage.write_info(self, **dict(kwargs, packed=True))
+
+    def write_execution_result(self, execution):
+        execution_result = execution()
+        object_name = self._get_execution_object_names(execution.name)[0]
+        if isinstance(execution_result, StoredStream):
+            # the items are stored in chunks anyway
+            FileStorage.write_execution_result(self, execution)
+            self._delete_record(object_name)
+            return
+        data = pickle.dumps(execution_result)
+        execution.set_statistics(size=len(data))
+        if len(data) > self._max_packed_size or not self._packable():
+            _atomic_write(self._get_filename(object_name, 'execution.pickle', prepare=True), lambda f: f.write(data))
+            self.write_execution(execution)
+            self.write_execution_ready(execution)
+            self._delete_record(object_name)
+        else:
+            self._append(object_name, pickle.dumps(execution.to_serializable()), data)
+            # the previous version could be large
+            for extension in ['execution.ready', 'execution.pickle', 'execution.info.pickle']:
+                try:
+                    os.remove(self._get_filename(object_name, extension))
+                except FileNotFoundError:
+                    pass
+        self._index_written(execution)
+
+    def _packable(self):
+        if self.layout == FileStorage.LAYOUT_SHARDED and not self._migrating:
+            return True
+        # the results are stored as standalone files until the cache is
+        # migrated
+        if not self._layout_warned:
+            self._layout_warned = True
+            print_warn('The packed storage needs the sharded layout, results are not packed until the cache is migrated (spiderpig-migrate).')
+        return False
+
+    def read_execution_result(self, execution):
+        object_name = self._find_execution(execution)
+        record = None if object_name is None else self._read_record(object_name)
+        if record is None:
+            return FileStorage.read_execution_result(self, execution)
+        return pickle.loads(record[1])
+
+    def read_execution_time(self, execution):
+        object_name = self._find_execution(execution)
+        entry = None if object_name is None else self._live_entry(object_name, refresh=False)
+        if entry is None:
+            return FileStorage.read_execution_time(self, execution)
+        return entry[0]
+
+    def read_execution(self, execution):
+        object_name = self._find_execution(execution)
+        record = None if object_name is None else self._read_record(object_name)
+        if record is None:
+            return FileStorage.read_execution(self, execution)
+        return Execution.from_serializable(pickle.loads(record[0]))
+
+    def read_executions(self, function=None):
+        yield from FileStorage.read_executions(self, function)
+        with self._records_lock:
+            self._refresh()
+            object_names = [name for (name, entry) in self._records.items() if entry[3] > 0]
+        for object_name in object_names:
+            if function is not None and object_name.rsplit('.', 3)[0] != function.name:
+                continue
+            if FileStorage._is_ready(self, object_name):
+                # the standalone version has been already read
+                continue
+            record = self._read_record(object_name)
+            if record is not None:
+                yield Execution.from_serializable(pickle.loads(record[0]))
+
+    def delete_execution_result(self, execution, invalidate_dependents=True):
+        object_name = self._find_execution(execution)
+        FileStorage.delete_execution_result(self, execution, invalidate_dependents=invalidate_dependents)
+        if object_name is not None:
+            self._delete_record(object_name)
+
+    def clear(self):
+        with self._records_lock:
+            self._close_segment()
+            shutil.rmtree(self._packed_directory, ignore_errors=True)
+            self._records, self._scanned, self._unsaved, self._directory_mtime = None, None, 0, None
+        FileStorage.clear(self)
+
+    def close(self):
+        # the segment is sealed, so it can be compacted
+        with self._records_lock:
+            self._close_segment()
+            if self._unsaved > 0:
+                self._save_snapshot()
+
+    def compact(self, min_dead_ratio=0.5):
+        """
+        Rewrite the live records of sealed segments into new segments and
+        delete the old ones. The segments with at least the given ratio of
+        dead bytes are compacted, the small segments are merged. Segments
+        still written by other processes are skipped, the cache can be used
+        during the compaction.
+
+        Returns
+        -------
+        (number of compacted segments, number of reclaimed bytes)
+        """
+        os.makedirs(self._packed_directory, exist_ok=True)
+        with filelock.FileLock(os.path.join(self._packed_directory, 'compact.lock')), self._records_lock:
+            self._close_segment()
+            self._refresh()
+            sealed = {}
+            try:
+                for segment in list(self._scanned):
+                    fd = _open_sealed(self._get_segment_filename(segment))
+                    if fd is not None:
+                        sealed[segment] = fd
+                # the sealed segments do not grow anymore
+                self._refresh()
+                sizes = {segment: os.fstat(fd).st_size for (segment, fd) in sealed.items()}
+                live = defaultdict(int)
+                for object_name, entry in self._records.items():
+                    live[entry[1]] += _record_size(object_name, entry)
+                selected = [s for s in sealed if sizes[s] > 0 and 1 - live[s] / sizes[s] >= min_dead_ratio]
+                small = [s for s in sealed if s not in selected and sizes[s] < self._segment_size / 2]
+                if len(small) > 1 or (len(small) > 0 and len(selected) > 0):
+                    selected += small
+                if len(selected) == 0:
+                    return 0, 0
+                # tombstones have to be kept while any segment could contain
+                # an older record of the execution
+                keep_tombstones = len(selected) < len(self._scanned)
+                moved = sorted(
+                    [(name, entry) for (name, entry) in self._records.items() if entry[1] in selected and (entry[3] > 0 or keep_tombstones)],
+                    key=lambda x: (x[1][1], x[1][2])
+                )
+                written = 0
+                for object_name, entry in moved:
+                    size = _record_size(object_name, entry)
+                    record = os.pread(sealed[entry[1]], size, entry[2])
+                    self._write_record(object_name, record, entry[0], entry[3], entry[4], sync=False)
+                    written += size
+                if self._segment_writer is not None:
+                    os.fsync(self._segment_writer[2])
+                self._close_segment()
+                for segment in selected:
+                    os.remove(self._get_segment_filename(segment))
+            finally:
+                for fd in sealed.values():
+                    os.close(fd)
+            self._refresh()
+            self._save_snapshot()
+            return len(selected), sum(sizes[s] for s in selected) - written
+
+    def _is_ready(self, object_name):
+        return self._live_entry(object_name) is not None or FileStorage._is_ready(self, object_name)
+
+    def _live_entry(self, object_name, refresh=True):
+        with self._records_lock:
+            if self._records is None:
+                self._refresh()
+            entry = self._records.get(object_name)
+            if refresh and (entry is None or entry[3] == 0 or time() - self._refresh_time > REFRESH_INTERVAL):
+                self._refresh()
+                entry = self._records.get(object_name)
+        return entry if entry is not None and entry[3] > 0 else None
+
+    def _read_record(self, object_name):
+        """
+        Read the live record of the given execution.
+
+        Returns
+        -------
+        (pickled info, pickled result), or None if there is no live record
+        """
+        entry = self._live_entry(object_name, refresh=False)
+        while entry is not None:
+            try:
+                with open(self._get_segment_filename(entry[1]), 'rb') as f:
+                    f.seek(entry[2])
+                    data = f.read(_record_size(object_name, entry))
+                break
+            except FileNotFoundError:
+                # the segment has been compacted in the meantime
+                previous, entry = entry, self._live_entry(object_name)
+                if entry == previous:
+                    raise
+        if entry is None:
+            return None
+        magic, name_length, info_length, result_length, _, checksum = _HEADER.unpack_from(data)
+        body = memoryview(data)[_HEADER.size:]
+        if magic != _MAGIC or zlib.crc32(body) != checksum:
+            raise ValueError('The packed record of {} in the segment {} is corrupted.'.format(object_name, entry[1]))
+        return bytes(body[name_length:name_length + info_length]), body[name_length + info_length:]
+
+    def _delete_record(self, object_name):
+        if self._live_entry(object_name) is not None:
+            self._append(object_name, b'', b'')
+
+    def _append(self, object_name, info, result):
+        name = object_name.encode('utf-8')
+        written = time()
+        checksum = zlib.crc32(result, zlib.crc32(info, zlib.crc32(name)))
+        record = _HEADER.pack(_MAGIC, len(name), len(info), len(result), written, checksum) + name + info + result
+        with self._records_lock:
+            if self._records is None:
+                self._refresh()
+            self._write_record(object_name, record, written, len(info), len(result))
+
+    def _write_record(self, object_name, record, written, info_length, result_length, sync=True):
+        segment, fd, offset = self._get_writable_segment(len(record))
+        view = memoryview(record)
+        while len(view) > 0:
+            view = view[os.write(fd, view):]
+        if sync:
+            os.fsync(fd)
+        self._segment_writer[3] += len(record)
+        if self._scanned.get(segment) == offset:
+            self._scanned[segment] = offset + len(record)
+        self._index(object_name, (written, segment, offset, info_length, result_length))
+        self._unsaved += len(record)
+        if self._unsaved >= SNAPSHOT_BYTES:
+            self._save_snapshot()
+
+    def _get_writable_segment(self, size):
+        writer = self._segment_writer
+        if writer is not None and (writer[0] != os.getpid() or (writer[3] > 0 and writer[3] + size > self._segment_size)):
+            # the segment of the parent process is not written by the child
+            self._close_segment()
+        if self._segment_writer is None:
+            os.makedirs(self._packed_directory, exist_ok=True)
+            segment = '{:020d}-{}{}'.format(time_ns(), uuid.uuid4().hex[:8], _SEGMENT_SUFFIX)
+            tmp_filename = os.path.join(self._packed_directory, '.{}.tmp'.format(segment))
+            fd = os.open(tmp_filename, os.O_WRONLY | os.O_CREAT | os.O_EXCL | os.O_APPEND, 0o644)
+            # the segment is locked before it is visible, so the compaction
+            # never takes the segment which is being written
+            fcntl.flock(fd, fcntl.LOCK_SH)
+            os.rename(tmp_filename, self._get_segment_filename(segment))
+            self._segment_writer = [os.getpid(), segment, fd, 0]
+            self._scanned[segment] = 0
+        _, segment, fd, offset = self._segment_writer
+        return segment, fd, offset
+
+    def _close_segment(self):
+        if self._segment_writer is not None:
+            os.close(self._segment_writer[2])
+            self._segment_writer = None
+
+    def _refresh(self):
+        """
+        Index the records appended since the last refresh and forget the
+        records of deleted (compacted) segments.
+        """
+        with self._records_lock:
+            if self._records is None:
+                self._load_snapshot()
+            try:
+                directory_mtime = os.stat(self._packed_directory).st_mtime_ns
+            except FileNotFoundError:
+                directory_mtime = None
+            # the directory is listed only if segments could have been added
+            # or removed; the modification time is coarse, so recently
+            # modified directory is always listed
+            if directory_mtime is None:
+                segments = set()
+            elif directory_mtime != self._directory_mtime or time_ns() - directory_mtime < _RACY_MTIME:
+                segments = {f for f in os.listdir(self._packed_directory) if f.endswith(_SEGMENT_SUFFIX)}
+            else:
+                segments = set(self._scanned)
+            self._directory_mtime = directory_mtime
+            self._refresh_time = time()
+            removed = [s for s in self._scanned if s not in segments]
+            if len(removed) > 0:
+                removed = set(removed)
+                for object_name in [n for (n, e) in self._records.items() if e[1] in removed]:
+                    del self._records[object_name]
+                for segment in removed:
+                    del self._scanned[segment]
+            for segment in sorted(segments):
+                self._scan(segment)
+            if self._unsaved >= SNAPSHOT_BYTES:
+                self._save_snapshot()
+
+    def _scan(self, segment):
+        offset = self._scanned.get(segment, 0)
+        filename = self._get_segment_filename(segment)
+        try:
+            size = os.path.getsize(filename)
+        except FileNotFoundError:
+            return
+        if size <= offset:
+            self._scanned[segment] = offset
+            return
+        with open(filename, 'rb') as f:
+            f.seek(offset)
+            position = offset
+            while position + _HEADER.size <= size:
+                header = f.read(_HEADER.size)
+                if len(header) < _HEADER.size:
+                    break
+                magic, name_length, info_length, result_length, written, _ = _HEADER.unpack(header)
+                end = position + _HEADER.size + name_length + info_length + result_length
+                if magic != _MAGIC or end > size:
+                    # the record is still being written (or the writer has
+                    # been killed), it is read again by the next scan
+                    break
+                object_name = f.read(name_length).decode('utf-8')
+                self._index(object_name, (written, segment, position, info_length, result_length))
+                f.seek(end)
+                position = end
+        self._unsaved += position - offset
+        self._scanned[segment] = position
+
+    def _index(self, object_name, entry):
+        current = self._records.get(object_name)
+        if current is None or entry[0] >= current[0]:
+            self._records[object_name] = entry
+
+    def _load_snapshot(self):
+        self._records, self._scanned = {}, {}
+        try:
+            with open(os.path.join(self._packed_directory, _SNAPSHOT), 'rb') as f:
+                snapshot = pickle.load(f)
+            self._records, self._scanned = snapshot['records'], snapshot['scanned']
+        except (OSError, EOFError, KeyError, pickle.UnpicklingError):
+            pass
+
+    def _save_snapshot(self):
+        snapshot = {'records': dict(self._records), 'scanned': dict(self._scanned)}
+        try:
+            os.makedirs(self._packed_directory, exist_ok=True)
+            _atomic_write(os.path.join(self._packed_directory, _SNAPSHOT), lambda f: pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL))
+        except OSError:
+            # the snapshot only speeds up the start
+            pass
+        self._unsaved = 0
+
+    def _get_segment_filename(self, segment):
+        return os.path.join(self._packed_directory, segment)
+
+
+def _record_size(object_name, entry):
+    return _HEADER.size + len(object_name.encode('utf-8')) + entry[3] + entry[4]
+
+
+def _open_sealed(filename):
+    """
+    Open and exclusively lock the segment which is not written by any
+    process.
+
+    Returns
+    -------
+    file descriptor, or None if the segment is being written
+    """
+    try:
+        fd = os.open(filename, os.O_RDONLY)
+    except FileNotFoundError:
+        return None
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return fd
+    except BlockingIOError:
+        os.close(fd)
+        return None
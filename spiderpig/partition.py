@@ -0,0 +1,95 @@
+"""
+Partitioning of executions over ranges of values, e.g., time ranges. The
+range given by the 'start' and 'end' arguments is split into aligned
+partitions which are executed (and cached) separately, and their results are
+merged by the given combiner. Extending the range thus computes only the new
+partitions.
+"""
+
+from .exceptions import ValidationError
+import datetime
+
+
+RANGE_ARGUMENTS = ('start', 'end')
+
+
+def split_dates(start, end):
+    """
+    Split the range [start, end) into days. Dates, datetimes and ISO date
+    strings are supported.
+
+        >>> split_dates('2020-02-27', '2020-03-01')
+        [('2020-02-27', '2020-02-28'), ('2020-02-28', '2020-02-29'), ('2020-02-29', '2020-03-01')]
+        >>> split_dates(datetime.datetime(2020, 1, 1, 12), datetime.datetime(2020, 1, 2, 6))
+        [(datetime.datetime(2020, 1, 1, 12, 0), datetime.datetime(2020, 1, 2, 0, 0)), (datetime.datetime(2020, 1, 2, 0, 0), datetime.datetime(2020, 1, 2, 6, 0))]
+
+    Returns
+    -------
+    list of (start, end) tuples
+    """
+    if isinstance(start, str) and isinstance(end, str):
+        return [
+            (s.isoformat(), e.isoformat())
+            for s, e in split_dates(datetime.date.fromisoformat(start), datetime.date.fromisoformat(end))
+        ]
+    day = datetime.timedelta(days=1)
+    if isinstance(start, datetime.datetime):
+        # partitions are aligned to midnights, so they are shared by ranges
+        # starting at different times
+        boundary = datetime.datetime.combine(start.date(), datetime.time(), tzinfo=start.tzinfo) + day
+    elif isinstance(start, datetime.date):
+        boundary = start + day
+    else:
+        raise ValidationError('Can not split the range of {} into dates.'.format(start.__class__.__name__))
+    boundaries = [start]
+    while boundary < end:
+        boundaries.append(boundary)
+        boundary += day
+    boundaries.append(end)
+    return [(s, e) for s, e in zip(boundaries[:-1], boundaries[1:]) if s < e]
+
+
+PARTITIONERS = {
+    'date': split_dates,
+}
+
+
+def get_partitioner(partition_by):
+    """
+    Get the function splitting a range into partitions. It is either one of
+    the PARTITIONERS or a callable taking start and end and returning the
+    list of (start, end) tuples.
+    """
+    if callable(partition_by):
+        return partition_by
+    if partition_by not in PARTITIONERS:
+        raise ValidationError('The partitioning has to be one of {} or a callable, given: {}'.format(sorted(PARTITIONERS), partition_by))
+    return PARTITIONERS[partition_by]
+
+
+def execute(context, function, use_cache=True, **kwargs):
+    """
+    Execute the partitioned function in the given context: each partition of
+    the range is executed (and cached) separately, in parallel when the
+    function has more 'partition_workers', and the results are merged by its
+    'combine' option.
+    """
+    options = function.options
+    resolved = context.resolve_kwargs(function, **kwargs)
+    defaults = function.default_kwargs
+    bounds = []
+    for argument in RANGE_ARGUMENTS:
+        if argument in resolved:
+            bounds.append(resolved[argument])
+        elif argument in defaults:
+            bounds.append(defaults[argument])
+        else:
+            raise ValidationError('The partitioned function {} has to be given the argument {}.'.format(function.name, argument))
+    partitions = get_partitioner(options['partition_by'])(*bounds)
+    results = context.execute_many(
+        function,
+        [dict(kwargs, **dict(zip(RANGE_ARGUMENTS, partition))) for partition in partitions],
+        use_cache=use_cache,
+        workers=options.get('partition_workers') or 1,
+    )
+    return options['combine'](results)
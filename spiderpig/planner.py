@@ -0,0 +1,228 @@
+"""
+Planning of executions without executing them (dry run). The plan is built
+from the dependency graph of functions recorded by previous runs and from
+metadata of stored executions, including their compute times.
+"""
+
+from .cache import InMemoryCacheProvider, StorageCacheProvider
+from .execution import Execution
+from .exceptions import TooManyDependencies
+from .msg import print_info, print_success, print_warn
+from .shm import SharedMemoryCacheProvider
+from clint.textui import indent
+from itertools import islice
+
+
+STATUS_MEMORY = 'memory'
+STATUS_SHARED_MEMORY = 'shared memory'
+STATUS_DISK = 'disk'
+STATUS_REMOTE = 'remote'
+STATUS_STALE = 'stale'
+STATUS_MISSING = 'missing'
+STATUS_NOT_CACHED = 'not cached'
+
+VALID_STATUSES = [STATUS_MEMORY, STATUS_SHARED_MEMORY, STATUS_DISK, STATUS_REMOTE]
+
+# number of stored executions used to estimate the compute time of an
+# execution which has never been computed
+SAMPLE_SIZE = 100
+
+
+class PlannedExecution:
+
+    def __init__(self, execution, status, estimated_time):
+        self.execution = execution
+        self.status = status
+        self.estimated_time = estimated_time
+        self.dependencies = []
+
+    @property
+    def name(self):
+        return self.execution.name
+
+    @property
+    def to_compute(self):
+        return self.status not in VALID_STATUSES
+
+    def __str__(self):
+        return str(self.execution)
+
+
+class Plan:
+
+    def __init__(self, root):
+        self.root = root
+
+    @property
+    def executions(self):
+        """
+        All planned executions which are needed, i.e., the executions whose
+        results are available are not expanded.
+        """
+        found = {}
+        to_visit = [self.root]
+        while len(to_visit) > 0:
+            planned = to_visit.pop()
+            if planned.name in found:
+                continue
+            found[planned.name] = planned
+            to_visit += planned.dependencies
+        return list(found.values())
+
+    @property
+    def to_compute(self):
+        return [p for p in self.executions if p.to_compute]
+
+    @property
+    def estimated_time(self):
+        """
+        Estimated time (in seconds) of computing all executions sequentially.
+        Executions with unknown time are not counted.
+        """
+        return sum(p.estimated_time for p in self.to_compute if p.estimated_time is not None)
+
+    @property
+    def critical_path(self):
+        """
+        The sequence of dependent executions to compute with the highest
+        estimated time, starting from the root.
+
+        Returns
+        -------
+        (list of planned executions, estimated time)
+        """
+        costs = {}
+
+        def cost(planned):
+            if planned.name not in costs:
+                if not planned.to_compute:
+                    costs[planned.name] = (0, [])
+                else:
+                    dependency_cost, path = max([cost(d) for d in planned.dependencies] + [(0, [])], key=lambda x: x[0])
+                    costs[planned.name] = (dependency_cost + (planned.estimated_time or 0), [planned] + path)
+            return costs[planned.name]
+        total, path = cost(self.root)
+        return path, total
+
+    def print(self):
+        print_info('Execution plan:')
+        with indent(4):
+            self._print_tree(self.root, set())
+        to_compute = self.to_compute
+        unknown = sum(1 for p in to_compute if p.estimated_time is None)
+        if len(to_compute) == 0:
+            print_success('Everything is cached.')
+            return
+        print_info('Executions to compute: {}'.format(len(to_compute)))
+        print_info('Estimated time: {}'.format(_format_time(self.estimated_time)))
+        if unknown > 0:
+            print_warn('The time of {} executions is unknown.'.format(unknown))
+        path, path_time = self.critical_path
+        print_info('Critical path ({}):'.format(_format_time(path_time)))
+        with indent(4):
+            for planned in path:
+                print_info('{} {}'.format(planned, _format_time(planned.estimated_time)))
+
+    def _print_tree(self, planned, printed):
+        print_info('[{}] {}{}'.format(
+            planned.status, planned, '' if not planned.to_compute else ' ' + _format_time(planned.estimated_time)
+        ))
+        if planned.name in printed:
+            return
+        printed.add(planned.name)
+        with indent(4):
+            for dependency in planned.dependencies:
+                self._print_tree(dependency, printed)
+
+
+class Planner:
+
+    """
+    Builds the plan of the given execution in the given context. No user
+    function is executed, the results are not read.
+    """
+
+    def __init__(self, context, cache_provider):
+        self._context = context
+        self._providers = []
+        while cache_provider is not None:
+            self._providers.append(cache_provider)
+            cache_provider = cache_provider.provider
+        self._storages = [p.storage for p in self._providers if isinstance(p, StorageCacheProvider)]
+        self._planned = {}
+        self._function_times = {}
+
+    def plan(self, raw_function, use_cache=None, **kwargs):
+        execution = self._context.create_execution(raw_function, **kwargs)
+        if use_cache is not None:
+            execution.function.set_options(cached=use_cache)
+        return Plan(self._plan(execution, []))
+
+    def _plan(self, execution, chain):
+        name = execution.name
+        if name in self._planned:
+            return self._planned[name]
+        stored = self._read_execution(execution)
+        status = self._status(execution, stored)
+        own_time = None if stored is None else stored.own_time
+        planned = PlannedExecution(execution, status, own_time if own_time is not None else self._function_time(execution.function))
+        self._planned[name] = planned
+        if planned.to_compute:
+            chain = chain + [execution]
+            for dependency in self._direct_dependencies(execution, stored, chain):
+                planned.dependencies.append(self._plan(dependency, chain))
+        return planned
+
+    def _status(self, execution, stored):
+        if not execution.function.options.get('cached', True):
+            return STATUS_NOT_CACHED
+        for provider in self._providers:
+            if provider.is_valid_cache(execution):
+                if isinstance(provider, InMemoryCacheProvider):
+                    return STATUS_MEMORY
+                if isinstance(provider, SharedMemoryCacheProvider):
+                    return STATUS_SHARED_MEMORY
+                return STATUS_DISK if isinstance(provider, StorageCacheProvider) else STATUS_REMOTE
+        return STATUS_MISSING if stored is None else STATUS_STALE
+
+    def _direct_dependencies(self, execution, stored, chain):
+        if stored is not None:
+            # the stored dependencies contain also dependencies of
+            # dependencies executed at the same time
+            dependencies = stored.dependencies
+            indirect = set()
+            for dependency in dependencies:
+                stored_dependency = self._read_execution(dependency)
+                if stored_dependency is not None:
+                    indirect |= {d.name for d in stored_dependency.dependencies}
+            return [d for d in dependencies if d.name not in indirect]
+        functions = execution.function.dependencies
+        indirect = {d.name for f in functions for d in f.dependencies}
+        return [
+            Execution(f, self._context.configuration, **self._context._get_kwargs(f, chain))
+            for f in functions if f.name not in indirect
+        ]
+
+    def _read_execution(self, execution):
+        for storage in self._storages:
+            try:
+                stored = storage.read_execution(execution)
+            except TooManyDependencies:
+                continue
+            if stored is not None:
+                return stored
+        return None
+
+    def _function_time(self, function):
+        if function.name not in self._function_times:
+            times = []
+            for storage in self._storages:
+                times += [e.own_time for e in islice(storage.read_executions(function), SAMPLE_SIZE) if e.own_time is not None]
+            self._function_times[function.name] = sum(times) / len(times) if len(times) > 0 else None
+        return self._function_times[function.name]
+
+
+def _format_time(seconds):
+    if seconds is None:
+        return '(unknown time)'
+    return '{0:.3f}s'.format(seconds)
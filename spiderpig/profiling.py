@@ -0,0 +1,137 @@
+"""
+Opt-in profiling of executions. The executions of functions matching the
+given patterns (e.g., 'pkg.mod.*') are computed under cProfile and
+tracemalloc; the statistics (in the .pstats format) and the summary of the
+peak memory are stored next to the execution in the storage, so the hot
+spots of a regressed stage can be compared with its previous runs (see
+spiderpig-profiles).
+"""
+
+from contextlib import contextmanager
+from fnmatch import fnmatchcase
+from time import time
+import cProfile
+import pstats
+import threading
+import tracemalloc
+
+
+# number of frames kept by tracemalloc for each allocation
+TRACEMALLOC_FRAMES = 1
+# number of allocation sites of the retained memory kept in the summary
+TOP_ALLOCATIONS = 10
+
+
+class Profiler:
+
+    """
+    Profiles the executions of the functions whose names match any of the
+    given (fnmatch) patterns and writes their profiles to the storage.
+    Executions nested in a profiled execution of the same thread are
+    included in its profile.
+    """
+
+    def __init__(self, patterns, storage=None):
+        self._patterns = [patterns] if isinstance(patterns, str) else list(patterns)
+        self._storage = storage
+        self._matched = {}
+        self._local = threading.local()
+        self._tracing_lock = threading.Lock()
+        self._tracing = 0
+        self._owns_tracing = False
+
+    @property
+    def patterns(self):
+        return list(self._patterns)
+
+    def matches(self, function):
+        name = function.name
+        if name not in self._matched:
+            self._matched[name] = not function.is_generator and any(fnmatchcase(name, p) for p in self._patterns)
+        return self._matched[name]
+
+    @contextmanager
+    def profiling(self, execution):
+        """
+        Context computing the given execution under the profilers.
+        """
+        if getattr(self._local, 'active', False):
+            yield
+            return
+        self._local.active = True
+        self._start_tracing()
+        baseline = tracemalloc.get_traced_memory()[0]
+        profile = cProfile.Profile()
+        started = time()
+        try:
+            profile.enable()
+        except ValueError:
+            # another profiler is active (e.g., in another thread or outside
+            # spiderpig), only one is allowed since Python 3.12
+            profile = None
+        if profile is None:
+            self._stop_tracing()
+            self._local.active = False
+            yield
+            return
+        try:
+            yield
+        finally:
+            profile.disable()
+            elapsed = time() - started
+            # the peak is shared by the executions profiled at the same time
+            peak = tracemalloc.get_traced_memory()[1]
+            snapshot = tracemalloc.take_snapshot().filter_traces([
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, __file__),
+            ])
+            self._stop_tracing()
+            self._local.active = False
+            if self._storage is not None:
+                self._storage.write_execution_profile(execution, pstats.Stats(profile).stats, {
+                    'execution': str(execution),
+                    'execution_name': execution.name,
+                    'started': started,
+                    'time': elapsed,
+                    'peak_memory': max(0, peak - baseline),
+                    # the memory still allocated when the execution ends,
+                    # e.g., its result
+                    'retained_allocations': [
+                        (str(stat.traceback[0]), stat.size, stat.count)
+                        for stat in snapshot.statistics('lineno')[:TOP_ALLOCATIONS]
+                    ],
+                })
+
+    def _start_tracing(self):
+        with self._tracing_lock:
+            if self._tracing == 0:
+                # the memory can be traced by someone else already
+                self._owns_tracing = not tracemalloc.is_tracing()
+                if self._owns_tracing:
+                    tracemalloc.start(TRACEMALLOC_FRAMES)
+                tracemalloc.reset_peak()
+            self._tracing += 1
+
+    def _stop_tracing(self):
+        with self._tracing_lock:
+            self._tracing -= 1
+            if self._tracing == 0 and self._owns_tracing:
+                tracemalloc.stop()
+
+
+def hot_spots(stats, sort='cumulative', top=20):
+    """
+    The most expensive functions in the given profile statistics (the
+    dictionary of pstats.Stats).
+
+    Returns
+    -------
+    list of (function, calls, total time, cumulative time) tuples, where
+    function is 'file:line(name)'
+    """
+    key = {'cumulative': 3, 'tottime': 2, 'calls': 1}[sort]
+    rows = [
+        (pstats.func_std_string(function), primitive_calls, total_time, cumulative_time)
+        for function, (primitive_calls, calls, total_time, cumulative_time, callers) in stats.items()
+    ]
+    return sorted(rows, key=lambda row: -row[key])[:top]
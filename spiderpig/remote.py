@@ -0,0 +1,294 @@
+from .cache import CacheProvider
+from .execution import Execution
+from .msg import Verbosity, print_warn
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import urlparse
+import http.client
+import json
+import os
+import pickle
+import queue
+import re
+import tempfile
+
+
+_NAME_PATTERN = re.compile(r'^[\w.\-]+$')
+# errors of the unavailable remote cache (connection errors and timeouts are
+# OSErrors), the remote cache is then skipped
+_REMOTE_ERRORS = (OSError, http.client.HTTPException)
+
+
+class RemoteCacheClient:
+
+    """
+    Client of the content-addressed HTTP cache server (see CacheServer).
+    Entries are addressed by execution names, connections are kept alive
+    and reused.
+    """
+
+    def __init__(self, url, pool_size=4, timeout=30):
+        parsed = urlparse(url)
+        if parsed.scheme not in ['http', 'https']:
+            raise ValueError('Only HTTP(S) remote cache is supported, given: {}'.format(url))
+        self._connection_class = http.client.HTTPSConnection if parsed.scheme == 'https' else http.client.HTTPConnection
+        self._netloc = parsed.netloc
+        self._path = parsed.path.rstrip('/')
+        self._timeout = timeout
+        self._pool = queue.LifoQueue(maxsize=pool_size)
+
+    def exists(self, names):
+        status, body = self._request('POST', '/_exists', json.dumps(list(names)).encode())
+        if status != 200:
+            raise IOError('Remote cache responded with status {}.'.format(status))
+        return json.loads(body.decode())
+
+    def get(self, name):
+        status, body = self._request('GET', '/' + name)
+        if status == 404:
+            return None
+        if status != 200:
+            raise IOError('Remote cache responded with status {}.'.format(status))
+        return body
+
+    def put(self, name, data):
+        status, _ = self._request('PUT', '/' + name, data)
+        if status not in [200, 201, 204]:
+            raise IOError('Remote cache responded with status {}.'.format(status))
+
+    def delete(self, name):
+        """
+        Delete the entries of the given execution (stored with any code
+        fingerprint), or of all executions of the given function.
+        """
+        status, _ = self._request('DELETE', '/' + name)
+        if status not in [200, 204]:
+            raise IOError('Remote cache responded with status {}.'.format(status))
+
+    def size(self):
+        status, body = self._request('GET', '/')
+        if status != 200:
+            raise IOError('Remote cache responded with status {}.'.format(status))
+        return json.loads(body.decode())['entries']
+
+    def close(self):
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                return
+
+    def _request(self, method, path, body=None):
+        try:
+            connection = self._pool.get_nowait()
+        except queue.Empty:
+            connection = self._connection_class(self._netloc, timeout=self._timeout)
+        try:
+            try:
+                response = self._send(connection, method, path, body)
+            except (http.client.HTTPException, ConnectionError):
+                # the server closed the kept-alive connection, try a fresh one
+                connection.close()
+                connection = self._connection_class(self._netloc, timeout=self._timeout)
+                response = self._send(connection, method, path, body)
+        except Exception:
+            connection.close()
+            raise
+        try:
+            self._pool.put_nowait(connection)
+        except queue.Full:
+            connection.close()
+        return response
+
+    def _send(self, connection, method, path, body):
+        headers = {} if body is None else {'Content-Length': str(len(body))}
+        connection.request(method, self._path + path, body=body, headers=headers)
+        response = connection.getresponse()
+        return response.status, response.read()
+
+
+class RemoteCacheProvider(CacheProvider):
+
+    """
+    Cache provider storing results in a shared remote cache. It is supposed to
+    be used as the last tier of the cache, e.g., under StorageCacheProvider,
+    so the remote cache is asked only when the result is not available
+    locally. The entries are addressed by the execution names together with
+    the code fingerprints of their functions.
+    """
+
+    def __init__(self, client, verbosity=Verbosity.INFO, locker=None, provider=None):
+        CacheProvider.__init__(self, locker, verbosity, provider)
+        self._client = client
+
+    def prepare(self):
+        if self._provider is not None:
+            return self._provider.prepare()
+
+    def get_or_execute(self, execution, already_exclusive=False):
+        if execution.function.is_generator:
+            # streams are cached only locally
+            if self._provider is None:
+                return True, execution()
+            return self._provider.get_or_execute(execution, already_exclusive)
+        with self.lock(execution, already_exclusive):
+            try:
+                data = self._client.get(_remote_name(execution)) if self.is_valid_cache(execution) else None
+            except _REMOTE_ERRORS as e:
+                print_warn('Can not read execution {} from the remote cache: {}'.format(execution.name, e))
+                data = None
+            if data is not None:
+                loaded = pickle.loads(data)
+                for dependency in loaded['execution']['dependencies']:
+                    execution.add_dependency(Execution.from_serializable(dependency, verbosity=self._verbosity))
+                execution.set_statistics(loaded['execution'].get('time'), loaded['execution'].get('own_time'), len(data), loaded['execution'].get('memory'))
+                execution.set_result(loaded['result'])
+                return False, loaded['result']
+            if self._provider is None:
+                executed = True
+                execution_result = execution()
+            else:
+                executed, execution_result = self._provider.get_or_execute(execution, already_exclusive=True)
+            try:
+                self._client.put(_remote_name(execution), pickle.dumps({
+                    'execution': execution.to_serializable(),
+                    'result': execution_result,
+                }))
+            except _REMOTE_ERRORS as e:
+                print_warn('Can not store execution {} in the remote cache: {}'.format(execution.name, e))
+            return executed, execution_result
+
+    def size(self):
+        return self._client.size()
+
+    def is_valid_cache(self, execution):
+        try:
+            return all(self._client.exists([_remote_name(e) for e in [execution] + list(execution.dependencies)]))
+        except _REMOTE_ERRORS as e:
+            print_warn('Can not check execution {} in the remote cache: {}'.format(execution.name, e))
+            return False
+
+    def invalidate(self, executions=None, function=None):
+        invalidated = CacheProvider.invalidate(self, executions=executions, function=function)
+        names = sorted(invalidated) + ([] if function is None else [function.name])
+        try:
+            for name in names:
+                self._client.delete(name)
+        except _REMOTE_ERRORS as e:
+            print_warn('Can not invalidate executions in the remote cache: {}'.format(e))
+        return invalidated
+
+    def clear(self, recursively=True):
+        # the remote cache is shared by other nodes, so it is never cleared
+        # from the client
+        if recursively and self._provider is not None:
+            self._provider.clear()
+
+
+def _remote_name(execution):
+    # the execution name does not change with the code of the function, the
+    # results computed by another version of the code are not shared
+    code_fingerprint = execution.function.code_fingerprint
+    return execution.name if code_fingerprint is None else '{}.{}'.format(execution.name, code_fingerprint)
+
+
+class CacheServer(ThreadingMixIn, HTTPServer):
+
+    """
+    Reference implementation of the content-addressed HTTP cache server. The
+    entries are stored as files in the given directory.
+
+    Supported requests:
+
+        GET /             number of stored entries
+        GET /<name>       content of the entry
+        HEAD /<name>      existence of the entry
+        PUT /<name>       store the entry
+        DELETE /<name>    delete the entry and the entries prefixed by
+                          '<name>.', i.e., all code versions of an execution
+                          or all executions of a function
+        POST /_exists     JSON list of names -> JSON list of booleans
+    """
+
+    daemon_threads = True
+
+    def __init__(self, directory, host='127.0.0.1', port=0):
+        self.directory = directory
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        HTTPServer.__init__(self, (host, port), _CacheRequestHandler)
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return 'http://{}:{}'.format(host, port)
+
+    def filename(self, name):
+        if not _NAME_PATTERN.match(name) or name.startswith('.'):
+            return None
+        return os.path.join(self.directory, name)
+
+
+class _CacheRequestHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        if self.path == '/':
+            entries = sum(1 for f in os.listdir(self.server.directory) if not f.startswith('.'))
+            return self._respond(200, json.dumps({'entries': entries}).encode())
+        filename = self.server.filename(self.path[1:])
+        if filename is None:
+            return self._respond(400)
+        try:
+            with open(filename, 'rb') as f:
+                return self._respond(200, f.read())
+        except FileNotFoundError:
+            return self._respond(404)
+
+    def do_HEAD(self):
+        filename = self.server.filename(self.path[1:])
+        if filename is None:
+            return self._respond(400)
+        return self._respond(200 if os.path.exists(filename) else 404, head=True)
+
+    def do_PUT(self):
+        filename = self.server.filename(self.path[1:])
+        data = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if filename is None:
+            return self._respond(400)
+        fd, tmp_filename = tempfile.mkstemp(dir=self.server.directory, prefix='.')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_filename, filename)
+        return self._respond(201)
+
+    def do_DELETE(self):
+        filename = self.server.filename(self.path[1:])
+        if filename is None:
+            return self._respond(400)
+        prefix = os.path.basename(filename) + '.'
+        for name in os.listdir(self.server.directory):
+            if name == os.path.basename(filename) or name.startswith(prefix):
+                try:
+                    os.remove(os.path.join(self.server.directory, name))
+                except FileNotFoundError:
+                    pass
+        return self._respond(204)
+
+    def do_POST(self):
+        data = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.path != '/_exists':
+            return self._respond(404)
+        filenames = [self.server.filename(name) for name in json.loads(data.decode())]
+        return self._respond(200, json.dumps([f is not None and os.path.exists(f) for f in filenames]).encode())
+
+    def log_message(self, format, *args):
+        pass
+
+    def _respond(self, status, body=b'', head=False):
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if not head:
+            self.wfile.write(body)
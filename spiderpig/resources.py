@@ -0,0 +1,446 @@
+"""
+Resource-aware admission of executions. Functions can be annotated by the
+resources one execution needs, e.g., @cached(resources={'memory_gb': 8,
+'cpu': 4}). For functions without the annotation, the peak memory learned
+from their stored executions is used. Before such an execution is computed,
+its tokens are taken from the budget of the host, which is shared by all
+processes using the same cache directory (e.g., workers of spiderpig-sweep
+and spiderpig-worker), so memory-hungry executions do not run all at once.
+Waiting executions are admitted by their priority, the estimated time of
+their critical path in the recorded dependency graph (see
+spiderpig.planner). Without the budget given and without annotated
+functions, the executions are neither admitted nor measured.
+"""
+
+from .cache import StorageCacheProvider
+from .exceptions import ValidationError
+from .execution import ExecutionContext, Function
+from .msg import Verbosity, print_debug, print_warn
+from contextlib import contextmanager
+from itertools import count, islice
+from time import sleep, time
+import filelock
+import json
+import os
+import socket
+import threading
+
+
+RESOURCES = ('memory_gb', 'cpu')
+# learned peak memory below this limit does not need admission
+MIN_LEARNED_MEMORY_GB = 0.5
+# number of stored executions the peak memory of a function is learned from
+SAMPLE_SIZE = 100
+POLL_INTERVAL = 0.1
+# executions waiting longer are admitted anyway, since the tokens can be
+# held by an execution waiting for the lock of the waiting one
+ADMISSION_TIMEOUT = 300
+SAMPLING_INTERVAL = 0.05
+
+_GB = 1024 ** 3
+
+
+def validate_resources(resources):
+    """
+    Check the resources of the annotation or of the budget.
+
+        >>> validate_resources({'memory_gb': 8, 'cpu': 4})
+        >>> validate_resources({'gpu': 1})
+        Traceback (most recent call last):
+        ...
+        spiderpig.exceptions.ValidationError: The resource "gpu" is not supported, use one of memory_gb, cpu.
+    """
+    for name, amount in resources.items():
+        if name not in RESOURCES:
+            raise ValidationError('The resource "{}" is not supported, use one of {}.'.format(name, ', '.join(RESOURCES)))
+        if not isinstance(amount, (int, float)) or amount < 0:
+            raise ValidationError('The amount of the resource "{}" has to be a non-negative number, given: {}'.format(name, amount))
+
+
+def is_annotated():
+    """
+    True if some function has been annotated by the resources it needs.
+    """
+    return any(options.get('resources') is not None for options in list(Function._options.values()))
+
+
+def host_capacity():
+    """
+    Resources of this host: the physical memory and the number of CPUs.
+    """
+    capacity = {'cpu': os.cpu_count() or 1}
+    try:
+        capacity['memory_gb'] = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') / _GB
+    except (AttributeError, ValueError, OSError):
+        # the memory is not limited when it can not be found out
+        pass
+    return capacity
+
+
+class ResourceBudget:
+
+    """
+    Tokens of the resources of one host. When the directory is given, the
+    state of the budget is kept in the file named by the host in the
+    directory, so it is shared by the processes on the host; the tokens of
+    processes which have died are returned.
+    """
+
+    def __init__(self, directory=None, capacity=None):
+        if capacity is not None:
+            validate_resources(capacity)
+        self._capacity = dict(host_capacity(), **({} if capacity is None else capacity))
+        self._directory = directory
+        self._filename = None
+        self._file_lock = None
+        if directory is not None:
+            self._filename = os.path.join(directory, '{}.json'.format(socket.gethostname()))
+            self._file_lock = filelock.FileLock(self._filename + '.lock')
+        self._state = {'holders': {}, 'waiters': {}}
+        self._lock = threading.Lock()
+        self._released = threading.Condition()
+        self._tokens = count()
+
+    @property
+    def capacity(self):
+        return dict(self._capacity)
+
+    def in_use(self):
+        """
+        Resources held by the running executions.
+        """
+        with self._transaction() as state:
+            return _sum_demands(state['holders'].values())
+
+    def acquire(self, demand, priority=0, wait=True, timeout=ADMISSION_TIMEOUT):
+        """
+        Take the tokens of the given resources. An execution is admitted
+        when its demand fits in the remaining budget and no waiting execution
+        with a higher priority fits there as well; an execution demanding
+        more than the whole budget is admitted when nothing else is running.
+
+        Returns
+        -------
+        token to be released, or None if the tokens are not available and
+        wait is False
+        """
+        token = '{}.{}.{}'.format(os.getpid(), threading.get_ident(), next(self._tokens))
+        since = time()
+        try:
+            while True:
+                with self._transaction() as state:
+                    expired = time() - since > timeout
+                    if expired or self._is_admissible(state, token, demand, priority, since):
+                        if expired:
+                            print_warn('The execution demanding {} has been waiting for {}s, it is admitted over the budget.'.format(demand, timeout))
+                        state['waiters'].pop(token, None)
+                        state['holders'][token] = {'pid': os.getpid(), 'demand': demand}
+                        return token
+                    if not wait:
+                        return None
+                    state['waiters'][token] = {'pid': os.getpid(), 'demand': demand, 'priority': priority, 'since': since}
+                with self._released:
+                    self._released.wait(POLL_INTERVAL)
+        except BaseException:
+            with self._transaction() as state:
+                state['waiters'].pop(token, None)
+            raise
+
+    def release(self, token):
+        with self._transaction() as state:
+            state['holders'].pop(token, None)
+        with self._released:
+            self._released.notify_all()
+
+    @contextmanager
+    def admitted(self, demand, priority=0):
+        """
+        Context holding the tokens of the given resources.
+        """
+        token = self.acquire(demand, priority)
+        try:
+            yield
+        finally:
+            self.release(token)
+
+    def _is_admissible(self, state, token, demand, priority, since):
+        for entries in [state['holders'], state['waiters']]:
+            for other in [t for t, entry in entries.items() if not _is_alive(entry['pid'])]:
+                del entries[other]
+        if len(state['holders']) == 0:
+            return True
+        used = _sum_demands(state['holders'].values())
+        if not self._fits(used, demand):
+            return False
+        # the waiting executions with a higher priority fitting in the budget
+        # go first
+        return not any(
+            (waiter['priority'], -waiter['since']) > (priority, -since) and self._fits(used, waiter['demand'])
+            for other, waiter in state['waiters'].items() if other != token
+        )
+
+    def _fits(self, used, demand):
+        return all(used.get(name, 0) + amount <= self._capacity.get(name, float('inf')) for name, amount in demand.items())
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            if self._filename is None:
+                yield self._state
+                return
+            if self._directory is not None:
+                # the directory is created only when the budget is used
+                os.makedirs(self._directory, exist_ok=True)
+                self._directory = None
+            with self._file_lock:
+                try:
+                    with open(self._filename, 'r') as f:
+                        state = json.load(f)
+                except (FileNotFoundError, ValueError):
+                    state = {'holders': {}, 'waiters': {}}
+                yield state
+                # readers hold the lock as well, so the state is overwritten
+                # in place
+                with open(self._filename, 'w') as f:
+                    json.dump(state, f)
+
+
+class MemoryMonitor:
+
+    """
+    Measures the peak growth of the resident memory of the process while
+    executions are running; the memory is sampled in a background thread.
+    Concurrent executions in one process are all charged the growth of the
+    whole process, so the estimates err on the safe side. The memory is
+    read from /proc, it is not measured where it is not available.
+    """
+
+    def __init__(self, interval=SAMPLING_INTERVAL):
+        self._interval = interval
+        self._page_size = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+        self._reset()
+
+    def start(self):
+        """
+        Start measuring an execution.
+
+        Returns
+        -------
+        key to stop the measurement, None if the memory is not measured
+        """
+        rss = self._rss()
+        if rss is None:
+            return None
+        with self._condition:
+            key = next(self._keys)
+            self._running[key] = [rss, rss]
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._sample, name='spiderpig-memory', daemon=True)
+                self._thread.start()
+            self._condition.notify()
+        return key
+
+    def stop(self, key):
+        """
+        Stop measuring an execution.
+
+        Returns
+        -------
+        peak growth of the resident memory in bytes, or None
+        """
+        if key is None:
+            return None
+        rss = self._rss()
+        with self._condition:
+            start, peak = self._running.pop(key)
+        return max(peak, start if rss is None else rss) - start
+
+    def _sample(self):
+        while True:
+            with self._condition:
+                while len(self._running) == 0:
+                    self._condition.wait()
+            rss = self._rss()
+            if rss is not None:
+                with self._condition:
+                    for measured in self._running.values():
+                        measured[1] = max(measured[1], rss)
+            sleep(self._interval)
+
+    def _rss(self):
+        if self._fd is None:
+            return None
+        try:
+            return int(os.pread(self._fd, 128, 0).split()[1]) * self._page_size
+        except (OSError, ValueError, IndexError):
+            return None
+
+    def _reset(self):
+        # the forked process has neither the sampling thread nor its own
+        # descriptor of /proc/self
+        if getattr(self, '_fd', None) is not None:
+            os.close(self._fd)
+        try:
+            self._fd = os.open('/proc/self/statm', os.O_RDONLY)
+        except OSError:
+            self._fd = None
+        self._running = {}
+        self._keys = count()
+        self._condition = threading.Condition()
+        self._thread = None
+
+
+_MONITOR = MemoryMonitor()
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_MONITOR._reset)
+
+
+class ResourceScheduler:
+
+    """
+    Admits the executions needing resources against the budget and records
+    the peak memory of computed executions, so it is known for functions
+    which are not annotated. Executions nested in an admitted execution are
+    covered by its tokens.
+    """
+
+    def __init__(self, budget, cache_provider=None, verbosity=Verbosity.INFO):
+        self._budget = budget
+        self._cache_provider = cache_provider
+        self._storages = []
+        while cache_provider is not None:
+            if isinstance(cache_provider, StorageCacheProvider):
+                self._storages.append(cache_provider.storage)
+            cache_provider = cache_provider.provider
+        self._verbosity = verbosity
+        self._demands = {}
+        self._local = threading.local()
+
+    @property
+    def budget(self):
+        return self._budget
+
+    def demand(self, function):
+        """
+        Resources needed by one execution of the given function, or None if
+        it does not need admission.
+        """
+        resources = function.options.get('resources')
+        if resources is not None:
+            return dict(resources)
+        name = function.name
+        if name not in self._demands:
+            # learned once per function, then updated by the executions
+            # measured in this process
+            memory = max(
+                (e.memory for storage in self._storages for e in islice(storage.read_executions(function), SAMPLE_SIZE) if e.memory is not None),
+                default=None
+            )
+            self._demands[name] = None if memory is None or memory < MIN_LEARNED_MEMORY_GB * _GB else {'memory_gb': memory / _GB}
+        return self._demands[name]
+
+    def critical_path_time(self, context, function, kwargs, planner=None):
+        """
+        Estimated time of the critical path of the execution, i.e., of the
+        longest chain of dependencies to compute.
+        """
+        # the planner is needed only by parallel executions
+        from .planner import Planner
+        planner = Planner(context, self._cache_provider) if planner is None else planner
+        return planner.plan(function, **kwargs).critical_path[1]
+
+    def prioritize(self, context, function, kwargs_list, workers):
+        """
+        Priorities (critical path times) of the executions of the function
+        with the given key-word arguments, or None if the order does not
+        matter, i.e., when all executions start at once and they do not need
+        admission.
+        """
+        if len(kwargs_list) <= workers and self.demand(function) is None:
+            return None
+        from .planner import Planner
+        planner = Planner(context, self._cache_provider)
+        return [self.critical_path_time(context, function, kwargs, planner) for kwargs in kwargs_list]
+
+    def is_holding(self):
+        """
+        True if the current thread runs within an admitted execution.
+        """
+        return getattr(self._local, 'holding', False)
+
+    @contextmanager
+    def prioritized(self, priority, holding=False):
+        """
+        Context of a thread executing on behalf of another one (e.g., in
+        ExecutionContext.execute_many), given the priority of its executions
+        and whether the other thread holds tokens.
+        """
+        previous = getattr(self._local, 'priority', None), self.is_holding()
+        self._local.priority, self._local.holding = priority, holding
+        try:
+            yield
+        finally:
+            self._local.priority, self._local.holding = previous
+
+    @contextmanager
+    def running(self, execution):
+        """
+        Context computing the given execution: it waits for admission if the
+        execution needs resources and measures its peak memory.
+        """
+        token = None
+        if not self.is_holding():
+            demand = self.demand(execution.function)
+            if demand is not None:
+                token = self._admit(execution, demand)
+        monitored = _MONITOR.start()
+        try:
+            yield
+        finally:
+            memory = _MONITOR.stop(monitored)
+            execution.set_statistics(memory=memory)
+            self._learn(execution.function, memory)
+            if token is not None:
+                self._local.holding = False
+                self._budget.release(token)
+
+    def _learn(self, function, memory):
+        name = function.name
+        if memory is None or name not in self._demands or function.options.get('resources') is not None:
+            return
+        learned = self._demands[name]
+        if memory >= MIN_LEARNED_MEMORY_GB * _GB and (learned is None or memory / _GB > learned['memory_gb']):
+            self._demands[name] = {'memory_gb': memory / _GB}
+
+    def _admit(self, execution, demand):
+        token = self._budget.acquire(demand, wait=False)
+        if token is None:
+            priority = getattr(self._local, 'priority', None)
+            if priority is None:
+                context = ExecutionContext(configuration=execution.configuration, cache_provider=self._cache_provider)
+                priority = self.critical_path_time(context, execution.function, execution.kwargs)
+            if self._verbosity > Verbosity.DEBUG:
+                print_debug('execution {} is waiting for {}'.format(execution.name, demand))
+            token = self._budget.acquire(demand, priority)
+        self._local.holding = True
+        return token
+
+
+def _sum_demands(demands):
+    used = {}
+    for entry in demands:
+        for name, amount in entry['demand'].items():
+            used[name] = used.get(name, 0) + amount
+    return used
+
+
+def _is_alive(pid):
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+        return True
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
@@ -0,0 +1,322 @@
+"""
+Cache tier shared by processes on one host through shared memory. Each
+result is kept in its own segment, serialized by pickle protocol 5 with the
+out-of-band buffers (e.g., NumPy arrays) placed right in the segment, so the
+processes map one copy of the data instead of loading their own. The small
+index segment lists the entries of the cache; it is guarded by a file lock,
+so no daemon is needed to allocate memory or to coordinate eviction.
+"""
+
+from .cache import CacheProvider, retention_value
+from .fingerprint import fingerprint
+from .msg import Verbosity
+from multiprocessing import shared_memory
+import filelock
+import mmap
+import os
+import pickle
+import struct
+import sys
+import tempfile
+import uuid
+
+
+INDEX_SIZE = 1 << 20
+# results with smaller serialized size are not shared
+MIN_SIZE = 64 * 1024
+
+_MAGIC = b'SPG1'
+_ALIGNMENT = 64
+
+
+class SharedMemoryCacheProvider(CacheProvider):
+
+    """
+    Cache provider keeping buffer-backed results (arrays, bytes) in shared
+    memory. It is supposed to be placed between InMemoryCacheProvider and
+    StorageCacheProvider. Processes using the same namespace (e.g., the cache
+    directory) share the entries. The entries which save the least compute
+    time per byte are evicted first (GreedyDual-Size), regardless of the
+    process which created them.
+
+    Shared arrays are read-only. Bytes are copied to the process when they
+    are read.
+    """
+
+    def __init__(self, namespace, verbosity=Verbosity.INFO, locker=None, provider=None, max_bytes=1 << 30, max_entries=1000, min_size=MIN_SIZE):
+        CacheProvider.__init__(self, locker, verbosity, provider)
+        self._namespace = namespace
+        self._prefix = 'sp{}'.format(fingerprint(namespace)[:8])
+        self._max_bytes = max_bytes
+        self._max_entries = max_entries
+        self._min_size = min_size
+        self._index_lock = filelock.FileLock(os.path.join(tempfile.gettempdir(), '{}.shm.lock'.format(self._prefix)))
+        self._index_segment = None
+        self._mapped = {}
+
+    def prepare(self):
+        if self._provider is not None:
+            return self._provider.prepare()
+
+    def get_or_execute(self, execution, already_exclusive=False):
+        if execution.function.is_generator:
+            return self._provider.get_or_execute(execution, already_exclusive) if self._provider is not None else (True, execution())
+        with self.lock(execution, already_exclusive):
+            if self._is_valid_below(execution):
+                found, result = self._get(execution.name)
+                if found:
+                    execution.set_result(result)
+                    return False, result
+            if self._provider is None:
+                executed = True
+                execution_result = execution()
+            else:
+                executed, execution_result = self._provider.get_or_execute(execution, already_exclusive=True)
+            self._put(execution, execution_result)
+            return executed, execution_result
+
+    def size(self):
+        with self._index_lock:
+            return len(self._read_index()['entries'])
+
+    def is_valid_cache(self, execution):
+        with self._index_lock:
+            if execution.name not in self._read_index()['entries']:
+                return False
+        return self._is_valid_below(execution)
+
+    def invalidate(self, executions=None, function=None):
+        invalidated = CacheProvider.invalidate(self, executions=executions, function=function)
+        prefix = None if function is None else function.name + '.'
+        with self._index_lock:
+            index = self._read_index()
+            for execution_name in list(index['entries']):
+                if execution_name in invalidated or (prefix is not None and execution_name.startswith(prefix)):
+                    self._remove(index, execution_name)
+            self._write_index(index)
+        return invalidated
+
+    def clear(self, recursively=True):
+        with self._index_lock:
+            index = self._read_index()
+            for execution_name in list(index['entries']):
+                self._remove(index, execution_name)
+            index['inflation'] = 0
+            self._write_index(index)
+            self._release(index)
+        if recursively and self._provider is not None:
+            self._provider.clear()
+
+    def unlink(self):
+        """
+        Remove all the shared memory of the cache from the host (including
+        the index), e.g., when the cache directory is deleted.
+        """
+        self.clear(recursively=False)
+        with self._index_lock:
+            if self._index_segment is not None:
+                self._index_segment.close()
+                self._index_segment = None
+            _unlink_segment('{}index'.format(self._prefix))
+
+    def _is_valid_below(self, execution):
+        # the shared entries can be invalidated by other processes through
+        # the tiers below (e.g., the storage or the remote cache), so they
+        # decide whether the entries are still valid
+        if self._provider is None:
+            return True
+        return self._provider.is_valid_cache(execution)
+
+    def _get(self, execution_name):
+        with self._index_lock:
+            index = self._read_index()
+            entry = index['entries'].get(execution_name)
+            if entry is None:
+                return False, None
+            entry['priority'] = index['inflation'] + entry['value']
+            self._write_index(index)
+        mapped = self._mapped.get(entry['segment'])
+        if mapped is None:
+            try:
+                mapped = _map_segment(entry['segment'])
+            except FileNotFoundError:
+                # evicted in the meantime
+                return False, None
+            self._mapped[entry['segment']] = mapped
+        return True, _deserialize(memoryview(mapped))
+
+    def _put(self, execution, execution_result):
+        serialized = _serialize(execution_result)
+        if serialized is None:
+            return
+        header, data, buffers = serialized
+        size = _serialized_size(header, data, buffers)
+        if size < self._min_size or size > self._max_bytes:
+            return
+        execution_name = execution.name
+        # every version of the entry gets its own segment, so the processes
+        # never see the segment they have mapped rewritten
+        segment_name = '{}{}{}'.format(self._prefix, fingerprint(execution_name)[:10], uuid.uuid4().hex[:10])
+        with self._index_lock:
+            index = self._read_index()
+            self._release(index)
+            if execution_name in index['entries']:
+                # the result has been recomputed, the entry is outdated
+                self._remove(index, execution_name)
+            while len(index['entries']) > 0 and (len(index['entries']) >= self._max_entries or index['bytes'] + size > self._max_bytes):
+                self._evict(index)
+            segment = _open_segment(segment_name, size=size)
+            _write(segment.buf, header, data, buffers)
+            segment.close()
+            value = retention_value(execution.time, size)
+            index['entries'][execution_name] = {
+                'segment': segment_name,
+                'size': size,
+                'value': value,
+                'priority': index['inflation'] + value,
+            }
+            index['bytes'] += size
+            self._write_index(index)
+
+    def _release(self, index):
+        # the segments which are no longer in the cache are unmapped as soon
+        # as their results are not referenced
+        segments = {e['segment'] for e in index['entries'].values()}
+        for segment_name in [s for s in self._mapped if s not in segments]:
+            del self._mapped[segment_name]
+
+    def _evict(self, index):
+        execution_name = min(index['entries'], key=lambda n: index['entries'][n]['priority'])
+        index['inflation'] = index['entries'][execution_name]['priority']
+        self._remove(index, execution_name)
+
+    def _remove(self, index, execution_name):
+        entry = index['entries'].pop(execution_name)
+        index['bytes'] -= entry['size']
+        # processes which have mapped the segment can still use it
+        _unlink_segment(entry['segment'])
+
+    def _read_index(self):
+        buf = self._get_index_segment().buf
+        length, = struct.unpack_from('<Q', buf, 0)
+        if length == 0:
+            return {'inflation': 0, 'bytes': 0, 'entries': {}}
+        return pickle.loads(buf[8:8 + length])
+
+    def _write_index(self, index):
+        data = pickle.dumps(index, protocol=pickle.HIGHEST_PROTOCOL)
+        buf = self._get_index_segment().buf
+        if len(data) + 8 > len(buf):
+            raise ValueError('The index of the shared memory cache is full, decrease the maximal number of entries.')
+        buf[8:8 + len(data)] = data
+        struct.pack_into('<Q', buf, 0, len(data))
+
+    def _get_index_segment(self):
+        if self._index_segment is None:
+            name = '{}index'.format(self._prefix)
+            try:
+                self._index_segment = _open_segment(name, size=INDEX_SIZE)
+            except FileExistsError:
+                self._index_segment = _open_segment(name)
+        return self._index_segment
+
+
+def _serialize(value):
+    """
+    Serialize the buffer-backed value, i.e., the value whose pickle has
+    out-of-band buffers, or bytes.
+
+    Returns
+    -------
+    (header, pickle data, list of buffers), or None if the value is not
+    buffer-backed
+    """
+    if not isinstance(value, (bytes, bytearray)):
+        buffers = []
+        try:
+            data = pickle.dumps(value, protocol=5, buffer_callback=buffers.append)
+            buffers = [b.raw() for b in buffers]
+        except (pickle.PicklingError, BufferError, TypeError, AttributeError):
+            return None
+        if len(buffers) == 0:
+            return None
+    else:
+        data, buffers = pickle.dumps(value, protocol=5), []
+    lengths = [len(data)] + [b.nbytes for b in buffers]
+    header = _MAGIC + struct.pack('<I{}Q'.format(len(lengths)), len(buffers), *lengths)
+    return header, data, buffers
+
+
+def _serialized_size(header, data, buffers):
+    size = _align(len(header)) + _align(len(data))
+    for buffer in buffers:
+        size += _align(buffer.nbytes)
+    return size
+
+
+def _write(buf, header, data, buffers):
+    position = 0
+    for chunk in [header, data] + buffers:
+        length = chunk.nbytes if isinstance(chunk, memoryview) else len(chunk)
+        buf[position:position + length] = chunk
+        position += _align(length)
+
+
+def _deserialize(buf):
+    if bytes(buf[:4]) != _MAGIC:
+        raise ValueError('The shared memory segment does not contain a cached result.')
+    buffers_count, = struct.unpack_from('<I', buf, 4)
+    lengths = struct.unpack_from('<{}Q'.format(buffers_count + 1), buf, 8)
+    position = _align(8 + 8 * len(lengths))
+    data = buf[position:position + lengths[0]]
+    position += _align(lengths[0])
+    buffers = []
+    for length in lengths[1:]:
+        buffers.append(buf[position:position + length])
+        position += _align(length)
+    return pickle.loads(data, buffers=buffers)
+
+
+def _align(length):
+    return (length + _ALIGNMENT - 1) // _ALIGNMENT * _ALIGNMENT
+
+
+def _open_segment(name, size=None):
+    """
+    Create (if the size is given) or attach the shared memory segment. The
+    segments are not tracked, they have to outlive the process which created
+    them.
+    """
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, create=size is not None, size=size or 0, track=False)
+    from multiprocessing import resource_tracker
+    segment = shared_memory.SharedMemory(name=name, create=size is not None, size=size or 0)
+    resource_tracker.unregister(segment._name, 'shared_memory')
+    return segment
+
+
+def _map_segment(name):
+    """
+    Map the segment read-only. Unlike SharedMemory, the mapping is released
+    only when the results using it are not referenced anymore.
+    """
+    from multiprocessing.shared_memory import _posixshmem
+    fd = _posixshmem.shm_open('/' + name, os.O_RDONLY, mode=0o600)
+    try:
+        return mmap.mmap(fd, os.fstat(fd).st_size, prot=mmap.PROT_READ)
+    finally:
+        os.close(fd)
+
+
+def _unlink_segment(name):
+    try:
+        segment = _open_segment(name)
+    except FileNotFoundError:
+        return
+    segment.close()
+    if sys.version_info >= (3, 13):
+        segment.unlink()
+    else:
+        # unlink() would unregister the segment from the resource tracker
+        from multiprocessing.shared_memory import _posixshmem
+        _posixshmem.shm_unlink(segment._name)
@@ -2,8 +2,10 @@ from multiprocessing.pool import ThreadPool
 from pytest import raises
 from spiderpig.msg import Verbosity
 from time import sleep
+import datetime
 import os
 import spiderpig
+import sys
 import tempfile
 
 
@@ -14,20 +16,33 @@ def test_configured():
             assert fun() == (2, 5)
         assert fun() == (1, 3)
         assert fun(a=2) == (2, 4)
-    with spiderpig.spiderpig(verbosity=Verbosity.INTERNAL):
-        try:
-            os.environ['A'] = '10'
+    try:
+        os.environ['A'] = '10'
+        with spiderpig.spiderpig(verbosity=Verbosity.INTERNAL):
             assert fun() == (10, 12)
             os.environ['B'] = '3'
+            # the environment is snapshotted when spiderpig is initialized
+            assert fun() == (10, 12)
+        with spiderpig.spiderpig(verbosity=Verbosity.INTERNAL):
             assert fun() == (10, 13)
             assert fun(a=1) == (1, 4)
             with spiderpig.configuration(a=2):
                 assert fun() == (2, 5)
-        finally:
-            if 'A' in os.environ:
-                del os.environ['A']
-            if 'B' in os.environ:
-                del os.environ['B']
+    finally:
+        if 'A' in os.environ:
+            del os.environ['A']
+        if 'B' in os.environ:
+            del os.environ['B']
+
+
+def test_configured_with_config():
+    with spiderpig.spiderpig(a=1, b=1):
+        assert configured_fun() == (5, 1)
+        assert configured_fun() == (5, 1)
+        assert fun_a() == 1
+        with spiderpig.configuration(b=10):
+            assert configured_fun() == (5, 10)
+        assert configured_recursion(3) == [5, 5, 5]
 
 
 def test_cached():
@@ -84,6 +99,174 @@ def test_in_memory_entries():
         assert spiderpig.cache_provider().size() <= 10
 
 
+def test_cache_tiers():
+    cache_dir = tempfile.mkdtemp()
+    shared_dir = tempfile.mkdtemp()
+    with spiderpig.spiderpig(cache_dir, cache_tiers=['{},max_entries=100'.format(shared_dir)]):
+        assert cached_fun_a(a=1) == 1
+    with spiderpig.spiderpig(tempfile.mkdtemp(), cache_tiers=[{'directory': shared_dir, 'write_policy': 'never'}]):
+        assert cached_fun_a(a=1) == 1
+        assert spiderpig.execution_context().count_executions(cached_fun_a, a=1) == 0
+
+
+def test_invalidate():
+    cache_dir = tempfile.mkdtemp()
+    with spiderpig.spiderpig(cache_dir, a=1):
+        assert cached_fun() == (1, 3, 10)
+    with spiderpig.spiderpig(cache_dir, a=1):
+        invalidated = spiderpig.invalidate(cached_fun_a)
+        assert len(invalidated) == 3
+        assert cached_fun() == (1, 3, 10)
+        assert spiderpig.execution_context().count_executions(cached_fun) == 1
+        assert spiderpig.execution_context().count_executions(cached_fun_a, a=1) == 1
+        assert spiderpig.execution_context().count_executions(cached_fun_b) == 1
+        assert spiderpig.execution_context().count_executions(cached_fun_c) == 0
+        assert len(spiderpig.invalidate_function(cached_fun_c)) == 2
+        assert cached_fun() == (1, 3, 10)
+        assert spiderpig.execution_context().count_executions(cached_fun) == 2
+        assert spiderpig.execution_context().count_executions(cached_fun_c) == 1
+        assert spiderpig.invalidate(cached_fun_a, 2) == set()
+
+
+def test_index_migration():
+    cache_dir = tempfile.mkdtemp()
+    spiderpig.cache.FileStorage(cache_dir).write_info(dependents_index=False)
+    with spiderpig.spiderpig(cache_dir, a=1):
+        assert cached_fun_b() == 3
+        assert not spiderpig.storage().indexed
+    with spiderpig.spiderpig(cache_dir, override_cache=True, a=1):
+        assert cached_fun_a() == 1
+        spiderpig.storage().migrate()
+        assert spiderpig.storage().indexed
+    with spiderpig.spiderpig(cache_dir, a=1):
+        assert cached_fun_b() == 3
+        assert spiderpig.execution_context().count_executions(cached_fun_a, a=1) == 0
+        assert spiderpig.execution_context().count_executions(cached_fun_b) == 1
+
+
+def test_code_change():
+    cache_dir = tempfile.mkdtemp()
+    with spiderpig.spiderpig(cache_dir, a=1):
+        assert cached_fun() == (1, 3, 10)
+    function = spiderpig.execution.Function(cached_fun_c)
+    code_fingerprint = function.code_fingerprint
+    spiderpig.execution.Function._code_fingerprints[function.name] = 'changed'
+    try:
+        with spiderpig.spiderpig(cache_dir, a=1):
+            assert cached_fun() == (1, 3, 10)
+            assert spiderpig.execution_context().count_executions(cached_fun) == 1
+            assert spiderpig.execution_context().count_executions(cached_fun_a, a=1) == 0
+            assert spiderpig.execution_context().count_executions(cached_fun_b) == 0
+            assert spiderpig.execution_context().count_executions(cached_fun_c) == 1
+        with spiderpig.spiderpig(cache_dir, a=1):
+            assert cached_fun() == (1, 3, 10)
+            assert spiderpig.execution_context().count_executions(cached_fun_c) == 0
+    finally:
+        spiderpig.execution.Function._code_fingerprints[function.name] = code_fingerprint
+
+
+def test_override_functions():
+    cache_dir = tempfile.mkdtemp()
+    with spiderpig.spiderpig(cache_dir, a=1):
+        assert cached_fun() == (1, 3, 10)
+    with spiderpig.spiderpig(cache_dir, a=1, override_functions=['{}.cached_fun_b'.format(__name__)]):
+        assert cached_fun() == (1, 3, 10)
+        assert spiderpig.execution_context().count_executions(cached_fun) == 1
+        assert spiderpig.execution_context().count_executions(cached_fun_a, a=1) == 0
+        assert spiderpig.execution_context().count_executions(cached_fun_b) == 1
+        assert spiderpig.execution_context().count_executions(cached_fun_c) == 0
+
+
+def test_plan():
+    cache_dir = tempfile.mkdtemp()
+    with spiderpig.spiderpig(cache_dir, a=1):
+        assert spiderpig.plan(cached_fun).root.status == 'missing'
+        assert cached_fun() == (1, 3, 10)
+    with spiderpig.spiderpig(cache_dir, a=1):
+        plan = spiderpig.plan(cached_fun)
+        assert plan.root.status == 'disk'
+        assert plan.to_compute == []
+        spiderpig.invalidate(cached_fun_c)
+        plan = spiderpig.plan(cached_fun)
+        statuses = {p.execution.function.name.split('.')[-1]: p.status for p in plan.executions}
+        assert statuses == {'cached_fun': 'stale', 'cached_fun_b': 'disk', 'cached_fun_c': 'stale'}
+        assert all(p.estimated_time is not None for p in plan.to_compute)
+        path, path_time = plan.critical_path
+        assert [p.execution.function.name.split('.')[-1] for p in path] == ['cached_fun', 'cached_fun_c']
+        assert path_time == plan.estimated_time
+        plan.print()
+        assert spiderpig.execution_context().count_executions(cached_fun) == 0
+        assert spiderpig.execution_context().count_executions(cached_fun_c) == 0
+    with spiderpig.spiderpig(cache_dir, a=2):
+        plan = spiderpig.plan(cached_fun)
+        assert [p.execution.function.name.split('.')[-1] for p in plan.root.dependencies] == ['cached_fun_b', 'cached_fun_c']
+        statuses = {p.execution.function.name.split('.')[-1]: p.status for p in plan.executions}
+        assert statuses == {'cached_fun': 'missing', 'cached_fun_a': 'missing', 'cached_fun_b': 'missing', 'cached_fun_c': 'stale'}
+        assert all(p.estimated_time is not None for p in plan.to_compute)
+
+
+def test_prewarm():
+    cache_dir = tempfile.mkdtemp()
+    with spiderpig.spiderpig(cache_dir, prewarm=True):
+        for i in range(5):
+            assert cached_fun_a(a=i) == i
+    assert len(spiderpig.cache.FileStorage(cache_dir).read_working_set()) == 5
+    with spiderpig.spiderpig(cache_dir, prewarm=True):
+        spiderpig.cache_provider().prewarm(wait=True)
+        assert spiderpig.cache_provider().size() == 5
+        assert spiderpig.save_working_set() == 5
+
+
+def test_partitioned():
+    with spiderpig.spiderpig(tempfile.mkdtemp(), start='2020-01-01', end='2020-01-04'):
+        context = spiderpig.execution_context()
+        assert days() == 3
+        assert days(end='2020-01-06') == 5
+        assert context.count_executions(days, start='2020-01-03', end='2020-01-04') == 1
+        assert context.count_executions(days, start='2020-01-05', end='2020-01-06') == 1
+        assert days_report() == 3
+        spiderpig.invalidate(days, start='2020-01-02', end='2020-01-03')
+        assert days_report() == 3
+        assert context.count_executions(days_report) == 2
+        assert context.count_executions(days, start='2020-01-02', end='2020-01-03') == 2
+        with raises(spiderpig.ValidationError):
+            spiderpig.cached(partition_by='date')
+    with spiderpig.spiderpig(tempfile.mkdtemp()):
+        context = spiderpig.execution_context()
+        assert days(start=datetime.date(2020, 1, 1), end=datetime.date(2020, 1, 4)) == 3
+        assert days(start=datetime.date(2020, 1, 2), end=datetime.date(2020, 1, 5)) == 3
+        assert context.count_executions(days, start=datetime.date(2020, 1, 2), end=datetime.date(2020, 1, 3)) == 1
+        assert context.count_executions(days, start=datetime.date(2020, 1, 4), end=datetime.date(2020, 1, 5)) == 1
+
+
+def test_sweep():
+    cache_dir = tempfile.mkdtemp()
+    with spiderpig.spiderpig(cache_dir):
+        for i in range(3):
+            cached_fun_a(a=i)
+    argv = sys.argv
+    sys.argv = ['spiderpig', '--spiderpig-dir', cache_dir, 'spiderpig-sweep', '--command', 'spiderpig-gc', '--grid', 'max_entries=1,2', '--workers', '2']
+    try:
+        spiderpig.run_cli()
+    finally:
+        sys.argv = argv
+    assert sum(1 for _ in spiderpig.cache.FileStorage(cache_dir).read_executions()) == 1
+
+
+def test_lazy_commands():
+    import argparse
+    import spiderpig.commands.common as spcommon
+    parser = argparse.ArgumentParser()
+    spiderpig.commands.register_submodule_commands(parser.add_subparsers(), spcommon, namespace='spiderpig', argv=['spiderpig-gc'])
+    args = vars(parser.parse_args(['spiderpig-gc', '--max-entries', '1']))
+    assert isinstance(args['func'], spiderpig.commands.LazyCommand)
+    assert args['max_entries'] == '1'
+    # the parser of the command which has not been selected is completed
+    # when the command is used
+    _, subparser = spiderpig.commands.registered_command('spiderpig-sweep')
+    assert '--command' in subparser._option_string_actions
+
+
 def test_exceptions():
     with spiderpig.spiderpig(verbosity=Verbosity.INTERNAL):
         with raises(RandomError):
@@ -92,6 +275,12 @@ def test_exceptions():
             errored()
 
 
+def test_stream_dependencies():
+    with spiderpig.spiderpig(tempfile.mkdtemp()):
+        assert list(stream_fun(2)) == [(10, 0), (10, 1)]
+        assert [d.name.split('.')[-1] for d in spiderpig.execution.Function(stream_fun).dependencies] == ['cached_fun_c']
+
+
 def test_concurrency():
     cache_dir = tempfile.mkdtemp()
     pool = ThreadPool(4)
@@ -115,6 +304,16 @@ def fun(a=None):
     return fun_a(), fun_b()
 
 
+@spiderpig.configured(a=5)
+def configured_fun(b=None):
+    return fun_a(), b
+
+
+@spiderpig.configured(a=5)
+def configured_recursion(n):
+    return [] if n == 0 else [fun_a()] + configured_recursion(n - 1)
+
+
 @spiderpig.cached()
 def cached_fun_a(a=None):
     return a
@@ -130,11 +329,27 @@ def cached_fun_c(c=10):
     return c
 
 
+@spiderpig.cached()
+def stream_fun(n):
+    for i in range(n):
+        yield cached_fun_c(), i
+
+
 @spiderpig.cached()
 def cached_fun():
     return cached_fun_a(), cached_fun_b(), cached_fun_c()
 
 
+@spiderpig.cached(partition_by='date', combine=sum, partition_workers=2)
+def days(start, end):
+    return 1
+
+
+@spiderpig.cached()
+def days_report():
+    return days()
+
+
 class RandomError(Exception):
     pass
 
@@ -1,7 +1,16 @@
-from spiderpig.cache import InMemoryCacheProvider, FileStorage, StorageCacheProvider
-from spiderpig.execution import ExecutionContext, Locker
+from glob import glob
+from pytest import raises
+from spiderpig.cache import InMemoryCacheProvider, FileStorage, StorageCacheProvider, _WRITERS
+from spiderpig.exceptions import ValidationError
+from spiderpig.config import Configuration
+from spiderpig.execution import Execution, ExecutionContext, Function, Locker
 from spiderpig.msg import Verbosity
 from spiderpig.tests.test_execution import reset_calls, get_calls, fun_a
+from itertools import islice
+from time import sleep, time
+import os
+import shutil
+import sys
 import tempfile
 
 
@@ -25,6 +34,58 @@ def test_in_memory_cache():
         assert provider.size() <= 10
 
 
+def test_in_memory_retention():
+    provider = InMemoryCacheProvider(max_entries=3)
+    context = ExecutionContext(cache_provider=provider)
+    assert context.execute(slow_fun, 1) == 1
+    for i in range(10):
+        assert context.execute(fun_a, i) == i
+    assert context.execute(slow_fun, 1) == 1
+    assert context.count_executions(slow_fun, a=1) == 1
+    assert provider.size() <= 3
+    provider = InMemoryCacheProvider(max_bytes=10000)
+    context = ExecutionContext(cache_provider=provider)
+    for i in range(3):
+        assert context.execute(fun_a, str(i) * 6000) == str(i) * 6000
+        assert provider.size() == 1
+
+
+def test_storage_garbage_collection():
+    storage = FileStorage(tempfile.mkdtemp())
+    context = ExecutionContext(cache_provider=StorageCacheProvider(storage=storage))
+    assert context.execute(slow_fun, 1) == 1
+    for i in range(3):
+        assert context.execute(fun_a, i) == i
+    slow_execution = storage.read_execution(context.create_execution(slow_fun, a=1))
+    assert slow_execution.time >= 0.05
+    assert slow_execution.size > 0
+    assert storage.collect_garbage(max_entries=1) == 3
+    assert [e.function.name for e in storage.read_executions()] == [slow_execution.function.name]
+    assert storage.collect_garbage(max_bytes=0) == 1
+
+
+def test_in_memory_prewarm():
+    storage = FileStorage(tempfile.mkdtemp())
+    context = ExecutionContext(cache_provider=StorageCacheProvider(storage=storage))
+    for i in range(4):
+        assert context.execute(fun_a, i) == i
+    assert context.execute(slow_fun, 1) == 1
+    provider = InMemoryCacheProvider(max_entries=2, provider=StorageCacheProvider(storage=storage))
+    provider.prepare()
+    provider.prewarm(wait=True)
+    assert provider.size() == 2
+    assert provider.working_set()[0] == context.create_execution(slow_fun, a=1).name
+    context = ExecutionContext(cache_provider=provider)
+    assert context.execute(slow_fun, 1) == 1
+    assert context.count_executions(slow_fun, a=1) == 0
+    # the prewarming waiting for foreground requests is stopped on close
+    provider = InMemoryCacheProvider(provider=StorageCacheProvider(storage=storage))
+    provider._foreground_time = time() + 60
+    provider.prewarm()
+    provider.close()
+    assert provider.size() == 0 and provider._prewarm_thread is None
+
+
 def test_storage_cache():
     reset_calls()
     storage = FileStorage(tempfile.mkdtemp())
@@ -69,6 +130,182 @@ def test_storage_integration():
     assert get_calls('a') == [{'a': i} for i in range(2)]
 
 
+def test_storage_write_behind():
+    reset_calls()
+    directory = tempfile.mkdtemp()
+    storage_provider = StorageCacheProvider(storage=FileStorage(directory), write_behind=True, max_pending_writes=2)
+    context = ExecutionContext(cache_provider=storage_provider)
+    for i in range(5):
+        for _ in range(2):
+            assert context.execute(fun_a, i) == i
+    storage_provider.flush()
+    assert get_calls('a') == [{'a': i} for i in range(5)]
+    assert storage_provider.size() == 5
+    # flushed once the process exits
+    assert storage_provider._writer in _WRITERS
+    context = ExecutionContext(cache_provider=StorageCacheProvider(storage=FileStorage(directory)))
+    for i in range(5):
+        assert context.execute(fun_a, i) == i
+    assert get_calls('a') == [{'a': i} for i in range(5)]
+
+
+def test_storage_tiers():
+    reset_calls()
+    slow_provider = StorageCacheProvider(storage=FileStorage(tempfile.mkdtemp()))
+    fast_provider = StorageCacheProvider(storage=FileStorage(tempfile.mkdtemp()), provider=slow_provider, max_entries=4)
+    context = ExecutionContext(cache_provider=fast_provider)
+    fast_provider.prepare()
+    for i in range(10):
+        assert context.execute(fun_a, i) == i
+    assert get_calls('a') == [{'a': i} for i in range(10)]
+    assert fast_provider.size() <= 4
+    assert slow_provider.size() == 10
+    fast_provider.clear(recursively=False)
+    for i in range(2):
+        assert context.execute(fun_a, i) == i
+    assert get_calls('a') == [{'a': i} for i in range(10)]
+    assert fast_provider.size() == 2
+
+
+def test_storage_write_policy():
+    reset_calls()
+    read_only_provider = StorageCacheProvider(storage=FileStorage(tempfile.mkdtemp()), write_policy='never')
+    provider = StorageCacheProvider(storage=FileStorage(tempfile.mkdtemp()), provider=read_only_provider)
+    context = ExecutionContext(cache_provider=provider)
+    for i in range(2):
+        for _ in range(2):
+            assert context.execute(fun_a, i) == i
+    assert get_calls('a') == [{'a': i} for i in range(2)]
+    assert provider.size() == 2
+    assert read_only_provider.size() == 0
+    with raises(ValidationError):
+        StorageCacheProvider(storage=FileStorage(tempfile.mkdtemp()), write_policy='sometimes')
+
+
+def test_storage_recover():
+    reset_calls()
+    directory = tempfile.mkdtemp()
+    storage = FileStorage(directory)
+    context = ExecutionContext(cache_provider=StorageCacheProvider(storage=storage))
+    for i in range(3):
+        assert context.execute(fun_a, i) == i
+    assert storage.recover(grace_period=0) == []
+    truncated, orphaned = sorted(glob(os.path.join(directory, '**', '*.execution.pickle'), recursive=True))[:2]
+    with open(truncated, 'r+b') as f:
+        f.truncate(os.path.getsize(truncated) - 1)
+    os.remove(orphaned.replace('.execution.pickle', '.execution.ready'))
+    partial = storage.recover(grace_period=0)
+    assert len(partial) == 5
+    assert storage.recover(grace_period=0) == []
+    assert len(glob(os.path.join(directory, '.quarantine', '**', '*.quarantined'), recursive=True)) == 5
+    for i in range(3):
+        assert context.execute(fun_a, i) == i
+    assert len(get_calls('a')) == 5
+
+
+def test_storage_migration():
+    reset_calls()
+    directory = tempfile.mkdtemp()
+    storage = FileStorage(directory)
+    storage.write_info(layout=FileStorage.LAYOUT_FLAT)
+    context = ExecutionContext(cache_provider=StorageCacheProvider(storage=FileStorage(directory)))
+    for i in range(3):
+        assert context.execute(fun_a, i) == i
+    assert len(glob(os.path.join(directory, 'spiderpig', 'tests', 'test_execution', 'fun_a', '*.execution.ready'))) == 3
+    assert storage.migrate() == 3
+    assert storage.migrate() == 0
+    assert len(glob(os.path.join(directory, 'spiderpig', 'tests', 'test_execution', 'fun_a', '*', '*', '*.execution.ready'))) == 3
+    # the process which has read the flat layout before the migration
+    assert context.execute(fun_a, 3) == 3
+    assert len(glob(os.path.join(directory, 'spiderpig', 'tests', 'test_execution', 'fun_a', '*.execution.ready'))) == 0
+    context = ExecutionContext(cache_provider=StorageCacheProvider(storage=FileStorage(directory)))
+    for i in range(3):
+        assert context.execute(fun_a, i) == i
+    assert get_calls('a') == [{'a': i} for i in range(4)]
+
+
+def test_storage_stream():
+    del YIELDED[:]
+    Function(stream_fun).set_options(chunk_size=2)
+    storage = FileStorage(tempfile.mkdtemp())
+    context = ExecutionContext(cache_provider=InMemoryCacheProvider(provider=StorageCacheProvider(storage=storage)))
+    execution = context.create_execution(stream_fun, n=5)
+    # interrupted consumption
+    assert list(islice(context.execute(stream_fun, 5), 3)) == [0, 1, 2]
+    assert storage.count_execution_chunks(execution) == 1
+    assert not storage.is_execution_ready(execution)
+    assert storage.recover(grace_period=0) == []
+    # resumed
+    assert list(context.execute(stream_fun, 5)) == [0, 1, 2, 3, 4]
+    assert storage.count_execution_chunks(execution) == 3
+    assert storage.is_execution_ready(execution)
+    # replayed
+    del YIELDED[:]
+    stream = context.execute(stream_fun, 5)
+    assert not isinstance(stream, list)
+    assert list(stream) == [0, 1, 2, 3, 4]
+    assert YIELDED == []
+    assert storage.read_execution(execution).size > 0
+
+
+def test_storage_stream_consistency():
+    del YIELDED[:]
+    Function(stream_fun).set_options(chunk_size=2)
+    storage = FileStorage(tempfile.mkdtemp())
+    context = ExecutionContext(cache_provider=StorageCacheProvider(storage=storage))
+    execution = context.create_execution(stream_fun, n=5)
+    assert list(islice(context.execute(stream_fun, 5), 3)) == [0, 1, 2]
+    assert storage.count_execution_chunks(execution) == 1
+    # the chunks of another size are discarded
+    Function(stream_fun).set_options(chunk_size=3)
+    first = context.execute(stream_fun, 5)
+    assert next(first) == 0
+    # the stream being written by someone else is only computed
+    assert list(context.execute(stream_fun, 5)) == [0, 1, 2, 3, 4]
+    assert not storage.is_execution_ready(execution)
+    assert list(first) == [1, 2, 3, 4]
+    assert storage.count_execution_chunks(execution) == 2
+    assert storage.is_execution_ready(execution)
+    Function(stream_fun).set_options(chunk_size=2)
+
+
+def test_storage_with_removed_function():
+    module_dir = tempfile.mkdtemp()
+    with open(os.path.join(module_dir, 'spiderpig_removed_module.py'), 'w') as f:
+        f.write('def removed_fun(a):\n    return a\n')
+    sys.path.insert(0, module_dir)
+    try:
+        import spiderpig_removed_module
+        storage = FileStorage(tempfile.mkdtemp())
+        provider = StorageCacheProvider(storage=storage)
+        provider.prepare()
+        assert ExecutionContext(cache_provider=provider).execute(spiderpig_removed_module.removed_fun, 1) == 1
+    finally:
+        sys.path.remove(module_dir)
+        sys.modules.pop('spiderpig_removed_module', None)
+    shutil.rmtree(module_dir)
+    # the cache of the removed function does not prevent using the storage
+    provider = StorageCacheProvider(storage=FileStorage(storage.directory))
+    provider.prepare()
+    context = ExecutionContext(cache_provider=provider)
+    assert context.execute(fun_a, 1) == 1
+
+
+def test_storage_dependents():
+    storage = FileStorage(tempfile.mkdtemp())
+    dependency = Execution(fun_a, Configuration(), a=1)
+    storage.write_execution_result(dependency)
+    execution = Execution(slow_fun, Configuration(), a=2)
+    execution.add_dependency(dependency)
+    for _ in range(3):
+        storage.write_execution_result(execution)
+    filename = storage._get_execution_filename(dependency, 'execution.dependents')
+    with open(filename, 'r') as f:
+        assert f.read().split() == [execution.name]
+    storage.write_execution_result(dependency)
+    assert storage.is_execution_dirty(execution)
+
+
 def test_storage_with_recursion():
     reset_calls()
     storage = FileStorage(tempfile.mkdtemp())
@@ -82,3 +319,17 @@ def factorial(n):
     if n <= 1:
         return 1
     return n * factorial(n - 1)
+
+
+YIELDED = []
+
+
+def stream_fun(n):
+    for i in range(n):
+        YIELDED.append(i)
+        yield i
+
+
+def slow_fun(a):
+    sleep(0.05)
+    return a
@@ -0,0 +1,106 @@
+from multiprocessing import Process
+from spiderpig.daemon import Daemon, run_client, _receive, _send, _EXIT, _REQUEST
+from time import sleep
+import io
+import json
+import os
+import socket
+import spiderpig
+import spiderpig.commands as commands
+import spiderpig.commands.common as spcommon
+import spiderpig.config as config
+import tempfile
+
+
+def test_daemon():
+    cache_dir = tempfile.mkdtemp()
+    socket_path = os.path.join(cache_dir, 'daemon.sock')
+    daemon = Process(target=_serve, args=(cache_dir, socket_path))
+    daemon.start()
+    try:
+        for _ in range(100):
+            if os.path.exists(socket_path):
+                break
+            sleep(0.05)
+        assert run_client(socket_path, ['--spiderpig-dir', cache_dir, 'spiderpig-executions'], output=io.BytesIO()) == 0
+        output = io.BytesIO()
+        assert run_client(socket_path, ['--spiderpig-dir', cache_dir, 'spiderpig-gc', '--unknown'], output=output) == 2
+        assert b'unrecognized arguments' in output.getvalue()
+        assert run_client(socket_path, ['--spiderpig-dir', tempfile.mkdtemp(), 'spiderpig-gc'], output=io.BytesIO()) == 1
+        assert run_client(socket_path, ['--spiderpig-dir', cache_dir, '--override-cache', 'spiderpig-executions'], output=io.BytesIO()) == 1
+        # the failed requests do not kill the workers
+        for request in [b'{', json.dumps({'argv': [], 'cwd': os.path.join(cache_dir, 'missing')}).encode('utf-8')] * 2:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+                connection.connect(socket_path)
+                _send(connection, _REQUEST, request)
+                kind, payload = _receive(connection)
+                assert kind == _EXIT and json.loads(payload.decode('utf-8'))['code'] == 1
+        assert run_client(socket_path, ['--spiderpig-dir', cache_dir, 'spiderpig-executions'], output=io.BytesIO()) == 0
+    finally:
+        daemon.terminate()
+        daemon.join()
+    assert not os.path.exists(socket_path)
+
+
+def test_daemon_executions():
+    cache_dir = tempfile.mkdtemp()
+    socket_path = os.path.join(cache_dir, 'daemon.sock')
+    daemon = Process(target=_serve_in_execution, args=(cache_dir, socket_path))
+    daemon.start()
+    try:
+        for _ in range(100):
+            if os.path.exists(socket_path):
+                break
+            sleep(0.05)
+        assert run_client(socket_path, ['--spiderpig-dir', cache_dir, 'spiderpig-executions'], output=io.BytesIO()) == 0
+    finally:
+        daemon.terminate()
+        daemon.join()
+    with open(os.path.join(cache_dir, 'nested.json'), 'r') as f:
+        served = json.load(f)
+    spiderpig.init(tempfile.mkdtemp())
+    try:
+        spiderpig.execution_context().execute(_record_nested, use_cache=False, directory=tempfile.mkdtemp())
+    finally:
+        spiderpig.terminate()
+    assert served == _NESTED
+    assert served['value'] == 1
+
+
+def _serve(cache_dir, socket_path):
+    spiderpig.init(cache_dir)
+    parser = config.get_argument_parser()
+    commands.register_submodule_commands(parser.add_subparsers(), spcommon, namespace='spiderpig', argv=[])
+    Daemon(socket_path, parser, workers=2).serve_forever()
+
+
+_NESTED = {}
+
+
+def _serve_in_execution(cache_dir, socket_path):
+    spiderpig.init(cache_dir)
+    parser = config.get_argument_parser()
+    commands.register_submodule_commands(parser.add_subparsers(), spcommon, namespace='spiderpig', argv=[])
+    # as spiderpig-serve, the daemon runs inside an execution
+    spiderpig.execution_context().execute(_run_daemon, use_cache=False, socket_path=socket_path, parser=parser, workers=2)
+
+
+def _run_daemon(socket_path, parser, workers):
+    Daemon(socket_path, parser, [_record_setup], workers=workers).serve_forever()
+
+
+def _record_setup():
+    directory = spiderpig.storage().directory
+    spiderpig.execution_context().execute(_record_nested, use_cache=False, directory=directory)
+    with open(os.path.join(directory, 'nested.json'), 'w') as f:
+        json.dump(_NESTED, f)
+
+
+def _record_nested(directory):
+    _NESTED['kwargs'] = sorted(spiderpig.execution_context().resolve_kwargs(_nested))
+    _NESTED['value'] = spiderpig.execution_context().execute(_nested)
+    return _NESTED
+
+
+def _nested(workers=1):
+    return workers
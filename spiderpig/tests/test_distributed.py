@@ -0,0 +1,43 @@
+from multiprocessing import Process
+from pytest import raises
+from spiderpig.distributed import WorkQueue, Worker
+import spiderpig
+import tempfile
+
+
+def test_workers():
+    cache_dir = tempfile.mkdtemp()
+    with spiderpig.spiderpig(cache_dir):
+        tasks = [spiderpig.submit(dist_fun, i) for i in range(4)] + [spiderpig.submit(dist_failing)]
+        # the task of a dead worker is re-queued
+        WorkQueue(cache_dir).claim('dead-worker')
+        workers = [Process(target=_work, args=(cache_dir,)) for _ in range(2)]
+        for worker in workers:
+            worker.start()
+        assert [t.result(timeout=30, poll_interval=0.05) for t in tasks[:-1]] == [0, 2, 4, 6]
+        with raises(spiderpig.exceptions.TaskFailed):
+            tasks[-1].result(timeout=30, poll_interval=0.05)
+        for worker in workers:
+            worker.join()
+        assert spiderpig.execution_context().count_executions(dist_fun) == 0
+        # the missing (or invalidated) result is not computed locally
+        spiderpig.storage().invalidate([tasks[0].task_id])
+        with raises(spiderpig.exceptions.TaskFailed):
+            tasks[0].result(timeout=30, poll_interval=0.05)
+        assert spiderpig.execution_context().count_executions(dist_fun) == 0
+        assert WorkQueue(cache_dir).size() == 0
+
+
+def _work(cache_dir):
+    spiderpig.init(cache_dir)
+    Worker(WorkQueue(cache_dir), lease_timeout=0.5, heartbeat_interval=0.1, poll_interval=0.05).run(idle_timeout=1)
+
+
+@spiderpig.cached()
+def dist_fun(a):
+    return 2 * a
+
+
+@spiderpig.cached()
+def dist_failing():
+    raise ValueError('failed')
@@ -1,8 +1,10 @@
 from pytest import raises
 from spiderpig.config import Configuration
 from spiderpig.exceptions import ValidationError
-from spiderpig.execution import Function, ExecutionContext, Execution
+from spiderpig.execution import Function, ExecutionContext, Execution, Locker
 from spiderpig.func import function_name
+from threading import Thread
+from time import sleep
 
 
 def test_function():
@@ -21,10 +23,30 @@ def test_function():
     assert fun.raw_function is function_name
     s_fun = Function.from_serializable(fun.to_serializable())
     assert s_fun == fun
+    assert not s_fun.code_changed
+    assert fun.code_fingerprint != dep_fun.code_fingerprint
     with raises(ImportError):
         Function.from_name('aaa.bbb')
 
 
+def test_configuration():
+    parent = Configuration(a=1, b='2')
+    configuration = Configuration(parent, b=3, c='True')
+    assert configuration['a'] == 1
+    assert configuration['b'] == 3
+    assert configuration['c'] is True
+    assert parent['b'] == 2
+    assert 'c' not in parent
+    with raises(KeyError):
+        configuration['d']
+    with raises(ValidationError):
+        configuration[1]
+    serializable = configuration.to_serializable()
+    assert serializable == {'kwargs': {'a': 1, 'b': 3, 'c': True}}
+    assert Configuration.from_serializable(serializable).to_serializable() == serializable
+    assert Configuration.from_serializable({'kwargs': {'b': 3}, 'configuration': {'kwargs': {'a': 1}}}).to_serializable() == {'kwargs': {'a': 1, 'b': 3}}
+
+
 def test_execution():
     reset_calls()
     execution = Execution(fun_a, Configuration(), a=1)
@@ -48,6 +70,43 @@ def test_execution_context():
         context.execute(fun_a, 1, a=2)
 
 
+def test_lock_statistics():
+    locker = Locker(wait_warning=0)
+    execution = Execution(fun_a, Configuration(), a=1)
+    with locker.lock():
+        pass
+    with locker.lock(execution):
+        pass
+    held = locker.lock(execution)
+
+    def hold():
+        with held:
+            sleep(0.1)
+    holder = Thread(target=hold)
+    holder.start()
+    sleep(0.05)
+    with locker.lock(execution):
+        pass
+    holder.join()
+    statistics = {s.kind: s for s in locker.statistics()}
+    assert statistics[Locker.LOCK_GLOBAL].acquisitions == 1
+    assert statistics[Locker.LOCK_GLOBAL].contended == 0
+    assert statistics[Locker.LOCK_EXECUTION].acquisitions == 3
+    assert statistics[Locker.LOCK_EXECUTION].contended == 1
+    assert statistics[Locker.LOCK_EXECUTION].max_wait_time > 0.02
+    assert statistics[Locker.LOCK_EXECUTION].hold_time > 0.1
+    assert locker.statistics()[0].kind == Locker.LOCK_EXECUTION
+    locker.print_report()
+    locker = Locker(max_statistics=2)
+    for i in range(5):
+        with locker.lock(Execution(fun_a, Configuration(), a=i)):
+            pass
+    statistics = locker.statistics(Locker.LOCK_EXECUTION)
+    assert len(statistics) == 3
+    assert sum(s.acquisitions for s in statistics) == 5
+    assert [s.acquisitions for s in statistics if s.name is None] == [3]
+
+
 _CALLS = {}
 
 
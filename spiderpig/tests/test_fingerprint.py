@@ -0,0 +1,139 @@
+from pytest import importorskip, raises
+from spiderpig import fingerprint as fp
+import datetime
+
+
+class Fingerprinted:
+
+    def __init__(self, value, ignored):
+        self.value = value
+        self.ignored = ignored
+
+    def fingerprint(self):
+        return self.value
+
+
+class Plain:
+
+    def __init__(self, value):
+        self.value = value
+
+
+def test_canonical():
+    assert fp.fingerprint({'a': 1, 'b': 2}) == fp.fingerprint({'b': 2, 'a': 1})
+    assert fp.fingerprint({1: 'a', 'b': 2}) == fp.fingerprint({'b': 2, 1: 'a'})
+    assert fp.fingerprint([1, 2]) == fp.fingerprint((1, 2))
+    assert fp.fingerprint({3, 1, 2}) == fp.fingerprint({1, 2, 3})
+    assert fp.fingerprint([1, 2]) != fp.fingerprint([2, 1])
+    assert fp.fingerprint(1) != fp.fingerprint('1')
+    assert fp.fingerprint(True) != fp.fingerprint(1)
+    assert fp.fingerprint('ab', 'c') != fp.fingerprint('a', 'bc')
+    assert fp.fingerprint(b'ab') == fp.fingerprint(bytearray(b'ab'))
+    assert len(fp.fingerprint(None)) == 2 * fp.DIGEST_SIZE
+
+
+def test_objects():
+    assert fp.fingerprint(Fingerprinted(1, 'a')) == fp.fingerprint(Fingerprinted(1, 'b'))
+    assert fp.fingerprint(Fingerprinted(1, 'a')) != fp.fingerprint(Fingerprinted(2, 'a'))
+    assert fp.fingerprint(Plain(1)) == fp.fingerprint(Plain(1))
+    assert fp.fingerprint(Plain(1)) != fp.fingerprint(Plain(2))
+    with raises(TypeError):
+        fp.fingerprint(object())
+
+
+def test_large_values():
+    value = 'x' * fp.CACHE_MIN_BYTES
+    first = fp.fingerprint(value)
+    assert fp._CACHE[id(value)][0] is value
+    assert fp.fingerprint(value) == first
+    assert fp.fingerprint(value[:-1] + 'y') != first
+    small = 'x' * (2 * fp.LARGE_SIZE)
+    assert fp.fingerprint(small) == fp.fingerprint('x' * (2 * fp.LARGE_SIZE))
+    assert id(small) not in fp._CACHE
+    assert fp._CACHE_BYTES <= fp.CACHE_MAX_BYTES
+    items = list(range(2 * fp.LARGE_SIZE))
+    assert fp.fingerprint(items) == fp.fingerprint(tuple(items))
+    assert id(items) not in fp._CACHE
+    plain = Plain(1)
+    values = tuple([plain] * fp.CACHE_MIN_BYTES)
+    first = fp.fingerprint(values)
+    assert id(values) not in fp._CACHE
+    plain.value = 2
+    assert fp.fingerprint(values) != first
+
+
+def test_dates():
+    assert fp.fingerprint(datetime.date(2020, 1, 1)) == fp.fingerprint(datetime.date(2020, 1, 1))
+    assert fp.fingerprint(datetime.date(2020, 1, 1)) != fp.fingerprint(datetime.date(2020, 1, 2))
+    assert fp.fingerprint(datetime.date(2020, 1, 1)) != fp.fingerprint(datetime.datetime(2020, 1, 1))
+    assert fp.fingerprint(datetime.date(2020, 1, 1)) != fp.fingerprint('2020-01-01')
+    assert fp.fingerprint(datetime.datetime(2020, 1, 1, 12)) != fp.fingerprint(datetime.datetime(2020, 1, 1, 12, tzinfo=datetime.timezone.utc))
+    assert fp.fingerprint(datetime.time(12)) != fp.fingerprint(datetime.time(13))
+    assert fp.fingerprint(datetime.timedelta(days=1)) == fp.fingerprint(datetime.timedelta(hours=24))
+    assert fp.fingerprint(datetime.timedelta(days=1)) != fp.fingerprint(datetime.timedelta(days=2))
+
+
+def test_register_handler():
+    class Custom:
+        pass
+    fp.register_handler(Custom, lambda hasher, obj: hasher.update(b'custom'))
+    assert fp.fingerprint(Custom()) == fp.fingerprint(Custom())
+
+
+def test_numpy():
+    np = importorskip('numpy')
+    array = np.arange(1000, dtype=np.float64).reshape(100, 10)
+    assert fp.fingerprint(array) == fp.fingerprint(array.copy())
+    assert fp.fingerprint(array) == fp.fingerprint(np.asfortranarray(array))
+    assert fp.fingerprint(array[::2]) == fp.fingerprint(array[::2].copy())
+    assert fp.fingerprint(array) != fp.fingerprint(array.astype(np.float32))
+    assert fp.fingerprint(array) != fp.fingerprint(array.reshape(10, 100))
+    assert fp.fingerprint(np.array(['a', None], dtype=object)) == fp.fingerprint(np.array(['a', None], dtype=object))
+    assert fp.fingerprint(np.array(['2020-01-01'], dtype='M8[D]')) != fp.fingerprint(np.array(['2020-01-02'], dtype='M8[D]'))
+    assert fp.fingerprint(np.float64(0.5)) == fp.fingerprint(0.5)
+    assert fp.fingerprint(np.int64(3)) == fp.fingerprint(3)
+
+
+def test_numpy_cache():
+    np = importorskip('numpy')
+    frozen = np.zeros(1000)
+    frozen.flags.writeable = False
+    first = fp.fingerprint(frozen)
+    assert fp._TRACKED[id(frozen)].digest is not None
+    assert fp.fingerprint(frozen) == first
+    frozen.flags.writeable = True
+    frozen[0] = 1
+    assert fp.fingerprint(frozen) != first
+    assert id(frozen) not in fp._TRACKED
+    view = np.zeros(1000)[:]
+    view.flags.writeable = False
+    fp.fingerprint(view)
+    assert id(view) not in fp._TRACKED
+
+    array = np.zeros(1000)
+    fp.track(array)
+    first = fp.fingerprint(array)
+    array[0] = 1
+    assert fp.fingerprint(array) == first
+    fp.modified(array)
+    assert fp.fingerprint(array) != first
+    key = id(array)
+    del array
+    assert key not in fp._TRACKED
+
+
+def test_pandas():
+    pd = importorskip('pandas')
+    frame = pd.DataFrame({'a': [1, 2, 3], 'b': ['x', 'y', 'z']})
+    assert fp.fingerprint(frame) == fp.fingerprint(frame.copy())
+    assert fp.fingerprint(frame) != fp.fingerprint(frame.set_index('a'))
+    assert fp.fingerprint(frame) != fp.fingerprint(frame.rename(columns={'b': 'c'}))
+    assert fp.fingerprint(frame['a']) == fp.fingerprint(frame['a'].copy())
+    assert fp.fingerprint(frame['a']) != fp.fingerprint(frame['a'].rename('c'))
+    dates = pd.Series(pd.date_range('2020-01-01', periods=3, tz='UTC'))
+    assert fp.fingerprint(dates) == fp.fingerprint(dates.copy())
+    fp.track(frame)
+    first = fp.fingerprint(frame)
+    frame.loc[0, 'a'] = 10
+    fp.modified(frame)
+    assert fp.fingerprint(frame) != first
@@ -0,0 +1,70 @@
+from spiderpig.cache import FileStorage
+from spiderpig.packed import PackedFileStorage, REFRESH_INTERVAL
+import os
+import spiderpig
+import tempfile
+
+
+def test_packed_storage():
+    cache_dir = tempfile.mkdtemp()
+    with spiderpig.spiderpig(cache_dir, packed_storage=True):
+        for i in range(10):
+            assert packed_dependent_fun(i) == 2 * i + 1
+        assert packed_fun(20000) == 'x' * 20000
+        # another process sees the records
+        other = PackedFileStorage(cache_dir)
+        assert sum(1 for _ in other.read_executions()) == 21
+        # only the large result and indices of dependents have their own files
+        assert len(_files(cache_dir, '.execution.ready')) == 1
+        execution = spiderpig.execution_context().create_execution(packed_fun, n=3)
+        other.delete_execution_result(execution)
+        # the found records are trusted until the index is refreshed
+        spiderpig.storage()._refresh_time -= REFRESH_INTERVAL
+        assert not spiderpig.storage().is_execution_ready(execution)
+        assert spiderpig.storage().is_execution_dirty(spiderpig.execution_context().create_execution(packed_dependent_fun, n=3))
+        assert other.read_execution_result(spiderpig.execution_context().create_execution(packed_fun, n=4)) == 'x' * 4
+        # the segment which is still written can not be compacted
+        compacted, reclaimed = other.compact(min_dead_ratio=0)
+        assert compacted == 1
+    compacted, reclaimed = other.compact(min_dead_ratio=0)
+    assert compacted == 2 and reclaimed > 0
+    assert len(_files(cache_dir, '.segment')) == 1
+    with spiderpig.spiderpig(cache_dir):
+        assert isinstance(spiderpig.storage(), PackedFileStorage)
+        assert packed_fun(7) == 'x' * 7
+        assert packed_dependent_fun(3) == 7
+        assert spiderpig.execution_context().count_executions(packed_fun, n=7) == 0
+        assert spiderpig.execution_context().count_executions(packed_fun, n=3) == 1
+        assert sum(1 for _ in spiderpig.storage().read_executions()) == 21
+
+
+def test_packed_flat_storage():
+    cache_dir = tempfile.mkdtemp()
+    FileStorage(cache_dir).write_info(layout=FileStorage.LAYOUT_FLAT)
+    with spiderpig.spiderpig(cache_dir, packed_storage=True):
+        for i in range(3):
+            assert packed_fun(i) == 'x' * i
+        # the results are not packed until the cache is migrated
+        assert len(_files(cache_dir, '.segment')) == 0
+        assert len(_files(cache_dir, '.execution.ready')) == 3
+        spiderpig.storage().migrate()
+        assert packed_fun(3) == 'x' * 3
+        assert len(_files(cache_dir, '.segment')) == 1
+    with spiderpig.spiderpig(cache_dir):
+        for i in range(4):
+            assert packed_fun(i) == 'x' * i
+        assert sum(spiderpig.execution_context().count_executions(packed_fun, n=i) for i in range(4)) == 0
+
+
+@spiderpig.cached()
+def packed_fun(n):
+    return 'x' * n
+
+
+@spiderpig.cached()
+def packed_dependent_fun(n):
+    return len(packed_fun(n)) * 2 + 1
+
+
+def _files(directory, suffix):
+    return [os.path.join(root, f) for root, _, files in os.walk(directory) for f in files if f.endswith(suffix)]
@@ -0,0 +1,63 @@
+from spiderpig.cache import FileStorage
+from spiderpig.commands.common import profiles
+from spiderpig.execution import Function
+from glob import glob
+import cProfile
+import marshal
+import os
+import spiderpig
+import tempfile
+import tracemalloc
+
+
+def test_profiling():
+    cache_dir = tempfile.mkdtemp()
+    with spiderpig.spiderpig(cache_dir, profile_functions=['test_profiling.profiled_*']):
+        assert profiled_fun(1000) == 1000
+        assert not_profiled_fun() == 1
+        spiderpig.invalidate_function(profiled_fun)
+        assert profiled_fun(1000) == 1000
+        stored = spiderpig.storage().read_profiles(Function(profiled_fun))
+        assert len(stored) == 2
+        assert stored[0]['started'] > stored[1]['started']
+        assert stored[0]['peak_memory'] >= 1000 * 1000
+        with open(stored[0]['stats_filename'], 'rb') as f:
+            assert any(name == 'allocate' for (_, _, name) in marshal.load(f))
+        assert len(spiderpig.storage().read_profiles(Function(not_profiled_fun))) == 0
+        profiles.execute('test_profiling.profiled_fun', diff=True)
+
+
+def test_profiling_migration():
+    cache_dir = tempfile.mkdtemp()
+    FileStorage(cache_dir).write_info(layout=FileStorage.LAYOUT_FLAT)
+    with spiderpig.spiderpig(cache_dir, profile_functions=['test_profiling.profiled_*']):
+        assert profiled_fun(10) == 10
+        assert spiderpig.storage().migrate() == 1
+        assert len(spiderpig.storage().read_profiles(Function(profiled_fun))) == 1
+    function_directory = os.path.join(cache_dir, 'test_profiling', 'profiled_fun')
+    assert len(glob(os.path.join(function_directory, '*.profile.*'))) == 0
+    assert len(glob(os.path.join(function_directory, '*', '*', '*.profile.*'))) == 2
+
+
+def test_profiling_collision(monkeypatch):
+    def enable(self):
+        raise ValueError('Another profiling tool is already active')
+    monkeypatch.setattr(cProfile.Profile, 'enable', enable)
+    with spiderpig.spiderpig(tempfile.mkdtemp(), profile_functions=['test_profiling.profiled_*']):
+        assert profiled_fun(10) == 10
+        assert len(spiderpig.storage().read_profiles(Function(profiled_fun))) == 0
+    assert not tracemalloc.is_tracing()
+
+
+@spiderpig.cached()
+def profiled_fun(n):
+    return len(allocate(n))
+
+
+@spiderpig.cached()
+def not_profiled_fun():
+    return 1
+
+
+def allocate(n):
+    return [bytes(1000) for _ in range(n)]
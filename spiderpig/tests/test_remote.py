@@ -0,0 +1,107 @@
+from spiderpig.cache import FileStorage, StorageCacheProvider
+from spiderpig.execution import ExecutionContext, Function
+from spiderpig.remote import CacheServer, RemoteCacheClient, RemoteCacheProvider
+from spiderpig.tests.test_execution import reset_calls, get_calls, fun_a
+from threading import Thread
+import tempfile
+
+
+def test_client():
+    server = _start_server()
+    try:
+        client = RemoteCacheClient(server.url)
+        assert client.get('a.b') is None
+        client.put('a.b', b'data')
+        assert client.get('a.b') == b'data'
+        assert client.exists(['a.b', 'a.c', '../a.b']) == [True, False, False]
+        assert client.size() == 1
+        client.put('a.b.c', b'data')
+        client.put('a.bc', b'data')
+        client.delete('a.b')
+        assert client.exists(['a.b', 'a.b.c', 'a.bc']) == [False, False, True]
+        client.close()
+    finally:
+        server.shutdown()
+
+
+def test_remote_tier():
+    reset_calls()
+    server = _start_server()
+    try:
+        providers = [
+            StorageCacheProvider(
+                storage=FileStorage(tempfile.mkdtemp()),
+                provider=RemoteCacheProvider(RemoteCacheClient(server.url)),
+            )
+            for _ in range(2)
+        ]
+        for provider in providers:
+            context = ExecutionContext(cache_provider=provider)
+            for i in range(2):
+                assert context.execute(fun_a, i) == i
+        assert get_calls('a') == [{'a': i} for i in range(2)]
+        assert providers[1].size() == 2
+        assert providers[1].provider.size() == 2
+    finally:
+        server.shutdown()
+
+
+def test_remote_invalidation():
+    reset_calls()
+    server = _start_server()
+    try:
+        client = RemoteCacheClient(server.url)
+        providers = [
+            StorageCacheProvider(storage=FileStorage(tempfile.mkdtemp()), provider=RemoteCacheProvider(client))
+            for _ in range(3)
+        ]
+        contexts = [ExecutionContext(cache_provider=provider) for provider in providers]
+        for i in range(2):
+            assert contexts[0].execute(fun_a, i) == i
+        providers[0].invalidate(executions=[contexts[0].create_execution(fun_a, a=0)])
+        for i in range(2):
+            assert contexts[1].execute(fun_a, i) == i
+        assert get_calls('a') == [{'a': 0}, {'a': 1}, {'a': 0}]
+        providers[1].invalidate(function=Function(fun_a))
+        assert client.size() == 0
+        assert contexts[2].execute(fun_a, 1) == 1
+        assert get_calls('a') == [{'a': 0}, {'a': 1}, {'a': 0}, {'a': 1}]
+    finally:
+        server.shutdown()
+
+
+def test_remote_code_change():
+    reset_calls()
+    server = _start_server()
+    function = Function(fun_a)
+    code_fingerprint = function.code_fingerprint
+    try:
+        context = ExecutionContext(cache_provider=RemoteCacheProvider(RemoteCacheClient(server.url)))
+        assert context.execute(fun_a, 1) == 1
+        assert context.execute(fun_a, 1) == 1
+        Function._code_fingerprints[function.name] = 'changed'
+        assert context.execute(fun_a, 1) == 1
+        assert get_calls('a') == [{'a': 1}, {'a': 1}]
+    finally:
+        Function._code_fingerprints[function.name] = code_fingerprint
+        server.shutdown()
+
+
+def test_unavailable_remote_tier():
+    reset_calls()
+    server = _start_server()
+    url = server.url
+    server.shutdown()
+    server.server_close()
+    provider = RemoteCacheProvider(RemoteCacheClient(url, timeout=1))
+    context = ExecutionContext(cache_provider=provider)
+    assert context.execute(fun_a, 1) == 1
+    assert get_calls('a') == [{'a': 1}]
+    assert not provider.is_valid_cache(context.create_execution(fun_a, a=1))
+    assert provider.invalidate(function=Function(fun_a)) == set()
+
+
+def _start_server():
+    server = CacheServer(tempfile.mkdtemp())
+    Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,91 @@
+from spiderpig.resources import ResourceBudget
+from threading import Lock
+from time import sleep
+import json
+import os
+import pytest
+import spiderpig
+import subprocess
+import sys
+import tempfile
+
+
+def test_budget():
+    directory = tempfile.mkdtemp()
+    budget = ResourceBudget(directory, capacity={'memory_gb': 8, 'cpu': 4})
+    # another process on the same host
+    other = ResourceBudget(directory, capacity={'memory_gb': 8, 'cpu': 4})
+    token = budget.acquire({'memory_gb': 6})
+    assert other.acquire({'memory_gb': 4}, wait=False) is None
+    small = other.acquire({'memory_gb': 2, 'cpu': 4}, wait=False)
+    assert other.in_use() == {'memory_gb': 8, 'cpu': 4}
+    budget.release(token)
+    other.release(small)
+    # the execution larger than the budget runs alone
+    with budget.admitted({'memory_gb': 16}):
+        assert other.acquire({'memory_gb': 1}, wait=False) is None
+    # a waiting execution with a higher priority goes first
+    budget_file = [f for f in os.listdir(directory) if f.endswith('.json')][0]
+    token = budget.acquire({'memory_gb': 4})
+    with open(os.path.join(directory, budget_file), 'r') as f:
+        state = json.load(f)
+    state['waiters']['waiting'] = {'pid': os.getpid(), 'demand': {'memory_gb': 2}, 'priority': 10, 'since': 0}
+    with open(os.path.join(directory, budget_file), 'w') as f:
+        json.dump(state, f)
+    assert other.acquire({'memory_gb': 2}, priority=1, wait=False) is None
+    # the tokens of processes which have died are returned
+    dead = subprocess.Popen([sys.executable, '-c', 'pass'])
+    dead.wait()
+    with open(os.path.join(directory, budget_file), 'r') as f:
+        state = json.load(f)
+    state['waiters'] = {}
+    state['holders']['dead'] = {'pid': dead.pid, 'demand': {'memory_gb': 4}}
+    with open(os.path.join(directory, budget_file), 'w') as f:
+        json.dump(state, f)
+    other.release(other.acquire({'memory_gb': 4}, wait=False))
+    budget.release(token)
+    assert other.in_use() == {}
+
+
+def test_resources_annotation():
+    with pytest.raises(spiderpig.ValidationError):
+        spiderpig.cached(resources={'gpu': 1})
+    cache_dir = tempfile.mkdtemp()
+    with spiderpig.spiderpig(cache_dir, host_resources={'memory_gb': 8}):
+        results = spiderpig.execution_context().execute_many(heavy_fun.__wrapped__, [{'n': n} for n in range(4)], workers=4)
+        assert results == list(range(4))
+        assert _RUNNING['max'] == 1
+        assert allocating_fun() == 64 << 20
+    stored = list(spiderpig.storage().read_executions(spiderpig.execution.Function(allocating_fun)))
+    assert len(stored) == 1 and stored[0].memory >= 32 << 20
+    assert os.path.exists(os.path.join(cache_dir, '.resources'))
+
+
+def test_resources_not_used(monkeypatch):
+    monkeypatch.setattr(spiderpig.resources, 'is_annotated', lambda: False)
+    cache_dir = tempfile.mkdtemp()
+    with spiderpig.spiderpig(cache_dir):
+        assert spiderpig.execution_context().scheduler is None
+        assert allocating_fun() == 64 << 20
+    assert not os.path.exists(os.path.join(cache_dir, '.resources'))
+
+
+_RUNNING = {'now': 0, 'max': 0, 'lock': Lock()}
+
+
+@spiderpig.cached(resources={'memory_gb': 6})
+def heavy_fun(n):
+    with _RUNNING['lock']:
+        _RUNNING['now'] += 1
+        _RUNNING['max'] = max(_RUNNING['max'], _RUNNING['now'])
+    sleep(0.1)
+    with _RUNNING['lock']:
+        _RUNNING['now'] -= 1
+    return n
+
+
+@spiderpig.cached()
+def allocating_fun():
+    data = b'x' * (64 << 20)
+    sleep(0.2)
+    return len(data)
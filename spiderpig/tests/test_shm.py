@@ -0,0 +1,72 @@
+from spiderpig.cache import FileStorage, StorageCacheProvider
+from spiderpig.execution import ExecutionContext
+from pytest import importorskip, raises
+from spiderpig.remote import RemoteCacheClient, RemoteCacheProvider
+from spiderpig.shm import SharedMemoryCacheProvider
+from spiderpig.tests.test_remote import _start_server
+import spiderpig
+import tempfile
+
+
+numpy = importorskip('numpy')
+
+
+def test_shared_memory():
+    cache_dir = tempfile.mkdtemp()
+    providers = [
+        SharedMemoryCacheProvider(cache_dir, provider=StorageCacheProvider(storage=FileStorage(cache_dir)), min_size=0, max_bytes=1 << 20)
+        for _ in range(2)
+    ]
+    try:
+        contexts = [ExecutionContext(cache_provider=provider) for provider in providers]
+        assert (contexts[0].execute(array_fun, 10) == numpy.arange(10)).all()
+        assert contexts[0].execute(small_fun) == 'small'
+        assert providers[1].size() == 1
+        shared = contexts[1].execute(array_fun, 10)
+        assert (shared == numpy.arange(10)).all()
+        assert not shared.flags.writeable
+        assert contexts[1].count_executions(array_fun, n=10) == 0
+        # invalidation through the storage is seen by all processes
+        providers[1].invalidate([contexts[1].create_execution(array_fun, n=10)])
+        assert not providers[0].is_valid_cache(contexts[0].create_execution(array_fun, n=10))
+        # eviction
+        for n in range(40000, 40004):
+            contexts[0].execute(array_fun, n)
+        assert 0 < providers[1].size() < 4
+    finally:
+        providers[0].unlink()
+
+
+def test_shared_memory_remote_tier():
+    server = _start_server()
+    client = RemoteCacheClient(server.url)
+    namespace = tempfile.mkdtemp()
+    providers = [
+        SharedMemoryCacheProvider(namespace, provider=RemoteCacheProvider(client), min_size=0, max_bytes=1 << 20)
+        for _ in range(2)
+    ]
+    try:
+        contexts = [ExecutionContext(cache_provider=provider) for provider in providers]
+        contexts[0].execute(array_fun, 10)
+        contexts[1].execute(array_fun, 10)
+        assert contexts[1].count_executions(array_fun, n=10) == 0
+        # invalidated by another node through the remote cache
+        client.delete(contexts[0].create_execution(array_fun, n=10).name)
+        assert (contexts[0].execute(array_fun, 10) == numpy.arange(10)).all()
+        assert contexts[0].count_executions(array_fun, n=10) == 2
+    finally:
+        providers[0].unlink()
+        server.shutdown()
+
+
+def test_shared_memory_needs_directory():
+    with raises(spiderpig.ValidationError):
+        spiderpig.init(shared_memory_bytes=1 << 20)
+
+
+def array_fun(n):
+    return numpy.arange(n)
+
+
+def small_fun():
+    return 'small'